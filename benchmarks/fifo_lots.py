@@ -0,0 +1,133 @@
+"""Pathological FIFO matching: thousands of small buys followed by a few large sells.
+
+Compares the former lot queue (a list of dicts consumed with list.pop(0), which
+shifts every remaining lot on each pop) with finance.ledger.fifo_replay (a deque
+of __slots__ Lot objects). Both must produce identical gains.
+
+    python benchmarks/fifo_lots.py --sizes 10000 50000 100000 200000 --sells 4
+"""
+import argparse
+import time
+import tracemalloc
+from collections import deque, namedtuple
+from datetime import date, timedelta
+from decimal import Decimal
+
+from _support import setup_django, teardown_django
+
+
+Row = namedtuple('Row', 'id transaction_type trade_date quantity price fees')
+
+
+def pathological_rows(size, sells):
+    start = date(2010, 1, 1)
+    rows = [
+        Row(index, 'buy', start + timedelta(days=index // 50), Decimal('1.5'), Decimal('10.0000') + index % 7, Decimal('0.10'))
+        for index in range(1, size + 1)
+    ]
+    chunk = Decimal(size) * Decimal('1.5') / sells
+    sell_date = rows[-1].trade_date + timedelta(days=1)
+    rows.extend(
+        Row(size + index, 'sell', sell_date, chunk, Decimal('12.0000'), Decimal('5.00'))
+        for index in range(1, sells + 1)
+    )
+    return rows
+
+
+def list_replay(transactions, lots):
+    """The lot queue as it was: dicts in a list, consumed with pop(0)."""
+    from finance.ledger import AMOUNT_QUANTUM, UNIT_COST_QUANTUM
+
+    gains = []
+    for transaction in transactions:
+        if transaction.transaction_type == 'buy':
+            total_cost = transaction.quantity * transaction.price + transaction.fees
+            lots.append({
+                'buy_transaction_id': transaction.id,
+                'trade_date': transaction.trade_date,
+                'quantity': transaction.quantity,
+                'unit_cost': (total_cost / transaction.quantity).quantize(UNIT_COST_QUANTUM),
+                'transaction': transaction,
+            })
+            continue
+
+        quantity_to_sell = transaction.quantity
+        cost_basis = Decimal('0')
+        allocations = []
+        while quantity_to_sell > 0 and lots:
+            lot = lots[0]
+            consumed_quantity = min(quantity_to_sell, lot['quantity'])
+            cost_basis += consumed_quantity * lot['unit_cost']
+            lot['quantity'] -= consumed_quantity
+            quantity_to_sell -= consumed_quantity
+            allocations.append({
+                'buy_transaction_id': lot['buy_transaction_id'],
+                'trade_date': lot['trade_date'].isoformat(),
+                'quantity': str(consumed_quantity),
+                'unit_cost': str(lot['unit_cost']),
+            })
+            if lot['quantity'] <= 0:
+                lots.pop(0)
+
+        proceeds = transaction.quantity * transaction.price - transaction.fees
+        cost_basis = cost_basis.quantize(AMOUNT_QUANTUM)
+        gains.append({
+            'sell_transaction_id': transaction.id,
+            'trade_date': transaction.trade_date,
+            'quantity': transaction.quantity,
+            'proceeds': proceeds.quantize(AMOUNT_QUANTUM),
+            'cost_basis': cost_basis,
+            'gain': (proceeds - cost_basis).quantize(AMOUNT_QUANTUM),
+            'allocations': allocations,
+        })
+    return gains
+
+
+def measure(replay, rows, lots):
+    started = time.perf_counter()
+    gains = replay(rows, lots)
+    return gains, time.perf_counter() - started
+
+
+def lot_memory(replay, rows, lots):
+    """Bytes held by the lot queue once every buy is queued."""
+    buys = [row for row in rows if row.transaction_type == 'buy']
+    tracemalloc.start()
+    replay(buys, lots)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return allocated
+
+
+def run(sizes, sells):
+    from finance.ledger import fifo_replay
+
+    print(f'{"buys":>8} {"list.pop(0) [s]":>15} {"deque [s]":>10} {"speed-up":>9} {"dict lots [MB]":>14} {"slot lots [MB]":>14}')
+    for size in sizes:
+        rows = pathological_rows(size, sells)
+        before, before_elapsed = measure(list_replay, rows, [])
+        after, after_elapsed = measure(fifo_replay, rows, deque())
+        assert before == after
+        before_memory = lot_memory(list_replay, rows, []) / 2**20
+        after_memory = lot_memory(fifo_replay, rows, deque()) / 2**20
+        print(
+            f'{size:>8} {before_elapsed:>15.2f} {after_elapsed:>10.2f} {before_elapsed / after_elapsed:>8.1f}x '
+            f'{before_memory:>14.1f} {after_memory:>14.1f}'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 50_000, 100_000, 200_000])
+    parser.add_argument('--sells', type=int, default=4)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        run(args.sizes, args.sells)
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Per-call latency of urllib.urlopen versus the pooled keep-alive HTTPSession.
+
+The local server sleeps --handshake seconds once per new connection (standing
+in for TCP + TLS setup) and --latency seconds per request. urlopen pays the
+handshake on every call; the pool pays it once. Pass --url to measure a real
+provider endpoint instead (e.g. https://stooq.pl/q/l/?s=kru.pl&f=sd2t2ohlcv&h&e=csv).
+
+    python benchmarks/http_pool.py --calls 50 --handshake 0.03
+"""
+import argparse
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import urlopen
+
+from _support import setup_django, teardown_django
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    handshake = 0.03
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        time.sleep(self.handshake)
+        super().setup()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        body = b'Symbol,Date,Time,Open,High,Low,Close,Volume\nKRU.PL,2026-01-02,17:00,480,486,478,484.2,1000\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def measure(label, calls, fetch):
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        fetch()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f'{label:>12} {statistics.mean(timings):>9.2f} {statistics.median(timings):>9.2f} {p95:>9.2f}')
+    return statistics.mean(timings)
+
+
+def run(calls, handshake, latency, url):
+    from finance.http_pool import HTTPSession
+
+    server = None
+    if not url:
+        KeepAliveHandler.handshake = handshake
+        KeepAliveHandler.latency = latency
+        server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}/q/l/?s=kru.pl'
+
+    def fetch_urlopen():
+        with urlopen(url, timeout=12) as response:
+            response.read()
+
+    session = HTTPSession()
+
+    def fetch_pooled():
+        with session.request('GET', url) as response:
+            response.read()
+
+    print(f'{"client":>12} {"mean [ms]":>9} {"p50 [ms]":>9} {"p95 [ms]":>9}')
+    before = measure('urlopen', calls, fetch_urlopen)
+    after = measure('HTTPSession', calls, fetch_pooled)
+    stats = session.stats()
+    print(f'connections opened: {stats["opened"]}, reused: {stats["reused"]}, speed-up: {before / after:.1f}x')
+
+    session.clear()
+    if server is not None:
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=50)
+    parser.add_argument('--handshake', type=float, default=0.03)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--url', default='')
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        run(args.calls, args.handshake, args.latency, args.url)
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Wall-clock benchmark of refresh_market_data_for_user against a local fake provider.
+
+Every request to the fake server sleeps for --latency seconds, so a sequential
+refresh costs roughly (requests x latency). With the concurrent pipeline the
+wall-clock time should grow much slower than the instrument count.
+
+    python benchmarks/market_refresh.py --sizes 5 10 20 40 --latency 0.05
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from _support import setup_django, teardown_django
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.05
+    request_count = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count_and_wait(self):
+        with self.lock:
+            FakeProviderHandler.request_count += 1
+        time.sleep(self.latency)
+
+    def _send(self, body, content_type):
+        payload = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        self._count_and_wait()
+        jobs = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        results = [{
+            'data': [{
+                'ticker': f"T{job['idValue'][-6:]}",
+                'name': f"Spółka {job['idValue']}",
+                'isin': job['idValue'],
+                'marketSector': 'Equity',
+                'securityType2': 'Common Stock',
+                'exchCode': 'PW',
+                'micCode': 'XWAR',
+            }],
+        } for job in jobs]
+        self._send(json.dumps(results), 'application/json')
+
+    def do_GET(self):
+        self._count_and_wait()
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path.startswith('/stooq'):
+            symbol = params.get('s', ['x'])[0].upper()
+            self._send(f'Symbol,Date,Time,Open,High,Low,Close,Volume\n{symbol},2026-01-02,17:00,10,11,9,10.5,1000\n', 'text/csv')
+        elif params.get('function') == ['DIVIDENDS']:
+            self._send(json.dumps({'data': []}), 'application/json')
+        else:
+            self._send(json.dumps({'Global Quote': {'05. price': '10.5000'}}), 'application/json')
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+
+def run(sizes, latency, workers):
+    from django.contrib.auth import get_user_model
+    from django.test import override_settings
+
+    from finance import market_data
+    from finance.market_cache import quote_store, resolution_cache
+    from finance.models import BrokerageInstrument, InstrumentResolution
+
+    FakeProviderHandler.latency = latency
+    server = FakeProviderServer(('127.0.0.1', 0), FakeProviderHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    market_data.OPENFIGI_MAPPING_URL = f'{base_url}/openfigi'
+    market_data.ALPHA_VANTAGE_URL = f'{base_url}/alpha'
+    market_data.STOOQ_QUOTE_URL = f'{base_url}/stooq/q/l/'
+    market_data.STOOQ_DAILY_URL = f'{base_url}/stooq/q/d/l/'
+
+    User = get_user_model()
+    print(f'{"instruments":>11} {"requests":>8} {"sequential est. [s]":>20} {"wall [s]":>9} {"speed-up":>9}')
+    with override_settings(
+        ALPHA_VANTAGE_API_KEY='benchmark',
+        MARKET_DATA_MAX_WORKERS=workers,
+        MARKET_DATA_PROVIDER_CONCURRENCY={'OpenFIGI': workers, 'Stooq': workers, 'Alpha Vantage': workers},
+        MARKET_DATA_PROVIDER_RATE_LIMITS={'OpenFIGI': (1000, 1), 'Stooq': (1000, 1), 'Alpha Vantage': (1000, 1)},
+    ):
+        market_data.reset_provider_guards()
+        for size in sizes:
+            user = User.objects.create_user(username=f'bench-{size}', password='benchmark')
+            BrokerageInstrument.objects.bulk_create([
+                BrokerageInstrument(
+                    user=user,
+                    ticker=f'PL{index:010d}',
+                    isin=f'PL{index:010d}',
+                    name=f'Instrument {index}',
+                    exchange='XWAR',
+                    currency='PLN',
+                )
+                for index in range(size)
+            ])
+            resolution_cache.clear()
+            quote_store.clear()
+            InstrumentResolution.objects.all().delete()
+            FakeProviderHandler.request_count = 0
+            started = time.perf_counter()
+            result = market_data.refresh_market_data_for_user(user)
+            elapsed = time.perf_counter() - started
+            requests = FakeProviderHandler.request_count
+            sequential = requests * latency
+            assert result['updated_quotes'] == size, result
+            print(f'{size:>11} {requests:>8} {sequential:>20.2f} {elapsed:>9.2f} {sequential / elapsed:>8.1f}x')
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 10, 20, 40])
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        run(args.sizes, args.latency, args.workers)
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
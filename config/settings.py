@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+from datetime import timedelta
 from pathlib import Path
 from django.contrib.messages import constants as messages
 from dotenv import load_dotenv
@@ -148,6 +149,49 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 WHITENOISE_MAX_AGE = 60 * 60 * 24 * 7
 ALPHA_VANTAGE_API_KEY = os.environ.get('ALPHA_VANTAGE_API_KEY', '')
 OPENFIGI_API_KEY = os.environ.get('OPENFIGI_API_KEY', '')
+# 0 picks the OpenFIGI limit for the key type (10 jobs without a key, 100 with one).
+OPENFIGI_MAX_JOBS_PER_REQUEST = int(os.environ.get('OPENFIGI_MAX_JOBS_PER_REQUEST', '0'))
+MARKET_DATA_MAX_WORKERS = int(os.environ.get('MARKET_DATA_MAX_WORKERS', '8'))
+MARKET_DATA_HTTP_CONNECT_TIMEOUT = float(os.environ.get('MARKET_DATA_HTTP_CONNECT_TIMEOUT', '5'))
+MARKET_DATA_HTTP_READ_TIMEOUT = float(os.environ.get('MARKET_DATA_HTTP_READ_TIMEOUT', '12'))
+MARKET_DATA_HTTP_POOL_SIZE = int(os.environ.get('MARKET_DATA_HTTP_POOL_SIZE', '8'))
+MARKET_DATA_PROVIDER_CONCURRENCY = {
+    'OpenFIGI': int(os.environ.get('OPENFIGI_CONCURRENCY', '2')),
+    'Stooq': int(os.environ.get('STOOQ_CONCURRENCY', '4')),
+    'Alpha Vantage': int(os.environ.get('ALPHA_VANTAGE_CONCURRENCY', '1')),
+}
+MARKET_DATA_RESOLUTION_TTL = timedelta(days=int(os.environ.get('MARKET_DATA_RESOLUTION_TTL_DAYS', '30')))
+MARKET_DATA_NEGATIVE_RESOLUTION_TTL = timedelta(hours=int(os.environ.get('MARKET_DATA_NEGATIVE_RESOLUTION_TTL_HOURS', '24')))
+MARKET_DATA_RESOLUTION_LRU_SIZE = int(os.environ.get('MARKET_DATA_RESOLUTION_LRU_SIZE', '1024'))
+MARKET_DATA_QUOTE_TTL = timedelta(minutes=int(os.environ.get('MARKET_DATA_QUOTE_TTL_MINUTES', '15')))
+MARKET_DATA_PRICE_BACKFILL_DAYS = int(os.environ.get('MARKET_DATA_PRICE_BACKFILL_DAYS', '365'))
+# Provider budgets as (requests, seconds); OpenFIGI without an override uses 25/6 s once a key is set.
+MARKET_DATA_PROVIDER_RATE_LIMITS = {
+    'Stooq': (int(os.environ.get('STOOQ_RATE_LIMIT_PER_SECOND', '10')), 1),
+    'Alpha Vantage': (int(os.environ.get('ALPHA_VANTAGE_RATE_LIMIT_PER_MINUTE', '5')), 60),
+}
+MARKET_DATA_RATE_LIMIT_MAX_WAIT = float(os.environ.get('MARKET_DATA_RATE_LIMIT_MAX_WAIT', '15'))
+MARKET_DATA_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('MARKET_DATA_BREAKER_FAILURE_THRESHOLD', '3'))
+MARKET_DATA_BREAKER_RESET_SECONDS = int(os.environ.get('MARKET_DATA_BREAKER_RESET_SECONDS', '60'))
+MARKET_DATA_REFRESH_JOB_STALE_AFTER = timedelta(minutes=int(os.environ.get('MARKET_DATA_REFRESH_JOB_STALE_MINUTES', '10')))
+MARKET_DATA_REFRESH_JOB_MAX_ATTEMPTS = int(os.environ.get('MARKET_DATA_REFRESH_JOB_MAX_ATTEMPTS', '3'))
+PORTFOLIO_HISTORY_MAX_DAYS = int(os.environ.get('PORTFOLIO_HISTORY_MAX_DAYS', '3660'))
+PORTFOLIO_HISTORY_CACHE_TTL = timedelta(hours=int(os.environ.get('PORTFOLIO_HISTORY_CACHE_TTL_HOURS', '6')))
+PORTFOLIO_SUMMARY_CACHE_TTL = timedelta(hours=int(os.environ.get('PORTFOLIO_SUMMARY_CACHE_TTL_HOURS', '6')))
+REPORT_MAX_MONTHS = int(os.environ.get('REPORT_MAX_MONTHS', '120'))
+
+# The market_data cache holds quotes shared by all users. LocMemCache shares
+# them between the threads of one process; point it at a shared backend
+# (e.g. DatabaseCache after `createcachetable`) to share across gunicorn workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'market_data': {
+        'BACKEND': os.environ.get('MARKET_DATA_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('MARKET_DATA_CACHE_LOCATION', 'market-data'),
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -1,12 +1,16 @@
+from collections import defaultdict
 from decimal import Decimal
 
-from django.db.models import Sum
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
 
-from .models import Daily, FinanceAccount, Income, Monthly
+from .models import Daily, FinanceAccount, Income, Monthly, MonthlyCategoryTotal
 
 ACTIVE_FINANCE_ACCOUNT_SESSION_KEY = 'active_finance_account_id'
 TRANSFER_TO_SHARED_CATEGORY = 'Wpłata do wspólnego z mBank'
 TRANSFER_INCOME_SOURCE = 'Wpłata na konto wspólne'
+MONTHLY_RECONCILE_BATCH_SIZE = 500
+CENT = Decimal('0.01')
 
 
 def ensure_personal_finance_account(user):
@@ -29,21 +33,48 @@ def get_available_shared_accounts(user):
     return get_user_finance_accounts(user).filter(account_type=FinanceAccount.SHARED)
 
 
+def get_request_finance_accounts(request):
+    """The user's finance accounts, resolved once per request and kept on it.
+
+    One query when the user is a member of their personal account; otherwise
+    ensure_personal_finance_account repairs the account or membership first.
+    """
+    accounts = getattr(request, '_finance_accounts', None)
+    if accounts is None:
+        user = request.user
+        accounts = list(FinanceAccount.objects.filter(members=user).distinct().order_by('account_type', 'name'))
+        personal_account = next(
+            (account for account in accounts if account.account_type == FinanceAccount.PERSONAL and account.owner_id == user.id),
+            None,
+        )
+        if personal_account is None:
+            personal_account = ensure_personal_finance_account(user)
+            accounts = sorted([*accounts, personal_account], key=lambda account: (account.account_type, account.name))
+        request._personal_finance_account = personal_account
+        request._finance_accounts = accounts
+    return accounts
+
+
 def get_active_finance_account(request):
-    personal_account = ensure_personal_finance_account(request.user)
-    available_accounts = get_user_finance_accounts(request.user)
+    active_account = getattr(request, '_active_finance_account', None)
+    if active_account is not None:
+        return active_account
+
+    available_accounts = get_request_finance_accounts(request)
     account_id = request.session.get(ACTIVE_FINANCE_ACCOUNT_SESSION_KEY)
-    active_account = available_accounts.filter(id=account_id).first()
+    active_account = next((account for account in available_accounts if account.id == account_id), None)
 
     if active_account is None:
-        active_account = personal_account
-        request.session[ACTIVE_FINANCE_ACCOUNT_SESSION_KEY] = personal_account.id
+        active_account = request._personal_finance_account
+        request.session[ACTIVE_FINANCE_ACCOUNT_SESSION_KEY] = active_account.id
 
+    request._active_finance_account = active_account
     return active_account
 
 
 def set_active_finance_account(request, account):
     request.session[ACTIVE_FINANCE_ACCOUNT_SESSION_KEY] = account.id
+    request._active_finance_account = account
 
 
 def get_or_create_monthly_record(*, user, account, month_date, for_update=False):
@@ -57,16 +88,135 @@ def get_or_create_monthly_record(*, user, account, month_date, for_update=False)
     )
 
 
-def recalculate_monthly_record(monthly_record):
-    monthly_record.total_income = Income.objects.filter(
-        account=monthly_record.account,
-        month=monthly_record,
-    ).aggregate(Sum('amount'))['amount__sum'] or Decimal('0.00')
-    monthly_record.total_expense = Daily.objects.filter(
-        account=monthly_record.account,
-        month=monthly_record,
-    ).aggregate(Sum('cost'))['cost__sum'] or Decimal('0.00')
-    monthly_record.save(update_fields=['total_income', 'total_expense'])
+def apply_monthly_delta(month_id, field, amount):
+    """Adds `amount` to `field` ('total_income' or 'total_expense') of the month in one UPDATE.
+
+    The sum is evaluated by the database, so concurrent writes to the same
+    month cannot overwrite each other, and the cost does not grow with the
+    number of entries.
+    """
+    if amount:
+        Monthly.objects.filter(pk=month_id).update(**{field: F(field) + amount})
+
+
+def move_monthly_amount(field, before, after):
+    """Books an entry that was added (before=None), edited or deleted (after=None) as deltas.
+
+    Both sides are (month_id, amount) tuples.
+    """
+    if before is not None and after is not None and before[0] == after[0]:
+        apply_monthly_delta(after[0], field, after[1] - before[1])
+        return
+    if before is not None:
+        apply_monthly_delta(before[0], field, -before[1])
+    if after is not None:
+        apply_monthly_delta(after[0], field, after[1])
+
+
+def apply_category_delta(month_id, account_id, category, amount, entries):
+    """Adds `amount` and `entries` to the MonthlyCategoryTotal row of (month, category) in one UPDATE.
+
+    A row lives exactly as long as the month has expenses in the category,
+    whatever their total: the first entry creates it and the last one
+    removes it. Deletes cascading from a removed month never recreate it.
+    """
+    rows = MonthlyCategoryTotal.objects.filter(month_id=month_id, category=category)
+    if rows.update(total=F('total') + amount, entries=F('entries') + entries):
+        if entries < 0:
+            rows.filter(entries__lte=0).delete()
+        return
+    if entries <= 0:
+        return
+    try:
+        with transaction.atomic():
+            MonthlyCategoryTotal.objects.create(
+                month_id=month_id, account_id=account_id, category=category, total=amount, entries=entries,
+            )
+    except IntegrityError:
+        # Another request created the row first.
+        rows.update(total=F('total') + amount, entries=F('entries') + entries)
+
+
+def move_category_amount(before, after):
+    """Books an expense that was added (before=None), edited or deleted (after=None) in the category rollup.
+
+    Both sides are (month_id, account_id, category, cost) tuples.
+    """
+    if before is not None and after is not None and (before[0], before[2]) == (after[0], after[2]):
+        month_id, account_id, category, cost = after
+        if cost != before[3]:
+            apply_category_delta(month_id, account_id, category, cost - before[3], 0)
+        return
+    if before is not None:
+        month_id, account_id, category, cost = before
+        apply_category_delta(month_id, account_id, category, -cost, -1)
+    if after is not None:
+        month_id, account_id, category, cost = after
+        apply_category_delta(month_id, account_id, category, cost, 1)
+
+
+def reconcile_monthly_totals(months, dry_run=False):
+    """Recomputes the totals and category rollups of `months` from their entries and fixes drift in bulk.
+
+    Works in chunks of MONTHLY_RECONCILE_BATCH_SIZE: per chunk, the months are
+    locked, incomes are summed per month and expenses per (month, category),
+    drifted totals are written with one bulk_update and drifted rollups are
+    rebuilt. Returns (month, old_income, old_expense, categories_drifted) for
+    every drifted month, with the month already corrected.
+    """
+    drifted = []
+    month_ids = list(months.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(month_ids), MONTHLY_RECONCILE_BATCH_SIZE):
+        chunk_ids = month_ids[start:start + MONTHLY_RECONCILE_BATCH_SIZE]
+        with transaction.atomic():
+            chunk = list(Monthly.objects.select_for_update().filter(pk__in=chunk_ids).select_related('account', 'user'))
+            incomes = dict(
+                Income.objects.filter(month_id__in=chunk_ids)
+                .values('month_id').annotate(total=Sum('amount')).order_by()
+                .values_list('month_id', 'total')
+            )
+            expected_categories = defaultdict(dict)
+            for month_id, category, total, entries in (
+                Daily.objects.filter(month_id__in=chunk_ids)
+                .values('month_id', 'category').annotate(total=Sum('cost'), entries=Count('id')).order_by()
+                .values_list('month_id', 'category', 'total', 'entries')
+            ):
+                expected_categories[month_id][category] = (total.quantize(CENT), entries)
+            stored_categories = defaultdict(dict)
+            for month_id, category, total, entries in (
+                MonthlyCategoryTotal.objects.filter(month_id__in=chunk_ids)
+                .values_list('month_id', 'category', 'total', 'entries')
+            ):
+                stored_categories[month_id][category] = (total, entries)
+
+            changed = []
+            rebuilt = []
+            for month in chunk:
+                income = (incomes.get(month.pk) or Decimal('0')).quantize(CENT)
+                expense = sum((total for total, _ in expected_categories[month.pk].values()), Decimal('0.00'))
+                categories_drifted = expected_categories[month.pk] != stored_categories[month.pk]
+                totals_drifted = month.total_income != income or month.total_expense != expense
+                if not totals_drifted and not categories_drifted:
+                    continue
+                drifted.append((month, month.total_income, month.total_expense, categories_drifted))
+                if totals_drifted:
+                    month.total_income = income
+                    month.total_expense = expense
+                    changed.append(month)
+                if categories_drifted:
+                    rebuilt.append(month)
+            if dry_run:
+                continue
+            if changed:
+                Monthly.objects.bulk_update(changed, ['total_income', 'total_expense'])
+            if rebuilt:
+                MonthlyCategoryTotal.objects.filter(month__in=rebuilt).delete()
+                MonthlyCategoryTotal.objects.bulk_create([
+                    MonthlyCategoryTotal(month=month, account_id=month.account_id, category=category, total=total, entries=entries)
+                    for month in rebuilt
+                    for category, (total, entries) in expected_categories[month.pk].items()
+                ])
+    return drifted
 
 
 def sync_shared_account_transfer(expense):
@@ -81,9 +231,7 @@ def sync_shared_account_transfer(expense):
 
     if not should_transfer:
         if linked_income:
-            target_month = linked_income.month
             linked_income.delete()
-            recalculate_monthly_record(target_month)
         if expense.transfer_target_account_id and expense.category != TRANSFER_TO_SHARED_CATEGORY:
             expense.transfer_target_account = None
             expense.save(update_fields=['transfer_target_account'])
@@ -107,7 +255,6 @@ def sync_shared_account_transfer(expense):
     }
 
     if linked_income:
-        old_target_month = linked_income.month
         linked_income.user = expense.user
         linked_income.account = expense.transfer_target_account
         linked_income.date = expense.date
@@ -116,8 +263,5 @@ def sync_shared_account_transfer(expense):
         linked_income.source = TRANSFER_INCOME_SOURCE
         linked_income.month = target_month
         linked_income.save()
-        recalculate_monthly_record(old_target_month)
     else:
         Income.objects.create(linked_expense=expense, **income_defaults)
-
-    recalculate_monthly_record(target_month)
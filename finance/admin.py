@@ -6,8 +6,16 @@ from .models import (
     BrokerageTransaction,
     Daily,
     FinanceAccount,
+    FxRate,
     Income,
+    InstrumentResolution,
+    MarketDataRefreshJob,
     Monthly,
+    MonthlyCategoryTotal,
+    OpenLot,
+    PriceBar,
+    PriceBarCoverage,
+    RealizedGain,
 )
 
 @admin.register(FinanceAccount)
@@ -21,6 +29,11 @@ class MonthlyAdmin(admin.ModelAdmin):
     list_display = ('account', 'user', 'date', 'total_income', 'total_expense')
     list_filter = ('account', 'user', 'date')
 
+@admin.register(MonthlyCategoryTotal)
+class MonthlyCategoryTotalAdmin(admin.ModelAdmin):
+    list_display = ('account', 'month', 'category', 'total')
+    list_filter = ('account', 'category')
+
 @admin.register(Daily)
 class DailyAdmin(admin.ModelAdmin):
     list_display = ('account', 'user', 'date', 'title', 'category', 'store', 'cost', 'month')
@@ -60,3 +73,52 @@ class BrokerageDividendAdmin(admin.ModelAdmin):
     list_display = ('payment_date', 'account', 'instrument', 'gross_amount_per_share', 'currency', 'tax_rate', 'status')
     list_filter = ('status', 'payment_date', 'currency')
     search_fields = ('instrument__ticker', 'account__name')
+
+
+@admin.register(InstrumentResolution)
+class InstrumentResolutionAdmin(admin.ModelAdmin):
+    list_display = ('isin', 'exchange', 'currency', 'found', 'symbol', 'resolved_exchange', 'resolved_at')
+    list_filter = ('found', 'currency')
+    search_fields = ('isin', 'symbol', 'name')
+
+
+@admin.register(PriceBar)
+class PriceBarAdmin(admin.ModelAdmin):
+    list_display = ('symbol', 'date', 'open', 'high', 'low', 'close', 'volume')
+    list_filter = ('date',)
+    search_fields = ('symbol',)
+    date_hierarchy = 'date'
+
+
+@admin.register(PriceBarCoverage)
+class PriceBarCoverageAdmin(admin.ModelAdmin):
+    list_display = ('symbol', 'first_date', 'last_date')
+    search_fields = ('symbol',)
+
+
+@admin.register(FxRate)
+class FxRateAdmin(admin.ModelAdmin):
+    list_display = ('currency', 'date', 'rate_to_pln')
+    list_filter = ('currency',)
+    date_hierarchy = 'date'
+
+
+@admin.register(OpenLot)
+class OpenLotAdmin(admin.ModelAdmin):
+    list_display = ('account', 'instrument', 'trade_date', 'quantity', 'unit_cost')
+    list_filter = ('account__broker', 'trade_date')
+    search_fields = ('instrument__ticker', 'account__name')
+
+
+@admin.register(RealizedGain)
+class RealizedGainAdmin(admin.ModelAdmin):
+    list_display = ('account', 'instrument', 'trade_date', 'quantity', 'proceeds', 'cost_basis', 'gain')
+    list_filter = ('account__broker', 'trade_date')
+    search_fields = ('instrument__ticker', 'account__name')
+
+
+@admin.register(MarketDataRefreshJob)
+class MarketDataRefreshJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'status', 'progress_done', 'progress_total', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__username', 'error')
@@ -1,9 +1,12 @@
+from bisect import bisect_right
 from collections import defaultdict
 from decimal import Decimal
 
+from django.db.models import Q, Sum
 from django.utils import timezone
 
-from .models import BrokerageAccount, BrokerageDividend, BrokerageTransaction
+from .fx_rates import consolidate_to_pln, load_fx_rate_table
+from .models import BrokerageAccount, BrokerageDividend, BrokerageTransaction, OpenLot, RealizedGain
 
 
 BELKA_TAX_RATE = Decimal('19.00')
@@ -28,47 +31,80 @@ def get_quantity(account, instrument, as_of=None):
     return max(quantity, Decimal('0'))
 
 
+class PositionHistory:
+    """Quantity held per (account, instrument) over time, answering get_quantity() lookups by binary search.
+
+    Transactions must be added in (trade_date, id) order; one point is kept per
+    trade date with the running quantity at the end of that day.
+    """
+
+    def __init__(self, transactions=()):
+        self._dates = defaultdict(list)
+        self._quantities = defaultdict(list)
+        for transaction in transactions:
+            self.add(transaction)
+
+    def add(self, transaction):
+        key = (transaction.account_id, transaction.instrument_id)
+        dates = self._dates[key]
+        quantities = self._quantities[key]
+        delta = transaction.quantity if transaction.transaction_type == BrokerageTransaction.BUY else -transaction.quantity
+        running = (quantities[-1] if quantities else Decimal('0')) + delta
+        if dates and dates[-1] == transaction.trade_date:
+            quantities[-1] = running
+        else:
+            dates.append(transaction.trade_date)
+            quantities.append(running)
+
+    def _running(self, key, as_of):
+        index = bisect_right(self._dates[key], as_of)
+        return self._quantities[key][index - 1] if index else Decimal('0')
+
+    def quantity(self, account_id, instrument_id, as_of=None):
+        key = (account_id, instrument_id)
+        quantities = self._quantities.get(key)
+        if not quantities:
+            return Decimal('0')
+        if as_of is None:
+            return max(quantities[-1], Decimal('0'))
+        return max(self._running(key, as_of), Decimal('0'))
+
+    def change_after(self, account_id, instrument_id, as_of):
+        """Net quantity bought minus sold after `as_of` (unclamped)."""
+        key = (account_id, instrument_id)
+        quantities = self._quantities.get(key)
+        if not quantities:
+            return Decimal('0')
+        return quantities[-1] - self._running(key, as_of)
+
+
 def build_portfolio_summary(user):
     accounts = list(BrokerageAccount.objects.filter(user=user))
-    transactions = (
-        BrokerageTransaction.objects
+    open_lots = (
+        OpenLot.objects
         .filter(account__user=user)
         .select_related('account', 'instrument')
-        .order_by('trade_date', 'id')
     )
-
     lots = defaultdict(list)
+    for lot in open_lots:
+        lots[(lot.account_id, lot.instrument_id)].append(lot)
+
+    realized_gains = (
+        RealizedGain.objects
+        .filter(account__user=user)
+        .values('instrument__currency')
+        .order_by()
+        .annotate(
+            realized_gain=Sum('gain'),
+            taxable_gain=Sum('gain', filter=Q(gain__gt=0) & ~Q(account__account_type=BrokerageAccount.IKE)),
+        )
+    )
     realized_tax_by_currency = defaultdict(lambda: ZERO)
     realized_gain_by_currency = defaultdict(lambda: ZERO)
-
-    for transaction in transactions:
-        key = (transaction.account_id, transaction.instrument_id)
-
-        if transaction.transaction_type == BrokerageTransaction.BUY:
-            total_cost = transaction.gross_value + transaction.fees
-            lots[key].append({
-                'quantity': transaction.quantity,
-                'unit_cost': total_cost / transaction.quantity,
-                'transaction': transaction,
-            })
-            continue
-
-        quantity_to_sell = transaction.quantity
-        cost_basis = ZERO
-        while quantity_to_sell > 0 and lots[key]:
-            lot = lots[key][0]
-            consumed_quantity = min(quantity_to_sell, lot['quantity'])
-            cost_basis += consumed_quantity * lot['unit_cost']
-            lot['quantity'] -= consumed_quantity
-            quantity_to_sell -= consumed_quantity
-            if lot['quantity'] <= 0:
-                lots[key].pop(0)
-
-        proceeds = (transaction.quantity * transaction.price) - transaction.fees
-        gain = proceeds - cost_basis
-        realized_gain_by_currency[transaction.instrument.currency] += gain
-        if not transaction.account.is_tax_exempt and gain > 0:
-            realized_tax_by_currency[transaction.instrument.currency] += gain * (BELKA_TAX_RATE / Decimal('100'))
+    for row in realized_gains:
+        currency = row['instrument__currency']
+        realized_gain_by_currency[currency] += row['realized_gain']
+        realized_tax_by_currency[currency] += (row['taxable_gain'] or ZERO) * (BELKA_TAX_RATE / Decimal('100'))
 
     positions = []
     account_totals = {
@@ -81,16 +117,17 @@ def build_portfolio_summary(user):
     currency_totals = defaultdict(lambda: {'currency': '', 'value': ZERO, 'cost': ZERO, 'unrealized': ZERO})
     planned_dividend_net_by_currency = defaultdict(lambda: ZERO)
 
-    for (account_id, instrument_id), open_lots in lots.items():
-        quantity = sum((lot['quantity'] for lot in open_lots), Decimal('0'))
+    open_quantities = {}
+    for key, position_lots in lots.items():
+        quantity = sum((lot.quantity for lot in position_lots), Decimal('0'))
+        open_quantities[key] = quantity
         if quantity <= 0:
             continue
 
-        first_transaction = open_lots[0]['transaction']
-        account = first_transaction.account
-        instrument = first_transaction.instrument
+        account = position_lots[0].account
+        instrument = position_lots[0].instrument
         currency = instrument.currency
-        cost = sum((lot['quantity'] * lot['unit_cost'] for lot in open_lots), ZERO)
+        cost = sum((lot.quantity * lot.unit_cost for lot in position_lots), ZERO)
         current_value = quantity * instrument.last_price if instrument.last_price is not None else None
         unrealized = current_value - cost if current_value is not None else None
 
@@ -119,16 +156,30 @@ def build_portfolio_summary(user):
 
     today = timezone.localdate()
     dividends = []
-    dividend_queryset = (
+    dividend_queryset = list(
         BrokerageDividend.objects
         .filter(account__user=user, payment_date__gte=today)
         .select_related('account', 'instrument')
         .order_by('payment_date', 'instrument__ticker')
     )
 
+    # Quantity on the ex-date = open quantity now minus what was traded after that date.
+    position_history = PositionHistory()
+    if dividend_queryset:
+        earliest_date = min(dividend.ex_dividend_date or today for dividend in dividend_queryset)
+        position_history = PositionHistory(
+            BrokerageTransaction.objects
+            .filter(account__user=user, trade_date__gt=earliest_date)
+            .order_by('trade_date', 'id')
+        )
+
     for dividend in dividend_queryset:
         quantity_date = dividend.ex_dividend_date or today
-        quantity = get_quantity(dividend.account, dividend.instrument, quantity_date)
+        key = (dividend.account_id, dividend.instrument_id)
+        quantity = max(
+            open_quantities.get(key, Decimal('0')) - position_history.change_after(*key, quantity_date),
+            Decimal('0'),
+        )
         gross_total = quantity * dividend.gross_amount_per_share
         tax_rate = ZERO if dividend.account.is_tax_exempt else dividend.tax_rate
         tax_amount = gross_total * (tax_rate / Decimal('100'))
@@ -182,10 +233,14 @@ def build_portfolio_summary(user):
             'estimated_sell_tax': money(realized_tax_by_currency[currency]),
         })
 
+    formatted_currency_totals.sort(key=lambda item: item['currency'])
+    fx_rates = load_fx_rate_table(all_currencies, today, today)
+
     return {
         'accounts': accounts,
         'account_totals': formatted_account_totals,
-        'currency_totals': sorted(formatted_currency_totals, key=lambda item: item['currency']),
+        'currency_totals': formatted_currency_totals,
+        'pln_totals': consolidate_to_pln(formatted_currency_totals, fx_rates, today),
         'positions': sorted(positions, key=lambda item: (item['account'].name, item['instrument'].ticker)),
         'upcoming_dividends': dividends,
     }
@@ -1,13 +1,14 @@
-from .account_utils import get_active_finance_account, get_user_finance_accounts
+from django.utils.functional import SimpleLazyObject
+
+from .account_utils import get_active_finance_account, get_request_finance_accounts
 
 
 def finance_accounts(request):
+    # Lazy, so pages that never render the account switcher skip the lookups entirely.
     if not request.user.is_authenticated:
         return {}
 
-    available_accounts = list(get_user_finance_accounts(request.user))
-    active_account = get_active_finance_account(request)
     return {
-        'finance_accounts': available_accounts,
-        'active_finance_account': active_account,
+        'finance_accounts': SimpleLazyObject(lambda: get_request_finance_accounts(request)),
+        'active_finance_account': SimpleLazyObject(lambda: get_active_finance_account(request)),
     }
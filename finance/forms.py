@@ -1,7 +1,7 @@
 from django import forms
 from django.utils import timezone
 
-from .market_data import MarketDataError, fetch_transaction_market_price
+from .market_data import MarketDataError, cached_transaction_market_price
 from .models import (
     BrokerageAccount,
     BrokerageDividend,
@@ -100,7 +100,7 @@ class BrokerageTransactionForm(BootstrapFinanceFormMixin, forms.ModelForm):
         max_digits=14,
         decimal_places=4,
         required=False,
-        help_text='Zostaw puste, żeby spróbować pobrać cenę rynkową. Wpisz swoją cenę, jeśli cena brokera jest inna.',
+        help_text='Zostaw puste, żeby użyć ceny rynkowej pobranej w tle po wpisaniu ISIN i daty. Wpisz swoją cenę, jeśli cena brokera jest inna.',
     )
     market_price_confirmed = forms.BooleanField(required=False, widget=forms.HiddenInput)
     market_price_value = forms.DecimalField(required=False, max_digits=14, decimal_places=4, widget=forms.HiddenInput)
@@ -136,29 +136,36 @@ class BrokerageTransactionForm(BootstrapFinanceFormMixin, forms.ModelForm):
         existing_market_source = cleaned_data.get('market_price_source_value', '')
         existing_market_symbol = cleaned_data.get('market_symbol_value', '')
 
-        if price is None and isin and trade_date and trade_time:
+        if price is None and existing_market_price is not None:
+            # Prefetched by the market-price endpoint while the form was being filled in.
+            self.market_price_fetched = existing_market_price
+            self.market_price_source = existing_market_source
+            self.resolved_symbol = existing_market_symbol
+            cleaned_data['price'] = existing_market_price
+        elif price is None and isin and trade_date and trade_time:
             try:
-                market_data = fetch_transaction_market_price(
-                    isin,
-                    trade_date,
-                    trade_time,
-                    '',
-                    cleaned_data.get('currency', ''),
-                )
+                market_data = cached_transaction_market_price(isin, trade_date, '', cleaned_data.get('currency', ''))
             except MarketDataError as exc:
                 self.add_error(
                     'price',
                     f'Nie udało się pobrać ceny rynkowej: {exc}. Wpisz cenę z brokera ręcznie.',
                 )
             else:
-                self.market_price_fetched = market_data['price']
-                self.market_price_source = market_data['source']
-                self.resolved_symbol = market_data.get('symbol', '')
-                self.resolved_market_data = market_data
-                cleaned_data['price'] = self.market_price_fetched
-                cleaned_data['market_price_value'] = self.market_price_fetched
-                cleaned_data['market_price_source_value'] = self.market_price_source
-                cleaned_data['market_symbol_value'] = self.resolved_symbol
+                if market_data is None:
+                    self.add_error(
+                        'price',
+                        'Cena rynkowa nie jest jeszcze pobrana. Poczekaj, aż pojawi się pod polem ceny, '
+                        'albo wpisz cenę z brokera ręcznie.',
+                    )
+                else:
+                    self.market_price_fetched = market_data['price']
+                    self.market_price_source = market_data['source']
+                    self.resolved_symbol = market_data.get('symbol', '')
+                    self.resolved_market_data = market_data
+                    cleaned_data['price'] = self.market_price_fetched
+                    cleaned_data['market_price_value'] = self.market_price_fetched
+                    cleaned_data['market_price_source_value'] = self.market_price_source
+                    cleaned_data['market_symbol_value'] = self.resolved_symbol
         elif existing_market_price is not None:
             self.market_price_fetched = existing_market_price
             self.market_price_source = existing_market_source
@@ -224,6 +231,19 @@ class BrokerageTransactionForm(BootstrapFinanceFormMixin, forms.ModelForm):
         }
 
 
+class BrokerageStatementImportForm(BootstrapFinanceFormMixin, forms.Form):
+    account = forms.ModelChoiceField(label='Konto maklerskie', queryset=BrokerageAccount.objects.none())
+    statement = forms.FileField(
+        label='Plik wyciągu',
+        help_text='Historia operacji z XTB albo historia transakcji z mBanku (eMakler), w formacie CSV lub XLSX.',
+    )
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if user:
+            self.fields['account'].queryset = BrokerageAccount.objects.filter(user=user)
+
+
 class BrokerageDividendForm(BootstrapFinanceFormMixin, forms.ModelForm):
     ex_dividend_date = forms.DateField(
         label='Dzień odcięcia prawa',
@@ -0,0 +1,135 @@
+import csv
+import io
+import re
+from datetime import datetime
+from decimal import Decimal
+
+from utils.tools import parse_decimal
+
+from .models import BrokerageInstrument, FxRate
+from .summary_cache import summary_cache
+
+
+BULK_INSERT_BATCH_SIZE = 500
+
+_DATE_FORMATS = ('%Y-%m-%d', '%Y%m%d', '%d.%m.%Y')
+_WIDE_COLUMN = re.compile(r'^(\d*)([A-Z]{3})$')
+
+
+class FxRateError(ValueError):
+    pass
+
+
+def _column(header, *names):
+    return next((header.index(name) for name in names if name in header), None)
+
+
+def _parse_date(value):
+    value = value.strip()
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_rate(value, units=1):
+    try:
+        rate = parse_decimal(value) / units
+    except ValueError:
+        return None
+    return rate.quantize(Decimal('0.000001')) if rate > 0 else None
+
+
+def read_fx_rates_csv(lines):
+    """Yields FxRate objects from a CSV, without reading it all into memory.
+
+    Two layouts are understood: long rows with date, currency and rate
+    columns, and the NBP archive layout with one column per currency
+    (`data;1USD;1EUR;100JPY;...`). Rows whose date or rate does not parse,
+    such as the table-number footer of the NBP files, are skipped.
+    """
+    lines = iter(lines)
+    header_line = next(lines, '')
+    try:
+        dialect = csv.Sniffer().sniff(header_line, delimiters=',;\t')
+    except csv.Error:
+        raise FxRateError('Nieznany format pliku kursów: nie rozpoznano separatora kolumn.')
+    header = [column.strip() for column in next(csv.reader([header_line], dialect))]
+    lowered = [column.lower() for column in header]
+    reader = csv.reader(lines, dialect)
+
+    date_index = _column(lowered, 'date', 'data')
+    if date_index is None:
+        raise FxRateError('Nieznany format pliku kursów: brak kolumny z datą.')
+    currency_index = _column(lowered, 'currency', 'waluta')
+    rate_index = _column(lowered, 'rate', 'kurs')
+    if currency_index is not None and rate_index is not None:
+        for row in reader:
+            if len(row) <= max(date_index, currency_index, rate_index):
+                continue
+            rate_date = _parse_date(row[date_index])
+            rate = _parse_rate(row[rate_index])
+            currency = row[currency_index].strip().upper()
+            if rate_date and rate is not None and len(currency) == 3:
+                yield FxRate(currency=currency, date=rate_date, rate_to_pln=rate)
+        return
+
+    columns = []
+    for index, column in enumerate(header):
+        match = _WIDE_COLUMN.match(column.upper())
+        if match and index != date_index:
+            columns.append((index, match.group(2), int(match.group(1) or 1)))
+    if not columns:
+        raise FxRateError('Nieznany format pliku kursów: brak kolumn walut.')
+    for row in reader:
+        rate_date = _parse_date(row[date_index]) if len(row) > date_index else None
+        if rate_date is None:
+            continue
+        for index, currency, units in columns:
+            rate = _parse_rate(row[index], units) if index < len(row) else None
+            if rate is not None:
+                yield FxRate(currency=currency, date=rate_date, rate_to_pln=rate)
+
+
+def save_fx_rates(rates):
+    """Upserts FxRate objects in fixed-size chunks and invalidates the summaries of users holding those currencies."""
+    saved = 0
+    currencies = set()
+    chunk = {}
+    for rate in rates:
+        # A later row for the same day wins; one upsert must not touch a row twice.
+        chunk[(rate.currency, rate.date)] = rate
+        currencies.add(rate.currency)
+        if len(chunk) >= BULK_INSERT_BATCH_SIZE:
+            saved += _upsert(chunk.values())
+            chunk = {}
+    if chunk:
+        saved += _upsert(chunk.values())
+    if currencies:
+        summary_cache.bump_many(
+            BrokerageInstrument.objects
+            .filter(currency__in=currencies)
+            .values_list('user_id', flat=True)
+            .distinct()
+        )
+    return saved
+
+
+def _upsert(rates):
+    rates = list(rates)
+    FxRate.objects.bulk_create(
+        rates,
+        update_conflicts=True,
+        unique_fields=['currency', 'date'],
+        update_fields=['rate_to_pln'],
+    )
+    return len(rates)
+
+
+def import_fx_rates_csv(file, encoding='utf-8-sig'):
+    """Loads a CSV file object (text or binary) into FxRate and returns the number of rows saved."""
+    if isinstance(file.read(0), bytes):
+        file = io.TextIOWrapper(file, encoding=encoding, newline='')
+    return save_fx_rates(read_fx_rates_csv(file))
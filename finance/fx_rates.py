@@ -0,0 +1,86 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from .models import FxRate
+
+
+BASE_CURRENCY = 'PLN'
+ONE = Decimal('1')
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+FX_RATE_LOOKBACK = timedelta(days=7)
+CONSOLIDATED_FIELDS = ('value', 'cost', 'unrealized', 'planned_dividend_net', 'realized_gain', 'estimated_sell_tax')
+
+
+class FxRateTable:
+    """Daily rates to PLN: a sorted NumPy array of dates per currency next to its Decimal rates.
+
+    A lookup takes the newest rate on or before the requested day, at most
+    FX_RATE_LOOKBACK old, so weekends and holidays carry Friday's rate forward.
+    Missing rates come back as None; PLN is always 1.
+    """
+
+    def __init__(self, rows=()):
+        points = defaultdict(list)
+        for currency, rate_date, rate in rows:
+            points[currency].append((rate_date.toordinal(), rate))
+        self._series = {}
+        for currency, currency_points in points.items():
+            currency_points.sort(key=lambda point: point[0])
+            self._series[currency] = (
+                np.array([ordinal for ordinal, _ in currency_points], dtype=np.int64),
+                [rate for _, rate in currency_points],
+            )
+
+    def rates_on(self, currency, days):
+        """Rates of one currency for a sequence of dates, located in one searchsorted pass."""
+        ordinals = np.fromiter((day.toordinal() for day in days), dtype=np.int64)
+        if currency == BASE_CURRENCY:
+            return [ONE] * len(ordinals)
+        series = self._series.get(currency)
+        if series is None:
+            return [None] * len(ordinals)
+        series_dates, series_rates = series
+        index = np.searchsorted(series_dates, ordinals, side='right') - 1
+        fresh = (index >= 0) & (ordinals - series_dates[np.maximum(index, 0)] <= FX_RATE_LOOKBACK.days)
+        return [series_rates[position] if found else None for position, found in zip(index.tolist(), fresh.tolist())]
+
+    def rate(self, currency, day):
+        return self.rates_on(currency, [day])[0]
+
+
+def load_fx_rate_table(currencies, start, end):
+    """One query for every rate of `currencies` needed to answer lookups between `start` and `end`."""
+    currencies = set(currencies) - {BASE_CURRENCY}
+    if not currencies:
+        return FxRateTable()
+    return FxRateTable(
+        FxRate.objects
+        .filter(currency__in=currencies, date__gte=start - FX_RATE_LOOKBACK, date__lte=end)
+        .values_list('currency', 'date', 'rate_to_pln')
+    )
+
+
+def consolidate_to_pln(currency_totals, table, day):
+    """Converts the per-currency summary rows to one PLN figure per field.
+
+    Each currency's rate is looked up once and the rate x amount products
+    are summed in Decimal; currencies without a rate are left out and listed
+    under 'missing_currencies'.
+    """
+    if not currency_totals:
+        return None
+    rates = {item['currency']: table.rate(item['currency'], day) for item in currency_totals}
+    converted = [item for item in currency_totals if rates[item['currency']] is not None]
+    return {
+        'currency': BASE_CURRENCY,
+        **{
+            field: sum((item[field] * rates[item['currency']] for item in converted), ZERO).quantize(CENT)
+            for field in CONSOLIDATED_FIELDS
+        },
+        'rates': {currency: rate for currency, rate in rates.items() if currency != BASE_CURRENCY and rate is not None},
+        'missing_currencies': [currency for currency, rate in rates.items() if rate is None],
+    }
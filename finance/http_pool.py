@@ -0,0 +1,214 @@
+import http.client
+import ssl
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 12
+DEFAULT_POOL_SIZE = 8
+IDLE_CONNECTION_TIMEOUT = 30
+MAX_REDIRECTS = 5
+READ_CHUNK_SIZE = 64 * 1024
+DRAIN_LIMIT = 64 * 1024
+USER_AGENT = 'Python-urllib/%d.%d' % sys.version_info[:2]
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, url, code, reason):
+        super().__init__(f'HTTP {code}: {reason}')
+        self.url = url
+        self.code = code
+        self.reason = reason
+
+
+class PooledResponse:
+    """Response whose connection goes back to the pool once the body is fully read and the response closed."""
+
+    def __init__(self, session, key, connection, response, url):
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self._session = session
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._finished = False
+        self._released = False
+        encoding = (response.getheader('Content-Encoding') or '').lower()
+        self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == 'gzip' else None
+
+    def iter_chunks(self, size=READ_CHUNK_SIZE):
+        """Yields the decoded body piece by piece."""
+        while True:
+            chunk = self._response.read(size)
+            if not chunk:
+                break
+            if self._decoder is not None:
+                chunk = self._decoder.decompress(chunk)
+            if chunk:
+                yield chunk
+        if self._decoder is not None:
+            tail = self._decoder.flush()
+            if tail:
+                yield tail
+        self._finished = True
+
+    def read(self):
+        return b''.join(self.iter_chunks())
+
+    def _drain(self):
+        # A short unread remainder is cheaper to skip than a new handshake; large ones close the socket.
+        remaining = self._response.length
+        if remaining is None or remaining > DRAIN_LIMIT:
+            return
+        try:
+            self._response.read()
+        except (OSError, http.client.HTTPException):
+            return
+        self._finished = True
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        if not self._finished:
+            self._drain()
+        if self._finished and not self._response.will_close:
+            self._session._release(self._key, self._connection)
+        else:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class HTTPSession:
+    """Thread-safe keep-alive connection pool over http.client, shared by all market-data clients.
+
+    Idle connections are kept per (scheme, host, port) and reused by the next
+    request to the same host, so repeated calls skip the TCP and TLS handshake.
+    A request that fails on a reused connection the server has already closed
+    is retried once on a fresh one.
+    """
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        self._ssl_context = None
+
+    def _timeouts(self):
+        return (
+            getattr(settings, 'MARKET_DATA_HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+            getattr(settings, 'MARKET_DATA_HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+        )
+
+    def _new_connection(self, key, connect_timeout):
+        scheme, host, port = key
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(host, port, timeout=connect_timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=connect_timeout)
+
+    def _acquire(self, key, connect_timeout):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                connection, released_at = idle.pop()
+                if now - released_at < IDLE_CONNECTION_TIMEOUT:
+                    self._stats['reused'] += 1
+                    return connection, True
+                connection.close()
+            self._stats['opened'] += 1
+        return self._new_connection(key, connect_timeout), False
+
+    def _release(self, key, connection):
+        pool_size = getattr(settings, 'MARKET_DATA_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < pool_size:
+                idle.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def _send(self, method, url, body, headers, read_timeout):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        key = (scheme, parts.hostname, parts.port or (443 if scheme == 'https' else 80))
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        connect_timeout, default_read_timeout = self._timeouts()
+        request_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip', **(headers or {})}
+
+        for attempt in range(2):
+            connection, reused = self._acquire(key, connect_timeout)
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                connection.sock.settimeout(read_timeout or default_read_timeout)
+                connection.request(method, path, body=body, headers=request_headers)
+                response = connection.getresponse()
+            except (ConnectionResetError, BrokenPipeError, http.client.BadStatusLine):
+                connection.close()
+                if reused and attempt == 0:
+                    with self._lock:
+                        self._stats['retries'] += 1
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            with self._lock:
+                self._stats['requests'] += 1
+            return PooledResponse(self, key, connection, response, url)
+
+    def request(self, method, url, *, body=None, headers=None, timeout=None):
+        """Sends the request, following redirects; raises HTTPStatusError for 4xx/5xx answers."""
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._send(method, url, body, headers, timeout)
+            location = response.headers.get('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                response.close()
+                url = urljoin(url, location)
+                if response.status == 303 or (response.status in (301, 302) and method == 'POST'):
+                    method, body = 'GET', None
+                continue
+            if response.status >= 400:
+                response.close()
+                raise HTTPStatusError(url, response.status, response.reason)
+            return response
+        raise HTTPStatusError(url, response.status, 'Zbyt wiele przekierowań')
+
+    def stats(self):
+        with self._lock:
+            stats = {name: self._stats[name] for name in ('requests', 'opened', 'reused', 'retries')}
+            stats['idle'] = sum(len(idle) for idle in self._idle.values())
+        return stats
+
+    def clear(self):
+        with self._lock:
+            idle = [connection for connections in self._idle.values() for connection, _ in connections]
+            self._idle.clear()
+            self._stats.clear()
+        for connection in idle:
+            connection.close()
+
+
+http_session = HTTPSession()
+
+
+def get_http_session_stats():
+    return http_session.stats()
@@ -0,0 +1,149 @@
+from collections import deque
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+
+from .models import BrokerageTransaction, OpenLot, RealizedGain
+
+
+UNIT_COST_QUANTUM = Decimal('0.000000000001')
+AMOUNT_QUANTUM = Decimal('0.0000000001')
+
+
+class Lot:
+    """Unsold remainder of one buy while replaying; only what FIFO matching needs."""
+
+    __slots__ = ('buy_transaction_id', 'trade_date', 'quantity', 'unit_cost')
+
+    def __init__(self, buy_transaction_id, trade_date, quantity, unit_cost):
+        self.buy_transaction_id = buy_transaction_id
+        self.trade_date = trade_date
+        self.quantity = quantity
+        self.unit_cost = unit_cost
+
+
+def fifo_replay(transactions, lots=None):
+    """Matches sells against buy lots first-in, first-out.
+
+    `transactions` must be ordered by (trade_date, id). `lots` is a deque of
+    the Lot objects open before the first transaction, oldest first, and is
+    updated in place. Returns one gain dict per sell.
+    """
+    lots = deque() if lots is None else lots
+    gains = []
+    for transaction in transactions:
+        if transaction.transaction_type == BrokerageTransaction.BUY:
+            total_cost = transaction.quantity * transaction.price + transaction.fees
+            unit_cost = (total_cost / transaction.quantity).quantize(UNIT_COST_QUANTUM)
+            lots.append(Lot(transaction.id, transaction.trade_date, transaction.quantity, unit_cost))
+            continue
+
+        quantity_to_sell = transaction.quantity
+        cost_basis = Decimal('0')
+        allocations = []
+        while quantity_to_sell > 0 and lots:
+            lot = lots[0]
+            consumed_quantity = min(quantity_to_sell, lot.quantity)
+            cost_basis += consumed_quantity * lot.unit_cost
+            lot.quantity -= consumed_quantity
+            quantity_to_sell -= consumed_quantity
+            allocations.append({
+                'buy_transaction_id': lot.buy_transaction_id,
+                'trade_date': lot.trade_date.isoformat(),
+                'quantity': str(consumed_quantity),
+                'unit_cost': str(lot.unit_cost),
+            })
+            if lot.quantity <= 0:
+                lots.popleft()
+
+        proceeds = transaction.quantity * transaction.price - transaction.fees
+        cost_basis = cost_basis.quantize(AMOUNT_QUANTUM)
+        gains.append({
+            'sell_transaction_id': transaction.id,
+            'trade_date': transaction.trade_date,
+            'quantity': transaction.quantity,
+            'proceeds': proceeds.quantize(AMOUNT_QUANTUM),
+            'cost_basis': cost_basis,
+            'gain': (proceeds - cost_basis).quantize(AMOUNT_QUANTUM),
+            'allocations': allocations,
+        })
+    return gains
+
+
+def open_lot(key, lot):
+    """OpenLot row for a replayed Lot."""
+    return OpenLot(
+        **key,
+        buy_transaction_id=lot.buy_transaction_id,
+        trade_date=lot.trade_date,
+        quantity=lot.quantity,
+        unit_cost=lot.unit_cost,
+    )
+
+
+def _lots_open_before(account_id, instrument_id, from_date):
+    """Reconstructs the lots open just before `from_date` from stored lots plus what later sells consumed."""
+    lots = {
+        lot.buy_transaction_id: Lot(lot.buy_transaction_id, lot.trade_date, lot.quantity, lot.unit_cost)
+        for lot in OpenLot.objects.filter(account_id=account_id, instrument_id=instrument_id, trade_date__lt=from_date)
+    }
+    later_gains = RealizedGain.objects.filter(
+        account_id=account_id,
+        instrument_id=instrument_id,
+        trade_date__gte=from_date,
+    ).values_list('allocations', flat=True)
+    for allocations in later_gains:
+        for allocation in allocations:
+            trade_date = date.fromisoformat(allocation['trade_date'])
+            if trade_date >= from_date:
+                continue
+            buy_transaction_id = allocation['buy_transaction_id']
+            quantity = Decimal(allocation['quantity'])
+            if buy_transaction_id in lots:
+                lots[buy_transaction_id].quantity += quantity
+            else:
+                lots[buy_transaction_id] = Lot(buy_transaction_id, trade_date, quantity, Decimal(allocation['unit_cost']))
+    return deque(sorted(lots.values(), key=lambda lot: (lot.trade_date, lot.buy_transaction_id)))
+
+
+def replay_ledger(account_id, instrument_id, from_date=None):
+    """Rebuilds OpenLot/RealizedGain rows of one position from `from_date` on (everything when None)."""
+    key = {'account_id': account_id, 'instrument_id': instrument_id}
+    with db_transaction.atomic():
+        transactions = BrokerageTransaction.objects.filter(**key).order_by('trade_date', 'id')
+        gains_to_replace = RealizedGain.objects.filter(**key)
+        if from_date is None:
+            lots = deque()
+        else:
+            lots = _lots_open_before(account_id, instrument_id, from_date)
+            transactions = transactions.filter(trade_date__gte=from_date)
+            gains_to_replace = gains_to_replace.filter(trade_date__gte=from_date)
+
+        gains = fifo_replay(transactions, lots)
+        OpenLot.objects.filter(**key).delete()
+        gains_to_replace.delete()
+        OpenLot.objects.bulk_create([open_lot(key, lot) for lot in lots if lot.quantity > 0])
+        RealizedGain.objects.bulk_create([RealizedGain(**key, **gain) for gain in gains])
+
+
+def replay_date_for_delete(transaction):
+    """Earliest date a replay must start from once `transaction` is gone."""
+    if transaction.transaction_type == BrokerageTransaction.BUY:
+        return transaction.trade_date
+    allocations = (
+        RealizedGain.objects
+        .filter(sell_transaction_id=transaction.pk)
+        .values_list('allocations', flat=True)
+        .first()
+    ) or []
+    return min(
+        [transaction.trade_date] + [date.fromisoformat(allocation['trade_date']) for allocation in allocations],
+    )
+
+
+def rebuild_ledgers(keys):
+    """Full rebuild for (account_id, instrument_id) pairs; for bulk writes that bypass model signals."""
+    for account_id, instrument_id in set(keys):
+        replay_ledger(account_id, instrument_id)
+
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.models import BrokerageAccount
+from finance.statement_import import StatementImportError, import_statement
+
+
+class Command(BaseCommand):
+    help = (
+        'Importuje transakcje z wyciągu brokera (historia operacji XTB albo historia transakcji mBanku, CSV lub XLSX) '
+        'na wskazane konto maklerskie. Transakcje już zapisane na koncie są pomijane.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Ścieżka do pliku CSV albo XLSX.')
+        parser.add_argument('--account', type=int, required=True, help='Id konta maklerskiego.')
+
+    def handle(self, *args, **options):
+        try:
+            account = BrokerageAccount.objects.select_related('user').get(pk=options['account'])
+        except BrokerageAccount.DoesNotExist:
+            raise CommandError(f"Nie ma konta maklerskiego o id {options['account']}.")
+
+        try:
+            with open(options['path'], 'rb') as file:
+                result = import_statement(account, file)
+        except (OSError, StatementImportError) as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(
+            f"Wiersze: {result['rows']}, dodane: {result['created']}, duplikaty: {result['duplicates']}, "
+            f"pominięte: {result['skipped']}, nowe instrumenty: {result['instruments_created']}"
+        )
+        if result['skipped_lines']:
+            self.stdout.write(f"Pominięte wiersze: {', '.join(map(str, result['skipped_lines'][:50]))}")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.fx_import import FxRateError, import_fx_rates_csv
+
+
+class Command(BaseCommand):
+    help = (
+        'Wczytuje dzienne kursy walut do PLN z pliku CSV: archiwum NBP (data;1USD;1EUR;...) '
+        'albo wiersze date,currency,rate. Istniejące kursy z tego samego dnia są nadpisywane.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Ścieżka do pliku CSV.')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Kodowanie pliku; archiwum NBP to zwykle cp1250.')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], encoding=options['encoding'], newline='') as file:
+                saved = import_fx_rates_csv(file)
+        except (OSError, FxRateError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(f'Zapisane kursy: {saved}')
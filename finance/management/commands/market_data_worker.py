@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from finance.refresh_jobs import claim_next_job, default_worker_name, recover_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Przetwarza kolejkę zadań odświeżania danych rynkowych.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Przetwórz oczekujące zadania i zakończ.')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Przerwa między sprawdzeniami kolejki (s).')
+        parser.add_argument('--max-jobs', type=int, default=0, help='Zakończ po tylu zadaniach (0 = bez limitu).')
+
+    def handle(self, *args, **options):
+        worker = default_worker_name()
+        processed = 0
+        while True:
+            close_old_connections()
+            requeued, failed = recover_stale_jobs()
+            if requeued or failed:
+                self.stdout.write(f'Wznowione zadania: {requeued}, porzucone: {failed}')
+
+            job = claim_next_job(worker)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            run_job(job)
+            processed += 1
+            self.stdout.write(
+                f'Zadanie #{job.pk} ({job.user}): {job.get_status_display()} '
+                f'[{job.progress_done}/{job.progress_total}]'
+            )
+            if options['max_jobs'] and processed >= options['max_jobs']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f'Przetworzone zadania: {processed}'))
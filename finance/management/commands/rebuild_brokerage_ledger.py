@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from finance.ledger import rebuild_ledgers
+from finance.models import BrokerageTransaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Przebudowuje od zera tabele otwartych pozycji (OpenLot) i zrealizowanych zysków (RealizedGain). '
+        'Potrzebne tylko po masowych zmianach transakcji z pominięciem modeli.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Nazwa użytkownika; domyślnie wszyscy.')
+
+    def handle(self, *args, **options):
+        transactions = BrokerageTransaction.objects.all()
+        if options['user']:
+            transactions = transactions.filter(account__user__username=options['user'])
+        keys = set(transactions.values_list('account_id', 'instrument_id'))
+        rebuild_ledgers(keys)
+        self.stdout.write(f'Przebudowane pozycje: {len(keys)}')
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from finance.market_data import refresh_all_market_data
+
+
+class Command(BaseCommand):
+    help = (
+        'Odświeża notowania i dywidendy wszystkich użytkowników, pobierając każdy symbol raz. '
+        'Przeznaczone do uruchamiania z crona, np. co noc: '
+        '0 5 * * * python manage.py refresh_all_market_data'
+    )
+
+    def handle(self, *args, **options):
+        result = refresh_all_market_data()
+
+        self.stdout.write(
+            f"Użytkownicy: {result['users']}, instrumenty: {result['instruments']}, "
+            f"unikalne symbole: {result['symbols']}"
+        )
+        self.stdout.write(
+            f"Odświeżone ceny: {result['updated_quotes']}, nieudane: {result['failed_instruments']}, "
+            f"scalone instrumenty: {result['merged_instruments']}, nowe dywidendy: {result['updated_dividends']}"
+        )
+        self.stdout.write(
+            f"Czas: {result['elapsed']:.2f} s, przepustowość: {result['instruments_per_second']:.1f} instrumentów/s"
+        )
+        calls = ', '.join(f'{provider}: {count}' for provider, count in sorted(result['provider_calls'].items()))
+        self.stdout.write(f"Wywołania dostawców: {calls or 'brak'}")
+        self.stdout.write(
+            f"Cache ISIN: {result['resolution_cache']['hit_ratio']:.0%} trafień, "
+            f"cache notowań: {result['quote_cache']['hit_ratio']:.0%} trafień"
+        )
+
+        for message in result['failed_quotes'][:10]:
+            self.stdout.write(self.style.WARNING(f'Cena: {message}'))
+        for message in result['failed_dividends'][:10]:
+            self.stdout.write(self.style.WARNING(f'Dywidendy: {message}'))
+
+        style = self.style.WARNING if result['failed_instruments'] else self.style.SUCCESS
+        self.stdout.write(style('Zakończono odświeżanie danych rynkowych.'))
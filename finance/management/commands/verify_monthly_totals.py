@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from finance.account_utils import reconcile_monthly_totals
+from finance.models import Monthly
+
+
+class Command(BaseCommand):
+    help = (
+        'Porównuje sumy miesięczne (Monthly) i sumy kategorii (MonthlyCategoryTotal) '
+        'z wydatkami i przychodami tego miesiąca i poprawia rozbieżności zbiorczo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, help='ID konta finansowego; domyślnie wszystkie.')
+        parser.add_argument('--dry-run', action='store_true', help='Tylko wypisz rozbieżności, bez zapisu.')
+
+    def handle(self, *args, **options):
+        months = Monthly.objects.all()
+        if options['account']:
+            months = months.filter(account_id=options['account'])
+        drifted = reconcile_monthly_totals(months, dry_run=options['dry_run'])
+        for month, old_income, old_expense, categories_drifted in drifted:
+            line = f'{month}: przychody {old_income} -> {month.total_income}, wydatki {old_expense} -> {month.total_expense}'
+            if categories_drifted:
+                line += ', sumy kategorii przebudowane'
+            self.stdout.write(line)
+        action = 'do poprawy' if options['dry_run'] else 'poprawione'
+        self.stdout.write(f'Sprawdzone miesiące: {months.count()}, {action}: {len(drifted)}')
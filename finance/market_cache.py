@@ -0,0 +1,297 @@
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .models import InstrumentResolution
+
+
+DEFAULT_RESOLUTION_TTL = timedelta(days=30)
+DEFAULT_NEGATIVE_RESOLUTION_TTL = timedelta(hours=24)
+DEFAULT_RESOLUTION_LRU_SIZE = 1024
+DEFAULT_QUOTE_TTL = timedelta(minutes=15)
+MARKET_DATA_CACHE_ALIAS = 'market_data'
+
+
+def resolution_key(isin, exchange='', currency=''):
+    return (
+        (isin or '').strip().upper(),
+        (exchange or '').strip().upper(),
+        (currency or '').strip().upper(),
+    )
+
+
+class ResolutionEntry:
+    """Cached OpenFIGI answer for one (isin, exchange, currency) key; `resolved` is None when not found."""
+
+    __slots__ = ('resolved', 'error', 'resolved_at')
+
+    def __init__(self, resolved, error='', resolved_at=None):
+        self.resolved = resolved
+        self.error = error
+        self.resolved_at = resolved_at or timezone.now()
+
+    @property
+    def found(self):
+        return self.resolved is not None
+
+    def is_fresh(self, now=None):
+        now = now or timezone.now()
+        if self.found:
+            ttl = getattr(settings, 'MARKET_DATA_RESOLUTION_TTL', DEFAULT_RESOLUTION_TTL)
+        else:
+            ttl = getattr(settings, 'MARKET_DATA_NEGATIVE_RESOLUTION_TTL', DEFAULT_NEGATIVE_RESOLUTION_TTL)
+        return self.resolved_at + ttl > now
+
+
+def _entry_from_row(row):
+    if not row.found:
+        return ResolutionEntry(None, row.error, row.resolved_at)
+    return ResolutionEntry(
+        {
+            'symbol': row.symbol,
+            'name': row.name,
+            'isin': row.resolved_isin or row.isin,
+            'exchange': row.resolved_exchange,
+            'currency': row.currency,
+            'figi': row.figi,
+        },
+        resolved_at=row.resolved_at,
+    )
+
+
+def _row_from_entry(key, entry):
+    isin, exchange, currency = key
+    resolved = entry.resolved or {}
+    return InstrumentResolution(
+        isin=isin,
+        exchange=exchange,
+        currency=currency,
+        found=entry.found,
+        symbol=resolved.get('symbol', '')[:32],
+        name=resolved.get('name', '')[:160],
+        resolved_isin=resolved.get('isin', '')[:12],
+        resolved_exchange=resolved.get('exchange', '')[:40],
+        figi=resolved.get('figi', '')[:12],
+        error=entry.error[:255],
+        resolved_at=entry.resolved_at,
+    )
+
+
+class ResolutionCache:
+    """ISIN -> symbol cache: an in-process LRU in front of the InstrumentResolution table.
+
+    The LRU is thread-safe, so refresh worker threads can read it and record
+    new answers with persist=False; those are written to the table later by
+    flush() from the thread that owns the database transaction.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def _maxsize(self):
+        return getattr(settings, 'MARKET_DATA_RESOLUTION_LRU_SIZE', DEFAULT_RESOLUTION_LRU_SIZE)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize():
+            self._entries.popitem(last=False)
+
+    def _count_hit(self, layer, entry):
+        self._stats[f'{layer}_hits'] += 1
+        if not entry.found:
+            self._stats['negative_hits'] += 1
+
+    def get(self, key, use_db=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.is_fresh():
+                    self._entries.move_to_end(key)
+                    self._count_hit('lru', entry)
+                    return entry
+                del self._entries[key]
+                self._stats['expired'] += 1
+
+        if use_db:
+            row = InstrumentResolution.objects.filter(isin=key[0], exchange=key[1], currency=key[2]).first()
+            if row is not None:
+                entry = _entry_from_row(row)
+                if entry.is_fresh():
+                    with self._lock:
+                        self._remember(key, entry)
+                        self._count_hit('db', entry)
+                    return entry
+                with self._lock:
+                    self._stats['expired'] += 1
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def load_many(self, keys):
+        """Warms the LRU with fresh table rows for all keys in a single query."""
+        with self._lock:
+            missing = {key for key in keys if key[0] and key not in self._entries}
+        if not missing:
+            return
+
+        rows = InstrumentResolution.objects.filter(isin__in={key[0] for key in missing})
+        with self._lock:
+            for row in rows:
+                key = (row.isin, row.exchange, row.currency)
+                if key not in missing:
+                    continue
+                entry = _entry_from_row(row)
+                if entry.is_fresh():
+                    self._remember(key, entry)
+
+    def store(self, key, resolved=None, error='', persist=True):
+        entry = ResolutionEntry(dict(resolved) if resolved else None, error)
+        with self._lock:
+            self._remember(key, entry)
+            self._stats['stores'] += 1
+            if not persist:
+                self._pending[key] = entry
+        if persist:
+            self._save([(key, entry)])
+        return entry
+
+    def flush(self):
+        with self._lock:
+            pending = list(self._pending.items())
+            self._pending.clear()
+        self._save(pending)
+
+    def _save(self, items):
+        if not items:
+            return
+        InstrumentResolution.objects.bulk_create(
+            [_row_from_entry(key, entry) for key, entry in items],
+            update_conflicts=True,
+            unique_fields=['isin', 'exchange', 'currency'],
+            update_fields=[
+                'found', 'symbol', 'name', 'resolved_isin', 'resolved_exchange', 'figi', 'error', 'resolved_at',
+            ],
+        )
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                name: self._stats[name]
+                for name in ('lru_hits', 'db_hits', 'negative_hits', 'misses', 'expired', 'stores')
+            }
+            stats['size'] = len(self._entries)
+        stats['hits'] = stats['lru_hits'] + stats['db_hits']
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+            self._stats.clear()
+
+
+resolution_cache = ResolutionCache()
+
+
+def get_resolution_cache_stats():
+    return resolution_cache.stats()
+
+
+class QuoteStore:
+    """Quote cache shared by all users, keyed by (provider, price symbol).
+
+    Values live in the `market_data` cache for MARKET_DATA_QUOTE_TTL, so every
+    user holding the same ticker reuses one provider answer. Concurrent misses
+    for the same key collapse into a single in-flight fetch whose result (or
+    error) is handed to every waiting caller.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    @property
+    def _cache(self):
+        return caches[MARKET_DATA_CACHE_ALIAS]
+
+    def _cache_key(self, provider, symbol):
+        return f"quote:{provider.lower().replace(' ', '-')}:{symbol.lower()}"
+
+    def _timeout(self):
+        return getattr(settings, 'MARKET_DATA_QUOTE_TTL', DEFAULT_QUOTE_TTL).total_seconds()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def peek(self, provider, symbol):
+        """The cached price, or None; never fetches."""
+        price = self._cache.get(self._cache_key(provider, symbol))
+        self._count('hits' if price is not None else 'misses')
+        return price
+
+    def get_or_fetch(self, provider, symbol, fetch):
+        key = self._cache_key(provider, symbol)
+        price = self._cache.get(key)
+        if price is not None:
+            self._count('hits')
+            return price
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+                self._stats['misses'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            price = fetch()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            self._cache.set(key, price, self._timeout())
+            future.set_result(price)
+            return price
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = {name: self._stats[name] for name in ('hits', 'misses', 'coalesced')}
+            stats['in_flight'] = len(self._in_flight)
+        lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_ratio'] = round((stats['hits'] + stats['coalesced']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        self._cache.clear()
+        with self._lock:
+            self._stats.clear()
+
+
+quote_store = QuoteStore()
+
+
+def get_quote_store_stats():
+    return quote_store.stats()
@@ -1,30 +1,293 @@
+import codecs
 import csv
+import http.client
 import json
-from datetime import timedelta
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
 from decimal import Decimal, InvalidOperation
-from io import StringIO
-from urllib.error import HTTPError, URLError
 from urllib.parse import quote_plus, urlencode
-from urllib.request import Request, urlopen
 
 from django.conf import settings
-from django.db import transaction
+from django.db import close_old_connections, transaction
+from django.db.models import Q
 from django.utils import timezone
 
-from .brokerage import get_quantity
-from .models import BrokerageAccount, BrokerageDividend, BrokerageInstrument
+from .brokerage import PositionHistory
+from .http_pool import HTTPStatusError, http_session
+from .ledger import rebuild_ledgers
+from .market_cache import quote_store, resolution_cache, resolution_key
+from .models import BrokerageAccount, BrokerageDividend, BrokerageInstrument, BrokerageTransaction, PriceBar
+from .price_history import (
+    DAILY_CLOSE_LOOKBACK,
+    missing_daily_ranges,
+    record_fetched_range,
+    save_price_bars,
+    stored_daily_close,
+)
+from .summary_cache import summary_cache
 
 
 ALPHA_VANTAGE_URL = 'https://www.alphavantage.co/query'
 OPENFIGI_MAPPING_URL = 'https://api.openfigi.com/v3/mapping'
 STOOQ_QUOTE_URL = 'https://stooq.pl/q/l/'
 STOOQ_DAILY_URL = 'https://stooq.com/q/d/l/'
+OPENFIGI_MAX_JOBS_WITHOUT_KEY = 10
+OPENFIGI_MAX_JOBS_WITH_KEY = 100
+
+DEFAULT_MARKET_DATA_MAX_WORKERS = 8
+DEFAULT_PROVIDER_CONCURRENCY = {
+    'OpenFIGI': 2,
+    'Stooq': 4,
+    'Alpha Vantage': 1,
+}
+
+# (requests, seconds): free-tier budgets published by the providers.
+DEFAULT_PROVIDER_RATE_LIMITS = {
+    'OpenFIGI': (25, 60),
+    'Stooq': (10, 1),
+    'Alpha Vantage': (5, 60),
+}
+OPENFIGI_RATE_LIMIT_WITH_KEY = (25, 6)
+DEFAULT_RATE_LIMIT_MAX_WAIT = 15
+DEFAULT_BREAKER_FAILURE_THRESHOLD = 3
+DEFAULT_BREAKER_RESET_SECONDS = 60
+
+_provider_semaphores = {}
+_provider_limiters = {}
+_provider_breakers = {}
+_provider_calls = Counter()
+_provider_semaphores_lock = threading.Lock()
 
 
 class MarketDataError(Exception):
     pass
 
 
+class InstrumentNotFoundError(MarketDataError):
+    pass
+
+
+class ProviderUnavailableError(MarketDataError):
+    """The provider did not answer (connection error, timeout, HTTP 5xx) or is switched off by its breaker."""
+
+
+class ProviderThrottledError(ProviderUnavailableError):
+    pass
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` calls per `per` seconds with bursts up to `rate`."""
+
+    def __init__(self, rate, per):
+        self.capacity = max(1, int(rate))
+        self.refill_rate = self.capacity / max(float(per), 0.001)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+        self.rejected = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_rate)
+        self._updated = now
+
+    def reserve(self, max_wait):
+        """Takes one token and returns how long the caller must sleep, or None when that exceeds max_wait."""
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (1 - self._tokens) / self.refill_rate)
+            if wait > max_wait:
+                self.rejected += 1
+                return None
+            # Tokens may go negative: later callers queue up behind this reservation.
+            self._tokens -= 1
+            self.waited += wait
+            return wait
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, self._tokens)
+
+
+class CircuitBreaker:
+    """Stops calling a provider after repeated failures; one trial call is let through after reset_timeout."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, provider, failure_threshold, reset_timeout):
+        self.provider = provider
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self.last_error = ''
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise ProviderUnavailableError(
+                        f'{self.provider} jest chwilowo wyłączony po błędach ({self.last_error}). '
+                        f'Ponowna próba za {remaining:.0f} s.'
+                    )
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    self.rejected += 1
+                    raise ProviderUnavailableError(f'{self.provider} jest sprawdzany po awarii, spróbuj ponownie za chwilę.')
+                self._trial_in_flight = True
+
+    def cancel_call(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, error, trip=False):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)[:200]
+            self._trial_in_flight = False
+            if trip or self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'retry_in': round(retry_in, 1),
+                'last_error': self.last_error,
+            }
+
+
+def _provider_rate_limit(provider):
+    configured = getattr(settings, 'MARKET_DATA_PROVIDER_RATE_LIMITS', {})
+    if provider in configured:
+        return configured[provider]
+    if provider == 'OpenFIGI' and getattr(settings, 'OPENFIGI_API_KEY', ''):
+        return OPENFIGI_RATE_LIMIT_WITH_KEY
+    return DEFAULT_PROVIDER_RATE_LIMITS.get(provider, (1, 1))
+
+
+def _provider_guards(provider):
+    with _provider_semaphores_lock:
+        semaphore = _provider_semaphores.get(provider)
+        if semaphore is None:
+            limits = {
+                **DEFAULT_PROVIDER_CONCURRENCY,
+                **getattr(settings, 'MARKET_DATA_PROVIDER_CONCURRENCY', {}),
+            }
+            semaphore = threading.BoundedSemaphore(max(1, int(limits.get(provider, 1))))
+            _provider_semaphores[provider] = semaphore
+
+        limiter = _provider_limiters.get(provider)
+        if limiter is None:
+            limiter = TokenBucket(*_provider_rate_limit(provider))
+            _provider_limiters[provider] = limiter
+
+        breaker = _provider_breakers.get(provider)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                provider,
+                getattr(settings, 'MARKET_DATA_BREAKER_FAILURE_THRESHOLD', DEFAULT_BREAKER_FAILURE_THRESHOLD),
+                getattr(settings, 'MARKET_DATA_BREAKER_RESET_SECONDS', DEFAULT_BREAKER_RESET_SECONDS),
+            )
+            _provider_breakers[provider] = breaker
+        return semaphore, limiter, breaker
+
+
+@contextmanager
+def _provider_slot(provider):
+    """Guards one provider call: concurrency cap, rate limit and circuit breaker shared by all threads.
+
+    Calls to a provider whose breaker is open fail immediately. Otherwise the
+    caller waits for a rate-limit token for at most MARKET_DATA_RATE_LIMIT_MAX_WAIT
+    seconds; ProviderUnavailableError raised by the call counts as a failure,
+    throttling answers open the breaker at once.
+    """
+    semaphore, limiter, breaker = _provider_guards(provider)
+    with semaphore:
+        breaker.before_call()
+        wait = limiter.reserve(getattr(settings, 'MARKET_DATA_RATE_LIMIT_MAX_WAIT', DEFAULT_RATE_LIMIT_MAX_WAIT))
+        if wait is None:
+            breaker.cancel_call()
+            raise ProviderThrottledError(f'Wyczerpano limit zapytań do {provider}, spróbuj ponownie później.')
+        if wait:
+            time.sleep(wait)
+        with _provider_semaphores_lock:
+            _provider_calls[provider] += 1
+
+        try:
+            yield
+        except ProviderUnavailableError as exc:
+            breaker.record_failure(exc, trip=isinstance(exc, ProviderThrottledError))
+            raise
+        except Exception:
+            breaker.record_success()
+            raise
+        else:
+            breaker.record_success()
+
+
+def get_provider_health():
+    with _provider_semaphores_lock:
+        providers = sorted(set(_provider_limiters) | set(_provider_breakers))
+        guards = [(name, _provider_limiters.get(name), _provider_breakers.get(name)) for name in providers]
+        calls = dict(_provider_calls)
+    health = {}
+    for name, limiter, breaker in guards:
+        health[name] = {
+            **(breaker.snapshot() if breaker else {}),
+            'calls': calls.get(name, 0),
+            'tokens': round(limiter.available(), 2) if limiter else None,
+            'throttled_wait': round(limiter.waited, 2) if limiter else 0.0,
+            'throttled_rejected': limiter.rejected if limiter else 0,
+        }
+    return health
+
+
+def provider_call_counts():
+    """Requests actually sent to each provider since start (or the last reset_provider_guards())."""
+    with _provider_semaphores_lock:
+        return dict(_provider_calls)
+
+
+def reset_provider_guards():
+    with _provider_semaphores_lock:
+        _provider_semaphores.clear()
+        _provider_limiters.clear()
+        _provider_breakers.clear()
+        _provider_calls.clear()
+
+
 def _decimal(value):
     try:
         return Decimal(str(value))
@@ -32,26 +295,37 @@ def _decimal(value):
         return None
 
 
+def _http_error(exc):
+    message = f'Dostawca danych zwrócił HTTP {exc.code}: {exc.reason}'
+    if exc.code == 429:
+        return ProviderThrottledError(message)
+    if exc.code >= 500:
+        return ProviderUnavailableError(message)
+    return MarketDataError(message)
+
+
+def _connection_error(exc):
+    return ProviderUnavailableError(
+        f'Nie udało się połączyć z dostawcą danych: {getattr(exc, "reason", None) or exc}'
+    )
+
+
 def _request_json(url, *, data=None, headers=None):
     request_headers = headers or {}
+    body = None
+    method = 'GET'
     if data is not None:
         request_headers = {'Content-Type': 'application/json', **request_headers}
-        request = Request(
-            url,
-            data=json.dumps(data).encode('utf-8'),
-            headers=request_headers,
-            method='POST',
-        )
-    else:
-        request = Request(url, headers=request_headers)
+        body = json.dumps(data).encode('utf-8')
+        method = 'POST'
 
     try:
-        with urlopen(request, timeout=12) as response:
+        with http_session.request(method, url, body=body, headers=request_headers) as response:
             return json.loads(response.read().decode('utf-8'))
-    except HTTPError as exc:
-        raise MarketDataError(f'Dostawca danych zwrócił HTTP {exc.code}: {exc.reason}') from exc
-    except URLError as exc:
-        raise MarketDataError(f'Nie udało się połączyć z dostawcą danych: {exc.reason}') from exc
+    except HTTPStatusError as exc:
+        raise _http_error(exc) from exc
+    except (OSError, http.client.HTTPException) as exc:
+        raise _connection_error(exc) from exc
     except json.JSONDecodeError as exc:
         raise MarketDataError('Dostawca danych zwrócił nieprawidłową odpowiedź JSON.') from exc
 
@@ -60,15 +334,76 @@ def _get_json(url):
     return _request_json(url)
 
 
-def _read_csv_url(url, timeout=12):
+class CSVRowStream:
+    """Lazily parsed CSV body: decodes the response incrementally and yields csv.DictReader rows.
+
+    The underlying pooled response is closed when the rows run out or on close(),
+    so callers can stop after the first row without downloading the rest.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self._rows = csv.DictReader(self._lines())
+
+    def _lines(self):
+        decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        pending = ''
+        for chunk in self._response.iter_chunks():
+            pending += decoder.decode(chunk)
+            *complete, pending = pending.split('\n')
+            for line in complete:
+                yield f'{line}\n'
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            yield pending
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._rows)
+        except StopIteration:
+            self.close()
+            raise
+        except (OSError, http.client.HTTPException) as exc:
+            self.close()
+            raise _connection_error(exc) from exc
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _read_csv_url(url, timeout=None):
+    """Sends the request right away, so HTTP errors surface here, and returns a lazy CSVRowStream."""
+    try:
+        response = http_session.request('GET', url, timeout=timeout)
+    except HTTPStatusError as exc:
+        raise _http_error(exc) from exc
+    except (OSError, http.client.HTTPException) as exc:
+        raise _connection_error(exc) from exc
+    return CSVRowStream(response)
+
+
+def _first_row(rows):
+    rows = iter(rows)
     try:
-        with urlopen(url, timeout=timeout) as response:
-            content = response.read().decode('utf-8-sig')
-        return list(csv.DictReader(StringIO(content)))
-    except HTTPError as exc:
-        raise MarketDataError(f'Dostawca danych zwrócił HTTP {exc.code}: {exc.reason}') from exc
-    except URLError as exc:
-        raise MarketDataError(f'Nie udało się połączyć z dostawcą danych: {exc.reason}') from exc
+        return next(rows, None)
+    finally:
+        close = getattr(rows, 'close', None)
+        if close is not None:
+            close()
+
+
+def _last_rows(rows, count, predicate=None):
+    """Keeps only the last `count` matching rows, so long downloads are scanned in constant memory."""
+    return list(deque((row for row in rows if predicate is None or predicate(row)), maxlen=count))
 
 
 def _is_warsaw_market(exchange='', currency=''):
@@ -101,6 +436,43 @@ def _stooq_symbol_candidates(symbol, exchange='', currency=''):
     return candidates
 
 
+def daily_bar_symbols(instrument):
+    """PriceBar symbols an instrument's daily closes may be stored under, most likely first."""
+    return _stooq_symbol_candidates(instrument.price_symbol or instrument.ticker, instrument.exchange, instrument.currency)
+
+
+def _bump_bar_symbol_holders(stooq_symbol):
+    """Invalidates cached portfolios whose history reads closes stored under `stooq_symbol`."""
+    base_symbol = stooq_symbol.split('.')[0]
+    instruments = BrokerageInstrument.objects.filter(
+        Q(ticker__istartswith=base_symbol) | Q(price_symbol__istartswith=base_symbol)
+    ).only('user_id', 'ticker', 'price_symbol', 'exchange', 'currency')
+    summary_cache.bump_many(
+        instrument.user_id for instrument in instruments if stooq_symbol in daily_bar_symbols(instrument)
+    )
+
+
+def _price_bars_from_rows(stooq_symbol, rows):
+    for row in rows:
+        try:
+            bar_date = date.fromisoformat((row.get('Date') or row.get('Data') or '').strip())
+        except ValueError:
+            continue
+        close = _extract_stooq_price(row)
+        if close is None:
+            continue
+        volume = _decimal(row.get('Volume') or row.get('Wolumen'))
+        yield PriceBar(
+            symbol=stooq_symbol,
+            date=bar_date,
+            open=_decimal(row.get('Open') or row.get('Otwarcie')),
+            high=_decimal(row.get('High') or row.get('Najwyzszy')),
+            low=_decimal(row.get('Low') or row.get('Najnizszy')),
+            close=close,
+            volume=int(volume) if volume is not None and volume.is_finite() else None,
+        )
+
+
 def _stooq_lookup_url(query):
     clean_query = (query or '').strip()
     if not clean_query:
@@ -132,12 +504,14 @@ class AlphaVantageClient:
 
     def _get(self, params):
         params = {**params, 'apikey': self.api_key}
-        payload = _get_json(f"{ALPHA_VANTAGE_URL}?{urlencode(params)}")
-
-        if 'Error Message' in payload:
-            raise MarketDataError(payload['Error Message'])
-        if 'Note' in payload:
-            raise MarketDataError(payload['Note'])
+        with _provider_slot(self.source_name):
+            payload = _get_json(f"{ALPHA_VANTAGE_URL}?{urlencode(params)}")
+            if 'Error Message' in payload:
+                raise MarketDataError(payload['Error Message'])
+            # Alpha Vantage signals exhausted quota with HTTP 200 and a Note/Information message.
+            for key in ('Note', 'Information'):
+                if key in payload:
+                    raise ProviderThrottledError(payload[key])
         return payload
 
     def fetch_dividends(self, symbol):
@@ -147,6 +521,9 @@ class AlphaVantageClient:
         return payload.get('data') or []
 
     def fetch_quote(self, symbol):
+        return quote_store.get_or_fetch(self.source_name, symbol.strip().upper(), lambda: self._fetch_quote(symbol))
+
+    def _fetch_quote(self, symbol):
         payload = self._get({'function': 'GLOBAL_QUOTE', 'symbol': symbol})
         quote = payload.get('Global Quote') or {}
         price = _decimal(quote.get('05. price'))
@@ -159,42 +536,82 @@ class StooqClient:
     source_name = 'Stooq'
 
     def fetch_quote(self, symbol, exchange='', currency=''):
+        candidates = _stooq_symbol_candidates(symbol, exchange, currency)
+        return quote_store.get_or_fetch(self.source_name, '|'.join(candidates), lambda: self._fetch_quote(candidates))
+
+    def _fetch_quote(self, candidates):
         errors = []
-        for stooq_symbol in _stooq_symbol_candidates(symbol, exchange, currency):
+        for stooq_symbol in candidates:
             params = urlencode({'s': stooq_symbol, 'f': 'sd2t2ohlcv', 'h': '', 'e': 'csv'})
-            rows = _read_csv_url(f'{STOOQ_QUOTE_URL}?{params}')
-            if not rows:
+            with _provider_slot(self.source_name):
+                row = _first_row(_read_csv_url(f'{STOOQ_QUOTE_URL}?{params}'))
+            if row is None:
                 errors.append(f'{stooq_symbol}: brak danych')
                 continue
 
-            price = _extract_stooq_price(rows[0])
+            price = _extract_stooq_price(row)
             if price is not None:
                 return price
 
-            errors.append(f'{stooq_symbol}: brak ceny ({_row_preview(rows[0])})')
+            errors.append(f'{stooq_symbol}: brak ceny ({_row_preview(row)})')
 
         raise MarketDataError(f'Nie udało się pobrać ceny Stooq. Próby: {"; ".join(errors)}.')
 
     def fetch_daily_close(self, symbol, trade_date, exchange='', currency=''):
         errors = []
+        today = timezone.localdate()
         for stooq_symbol in _stooq_symbol_candidates(symbol, exchange, currency):
-            date_from = (trade_date - timedelta(days=7)).strftime('%Y%m%d')
-            date_to = trade_date.strftime('%Y%m%d')
-            params = urlencode({'s': stooq_symbol, 'd1': date_from, 'd2': date_to, 'i': 'd'})
-            rows = _read_csv_url(f'{STOOQ_DAILY_URL}?{params}')
-            valid_rows = [row for row in rows if row.get('Date') and row.get('Date') != 'No data']
-            if not valid_rows:
-                errors.append(f'{stooq_symbol}: brak dziennych danych')
-                continue
-
-            price = _extract_stooq_price(valid_rows[-1])
+            if trade_date >= today:
+                price = self._fetch_recent_close(stooq_symbol, trade_date, errors)
+            else:
+                self.backfill_daily_bars(stooq_symbol, trade_date, until=today - timedelta(days=1))
+                price = stored_daily_close(stooq_symbol, trade_date)
+                if price is None:
+                    errors.append(f'{stooq_symbol}: brak dziennych danych')
             if price is not None:
                 return price
 
-            errors.append(f'{stooq_symbol}: brak ceny zamknięcia ({_row_preview(valid_rows[-1])})')
-
         raise MarketDataError(f'Brak dziennych danych Stooq. Próby: {"; ".join(errors)}.')
 
+    def backfill_daily_bars(self, stooq_symbol, trade_date, until):
+        """Downloads only the part of the daily series not fetched before; returns stored bar count."""
+        saved = 0
+        for date_from, date_to in missing_daily_ranges(stooq_symbol, trade_date, until):
+            if date_from > date_to:
+                continue
+            params = urlencode({
+                's': stooq_symbol,
+                'd1': date_from.strftime('%Y%m%d'),
+                'd2': date_to.strftime('%Y%m%d'),
+                'i': 'd',
+            })
+            # The stream is read inside the slot so the download holds the provider's
+            # concurrency slot and a connection lost mid-body reaches the breaker.
+            with _provider_slot(self.source_name):
+                rows = _read_csv_url(f'{STOOQ_DAILY_URL}?{params}')
+                saved += save_price_bars(_price_bars_from_rows(stooq_symbol, rows))
+            record_fetched_range(stooq_symbol, date_from, date_to)
+        if saved:
+            _bump_bar_symbol_holders(stooq_symbol)
+        return saved
+
+    def _fetch_recent_close(self, stooq_symbol, trade_date, errors):
+        # Today's bar is still moving, so it is read live and never stored.
+        date_from = (trade_date - DAILY_CLOSE_LOOKBACK).strftime('%Y%m%d')
+        date_to = trade_date.strftime('%Y%m%d')
+        params = urlencode({'s': stooq_symbol, 'd1': date_from, 'd2': date_to, 'i': 'd'})
+        with _provider_slot(self.source_name):
+            rows = _read_csv_url(f'{STOOQ_DAILY_URL}?{params}')
+            valid_rows = _last_rows(rows, 1, lambda row: row.get('Date') and row.get('Date') != 'No data')
+        if not valid_rows:
+            errors.append(f'{stooq_symbol}: brak dziennych danych')
+            return None
+
+        price = _extract_stooq_price(valid_rows[-1])
+        if price is None:
+            errors.append(f'{stooq_symbol}: brak ceny zamknięcia ({_row_preview(valid_rows[-1])})')
+        return price
+
 
 class OpenFigiClient:
     source_name = 'OpenFIGI'
@@ -223,40 +640,99 @@ class OpenFigiClient:
 
         return filters
 
-    def search_by_isin(self, isin, exchange='', currency=''):
-        clean_isin = (isin or '').strip().upper()
-        if not clean_isin:
-            raise MarketDataError('Podaj ISIN instrumentu.')
+    def _max_jobs_per_request(self):
+        default_limit = OPENFIGI_MAX_JOBS_WITH_KEY if self.api_key else OPENFIGI_MAX_JOBS_WITHOUT_KEY
+        return max(1, int(getattr(settings, 'OPENFIGI_MAX_JOBS_PER_REQUEST', 0) or default_limit))
 
-        base_job = {'idType': 'ID_ISIN', 'idValue': clean_isin}
+    def _jobs_for(self, isin, exchange='', currency=''):
+        base_job = {'idType': 'ID_ISIN', 'idValue': isin}
         filtered_job = {**base_job, **self._market_filters(exchange, currency)}
-        jobs = [filtered_job, base_job] if filtered_job != base_job else [base_job]
-
-        payload = _request_json(OPENFIGI_MAPPING_URL, data=jobs, headers=self._headers())
-        if not isinstance(payload, list):
-            raise MarketDataError('OpenFIGI zwróciło nieprawidłową odpowiedź.')
-
-        records = []
-        for result in payload:
-            records.extend(result.get('data') or [])
+        return [filtered_job, base_job] if filtered_job != base_job else [base_job]
 
+    def _resolved_from_records(self, records, isin, exchange='', currency=''):
         record = self._select_record(records, exchange, currency)
         if not record:
-            raise MarketDataError(f'Nie znaleziono instrumentu dla ISIN {clean_isin}.')
+            raise InstrumentNotFoundError(f'Nie znaleziono instrumentu dla ISIN {isin}.')
 
         symbol = record.get('ticker')
         if not symbol:
-            raise MarketDataError(f'OpenFIGI nie zwróciło tickera dla ISIN {clean_isin}.')
+            raise InstrumentNotFoundError(f'OpenFIGI nie zwróciło tickera dla ISIN {isin}.')
 
         return {
             'symbol': symbol,
             'name': record.get('name') or record.get('securityDescription') or '',
-            'isin': record.get('isin') or clean_isin,
+            'isin': record.get('isin') or isin,
             'exchange': record.get('micCode') or record.get('exchCode') or '',
             'currency': currency or '',
             'figi': record.get('figi', ''),
         }
 
+    def search_by_isin(self, isin, exchange='', currency=''):
+        clean_isin = (isin or '').strip().upper()
+        if not clean_isin:
+            raise MarketDataError('Podaj ISIN instrumentu.')
+
+        result = self.search_many([(clean_isin, exchange, currency)])[resolution_key(clean_isin, exchange, currency)]
+        if isinstance(result, MarketDataError):
+            raise result
+        return result
+
+    def search_many(self, isins):
+        """Resolves many ISINs with as few mapping calls as the per-request job limit allows.
+
+        `isins` holds plain ISINs or (isin, exchange, currency) tuples. Returns a
+        dict keyed by resolution_key() whose values are resolved instruments or
+        MarketDataError instances (InstrumentNotFoundError when OpenFIGI has no
+        match), so one bad ISIN or failed batch does not hide the others.
+        """
+        items = {}
+        for item in isins:
+            isin, exchange, currency = (item, '', '') if isinstance(item, str) else item
+            clean_isin = (isin or '').strip().upper()
+            if clean_isin:
+                items.setdefault(resolution_key(clean_isin, exchange, currency), (clean_isin, exchange, currency))
+
+        max_jobs = self._max_jobs_per_request()
+        batches = []
+        batch_jobs = []
+        batch_keys = []
+        for key, (isin, exchange, currency) in items.items():
+            jobs = self._jobs_for(isin, exchange, currency)
+            if batch_jobs and len(batch_jobs) + len(jobs) > max_jobs:
+                batches.append((batch_keys, batch_jobs))
+                batch_jobs, batch_keys = [], []
+            batch_keys.append((key, len(jobs)))
+            batch_jobs.extend(jobs)
+        if batch_jobs:
+            batches.append((batch_keys, batch_jobs))
+
+        results = {}
+        for batch_keys, jobs in batches:
+            try:
+                with _provider_slot(self.source_name):
+                    payload = _request_json(OPENFIGI_MAPPING_URL, data=jobs, headers=self._headers())
+                if not isinstance(payload, list):
+                    raise MarketDataError('OpenFIGI zwróciło nieprawidłową odpowiedź.')
+            except MarketDataError as exc:
+                for key, _ in batch_keys:
+                    results[key] = exc
+                continue
+
+            offset = 0
+            for key, job_count in batch_keys:
+                records = []
+                for result in payload[offset:offset + job_count]:
+                    records.extend(result.get('data') or [])
+                offset += job_count
+
+                isin, exchange, currency = items[key]
+                try:
+                    results[key] = self._resolved_from_records(records, isin, exchange, currency)
+                except InstrumentNotFoundError as exc:
+                    results[key] = exc
+
+        return results
+
     def _select_record(self, records, exchange='', currency=''):
         if not records:
             return None
@@ -290,14 +766,63 @@ def get_openfigi_client():
 
 
 def resolve_instrument_by_isin(isin, exchange='', currency=''):
-    return get_openfigi_client().search_by_isin(isin, exchange, currency)
+    """Maps an ISIN to a quote symbol, going to OpenFIGI only on a resolution cache miss."""
+    key = resolution_key(isin, exchange, currency)
+    if not key[0]:
+        return get_openfigi_client().search_by_isin(isin, exchange, currency)
 
+    entry = resolution_cache.get(key)
+    if entry is not None:
+        if not entry.found:
+            raise InstrumentNotFoundError(entry.error)
+        return dict(entry.resolved)
 
-def fetch_latest_market_price(symbol='', exchange='', currency='', isin='', price_symbol=''):
-    resolved = None
+    try:
+        resolved = get_openfigi_client().search_by_isin(isin, exchange, currency)
+    except InstrumentNotFoundError as exc:
+        resolution_cache.store(key, error=str(exc))
+        raise
+    resolution_cache.store(key, resolved)
+    return resolved
+
+
+def resolve_instruments_by_isin(keys):
+    """Batch counterpart of resolve_instrument_by_isin for the refresh pipeline.
+
+    Cached keys are answered from the LRU (warmed from the table in one query);
+    the remaining ones go to OpenFIGI through search_many. New answers are
+    kept in the LRU until resolution_cache.flush().
+    """
+    keys = [key for key in dict.fromkeys(keys) if key[0]]
+    resolution_cache.load_many(keys)
+
+    results = {}
+    missing = []
+    for key in keys:
+        entry = resolution_cache.get(key, use_db=False)
+        if entry is None:
+            missing.append(key)
+        elif entry.found:
+            results[key] = dict(entry.resolved)
+        else:
+            results[key] = InstrumentNotFoundError(entry.error)
+
+    if missing:
+        for key, result in get_openfigi_client().search_many(missing).items():
+            if isinstance(result, InstrumentNotFoundError):
+                resolution_cache.store(key, error=str(result), persist=False)
+            elif not isinstance(result, MarketDataError):
+                resolution_cache.store(key, result, persist=False)
+            results[key] = result
+
+    return results
+
+
+def fetch_latest_market_price(symbol='', exchange='', currency='', isin='', price_symbol='', resolved=None):
     quote_symbol = price_symbol.strip().upper() if price_symbol else ''
-    if isin:
+    if resolved is None and isin:
         resolved = resolve_instrument_by_isin(isin, exchange, currency)
+    if resolved is not None:
         symbol = resolved['symbol']
         exchange = resolved.get('exchange', exchange)
         currency = resolved.get('currency', currency)
@@ -390,6 +915,52 @@ def fetch_transaction_market_price(isin, trade_date=None, trade_time=None, excha
     return fetch_latest_market_price(symbol=symbol, exchange=resolved_exchange, currency=resolved_currency, isin='')
 
 
+def cached_transaction_market_price(isin, trade_date=None, exchange='', currency=''):
+    """fetch_transaction_market_price answered from local data only: the resolution cache,
+    stored PriceBar closes and cached quotes.
+
+    Returns None when an answer would need a provider round trip, and raises
+    InstrumentNotFoundError for ISINs OpenFIGI recently did not know.
+    """
+    entry = resolution_cache.get(resolution_key(isin, exchange, currency))
+    if entry is None:
+        return None
+    if not entry.found:
+        raise InstrumentNotFoundError(entry.error)
+
+    resolved = entry.resolved
+    symbol = resolved['symbol']
+    resolved_exchange = resolved.get('exchange', exchange)
+    resolved_currency = resolved.get('currency', currency)
+    price = None
+    if _is_warsaw_market(resolved_exchange, resolved_currency):
+        candidates = _stooq_symbol_candidates(symbol, resolved_exchange, resolved_currency)
+        if trade_date and trade_date < timezone.localdate():
+            for candidate in candidates:
+                price = stored_daily_close(candidate, trade_date)
+                if price is not None:
+                    source = f'{StooqClient.source_name} dzienne zamknięcie'
+                    break
+        if price is None:
+            price = quote_store.peek(StooqClient.source_name, '|'.join(candidates))
+            source = f'{StooqClient.source_name} najnowsza cena'
+    else:
+        price = quote_store.peek(AlphaVantageClient.source_name, symbol.strip().upper())
+        source = AlphaVantageClient.source_name
+
+    if price is None:
+        return None
+    return {
+        'price': price,
+        'source': source,
+        'symbol': symbol,
+        'name': resolved.get('name', ''),
+        'isin': resolved.get('isin', isin),
+        'exchange': resolved_exchange,
+        'currency': resolved_currency,
+    }
+
+
 def merge_duplicate_instrument(instrument, target_symbol):
     duplicate = (
         BrokerageInstrument.objects
@@ -401,6 +972,7 @@ def merge_duplicate_instrument(instrument, target_symbol):
         return instrument, False
 
     with transaction.atomic():
+        account_ids = set(instrument.transactions.values_list('account_id', flat=True))
         instrument.transactions.update(instrument=duplicate)
         instrument.dividends.update(instrument=duplicate)
 
@@ -419,11 +991,180 @@ def merge_duplicate_instrument(instrument, target_symbol):
         duplicate.save(update_fields=['isin', 'price_symbol', 'exchange', 'currency', 'last_price', 'last_price_at', 'market_data_source'])
 
         instrument.delete()
+        rebuild_ledgers((account_id, duplicate.id) for account_id in account_ids)
 
     return duplicate, True
 
 
-def refresh_market_data_for_user(user):
+def _fetch_instrument_market_data(instrument, alpha_client, resolved=None):
+    """Network half of the refresh. Runs in a worker thread and writes nothing to the database.
+
+    Quotes go through the market_data cache, which may be a DatabaseCache; the
+    connection that opens in this thread is closed by _fetch_in_worker.
+    """
+    fetched = {
+        'instrument': instrument,
+        'market_data': None,
+        'quote_error': '',
+        'dividend_items': None,
+        'dividend_error': '',
+    }
+    try:
+        if isinstance(resolved, MarketDataError):
+            raise resolved
+        fetched['market_data'] = fetch_latest_market_price(
+            symbol=instrument.ticker,
+            exchange=instrument.exchange,
+            currency=instrument.currency,
+            isin=instrument.isin,
+            price_symbol=instrument.price_symbol,
+            resolved=resolved,
+        )
+    except MarketDataError as exc:
+        fetched['quote_error'] = str(exc)
+        return fetched
+
+    if alpha_client is None:
+        return fetched
+
+    try:
+        fetched['dividend_items'] = alpha_client.fetch_dividends(fetched['market_data']['symbol'])
+    except MarketDataError as exc:
+        fetched['dividend_error'] = str(exc)
+    return fetched
+
+
+def _fetch_in_worker(instrument, alpha_client, resolved):
+    try:
+        return _fetch_instrument_market_data(instrument, alpha_client, resolved)
+    finally:
+        # Worker threads are not request threads, so nothing else closes their connections.
+        close_old_connections()
+
+
+def _fetch_market_data_concurrently(instruments, alpha_client, resolutions, progress=None):
+    if not instruments:
+        return []
+
+    max_workers = getattr(settings, 'MARKET_DATA_MAX_WORKERS', DEFAULT_MARKET_DATA_MAX_WORKERS)
+    max_workers = max(1, min(int(max_workers), len(instruments)))
+    fetched_items = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='market-data') as executor:
+        for fetched in executor.map(
+            lambda instrument: _fetch_in_worker(
+                instrument,
+                alpha_client,
+                resolutions.get(resolution_key(instrument.isin, instrument.exchange, instrument.currency)),
+            ),
+            instruments,
+        ):
+            fetched_items.append(fetched)
+            # Reported from the calling thread, so the callback may use the database.
+            if progress is not None:
+                progress(len(fetched_items), len(instruments))
+    return fetched_items
+
+
+INSTRUMENT_MARKET_DATA_FIELDS = [
+    'ticker', 'price_symbol', 'last_price', 'last_price_at', 'market_data_source', 'exchange', 'currency',
+]
+DIVIDEND_UPSERT_FIELDS = [
+    'ex_dividend_date', 'gross_amount_per_share', 'currency', 'tax_rate', 'status', 'source',
+]
+
+
+def _apply_market_data(instrument, market_data, refreshed_at):
+    instrument.ticker = market_data['symbol']
+    instrument.last_price = market_data['price']
+    instrument.last_price_at = refreshed_at
+    instrument.market_data_source = market_data['source']
+    if market_data.get('exchange'):
+        instrument.exchange = market_data['exchange']
+    if market_data.get('currency'):
+        instrument.currency = market_data['currency']
+    if market_data.get('price_symbol') and not instrument.price_symbol:
+        instrument.price_symbol = market_data['price_symbol']
+
+
+def _iso_date(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _store_planned_dividends(targets, source, today):
+    """Upserts planned dividends for (instrument, accounts, dividend_items) targets in a fixed number of queries.
+
+    Holdings on each ex-dividend date (or today) are answered from one
+    transaction query through PositionHistory, existing rows are read once to
+    count new ones, and everything is written with one upsert per batch. The
+    upsert bypasses post_save, so the owners' summary generation is bumped here.
+    Returns the number of dividends created.
+    """
+    planned = []
+    for instrument, accounts, dividend_items in targets:
+        for item in dividend_items or ():
+            payment_date = _iso_date(item.get('payment_date'))
+            amount = _decimal(item.get('amount'))
+            if payment_date is None or amount is None or payment_date < today:
+                continue
+            planned.append((instrument, accounts, payment_date, _iso_date(item.get('ex_dividend_date')), amount))
+    if not planned:
+        return 0
+
+    instrument_ids = {instrument.id for instrument, *_ in planned}
+    account_ids = {account.id for _, accounts, *_ in planned for account in accounts}
+    positions = PositionHistory(
+        BrokerageTransaction.objects
+        .filter(instrument_id__in=instrument_ids, account_id__in=account_ids)
+        .only('account_id', 'instrument_id', 'transaction_type', 'quantity', 'trade_date')
+        .order_by('trade_date', 'id')
+    )
+
+    tax_rate = BrokerageDividend._meta.get_field('tax_rate').default
+    rows = {}
+    for instrument, accounts, payment_date, ex_dividend_date, amount in planned:
+        for account in accounts:
+            if positions.quantity(account.id, instrument.id, ex_dividend_date or today) <= 0:
+                continue
+            # A later item for the same payment date wins, as it did with update_or_create.
+            rows[(account.id, instrument.id, payment_date)] = BrokerageDividend(
+                account=account,
+                instrument=instrument,
+                payment_date=payment_date,
+                ex_dividend_date=ex_dividend_date,
+                gross_amount_per_share=amount,
+                currency=instrument.currency,
+                tax_rate=tax_rate,
+                status=BrokerageDividend.PLANNED,
+                source=source,
+            )
+    if not rows:
+        return 0
+
+    existing = set(
+        BrokerageDividend.objects
+        .filter(
+            instrument_id__in={key[1] for key in rows},
+            account_id__in={key[0] for key in rows},
+            payment_date__in={key[2] for key in rows},
+        )
+        .values_list('account_id', 'instrument_id', 'payment_date')
+    )
+    BrokerageDividend.objects.bulk_create(
+        rows.values(),
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['account', 'instrument', 'payment_date'],
+        update_fields=DIVIDEND_UPSERT_FIELDS,
+    )
+    summary_cache.bump_many(dividend.account.user_id for dividend in rows.values())
+    return len(rows.keys() - existing)
+
+
+def refresh_market_data_for_user(user, progress=None):
+    """Refreshes quotes and dividends of all user's instruments; `progress(done, total)` is called per instrument."""
     alpha_client = None
     alpha_key = getattr(settings, 'ALPHA_VANTAGE_API_KEY', '')
     if alpha_key:
@@ -433,83 +1174,54 @@ def refresh_market_data_for_user(user):
     merged_instruments = 0
     failed_quotes = []
     failed_dividends = []
+    dividend_targets = []
     sources = set()
     today = timezone.localdate()
 
-    instruments = BrokerageInstrument.objects.filter(user=user)
-    accounts = BrokerageAccount.objects.filter(user=user)
+    instruments = list(BrokerageInstrument.objects.filter(user=user))
+    accounts = list(BrokerageAccount.objects.filter(user=user))
 
-    for instrument in instruments:
-        try:
-            market_data = fetch_latest_market_price(
-                symbol=instrument.ticker,
-                exchange=instrument.exchange,
-                currency=instrument.currency,
-                isin=instrument.isin,
-                price_symbol=instrument.price_symbol,
-            )
-        except MarketDataError as exc:
-            failed_quotes.append(f'{instrument.ticker}: {exc}')
-            continue
+    # ISINs are resolved in batched OpenFIGI calls, then quotes and dividends
+    # are fetched in parallel; all database writes happen afterwards in a
+    # single transaction.
+    resolutions = resolve_instruments_by_isin(
+        resolution_key(instrument.isin, instrument.exchange, instrument.currency) for instrument in instruments
+    )
+    if progress is not None:
+        progress(0, len(instruments))
+    fetched_items = _fetch_market_data_concurrently(instruments, alpha_client, resolutions, progress)
 
-        instrument, merged = merge_duplicate_instrument(instrument, market_data['symbol'])
-        if merged:
-            merged_instruments += 1
-
-        instrument.ticker = market_data['symbol']
-        instrument.last_price = market_data['price']
-        instrument.last_price_at = timezone.now()
-        instrument.market_data_source = market_data['source']
-        if market_data.get('exchange'):
-            instrument.exchange = market_data['exchange']
-        if market_data.get('currency'):
-            instrument.currency = market_data['currency']
-        if market_data.get('price_symbol') and not instrument.price_symbol:
-            instrument.price_symbol = market_data['price_symbol']
-        instrument.save(update_fields=['ticker', 'price_symbol', 'last_price', 'last_price_at', 'market_data_source', 'exchange', 'currency'])
-        updated_quotes += 1
-        sources.add(market_data['source'])
-
-        if alpha_client is None:
-            continue
+    with transaction.atomic():
+        resolution_cache.flush()
+        for fetched in fetched_items:
+            instrument = fetched['instrument']
+            if fetched['quote_error']:
+                failed_quotes.append(f'{instrument.ticker}: {fetched["quote_error"]}')
+                continue
 
-        try:
-            dividend_items = alpha_client.fetch_dividends(instrument.ticker)
-        except MarketDataError as exc:
-            failed_dividends.append(f'{instrument.ticker}: {exc}')
-            continue
+            market_data = fetched['market_data']
+            instrument, merged = merge_duplicate_instrument(instrument, market_data['symbol'])
+            if merged:
+                merged_instruments += 1
 
-        for item in dividend_items:
-            payment_date = item.get('payment_date')
-            amount = _decimal(item.get('amount'))
-            if not payment_date or amount is None:
+            _apply_market_data(instrument, market_data, timezone.now())
+            instrument.save(update_fields=INSTRUMENT_MARKET_DATA_FIELDS)
+            updated_quotes += 1
+            sources.add(market_data['source'])
+
+            if alpha_client is None:
                 continue
 
-            ex_dividend_date = item.get('ex_dividend_date') or None
-            if payment_date < today.isoformat():
+            if fetched['dividend_error']:
+                failed_dividends.append(f'{instrument.ticker}: {fetched["dividend_error"]}')
                 continue
 
-            for account in accounts:
-                quantity_date = ex_dividend_date or today
-                if get_quantity(account, instrument, quantity_date) <= 0:
-                    continue
-
-                _, created = BrokerageDividend.objects.update_or_create(
-                    account=account,
-                    instrument=instrument,
-                    payment_date=payment_date,
-                    defaults={
-                        'ex_dividend_date': ex_dividend_date,
-                        'gross_amount_per_share': amount,
-                        'currency': instrument.currency,
-                        'tax_rate': BrokerageDividend._meta.get_field('tax_rate').default,
-                        'status': BrokerageDividend.PLANNED,
-                        'source': alpha_client.source_name,
-                    },
-                )
-                if created:
-                    updated_dividends += 1
-                    sources.add(alpha_client.source_name)
+            dividend_targets.append((instrument, accounts, fetched['dividend_items']))
+
+        if dividend_targets:
+            updated_dividends = _store_planned_dividends(dividend_targets, alpha_client.source_name, today)
+            if updated_dividends:
+                sources.add(alpha_client.source_name)
 
     return {
         'updated_quotes': updated_quotes,
@@ -518,4 +1230,137 @@ def refresh_market_data_for_user(user):
         'failed_quotes': failed_quotes,
         'failed_dividends': failed_dividends,
         'source': ', '.join(sorted(sources)) or 'brak źródła',
+        'resolution_cache': resolution_cache.stats(),
+        'quote_cache': quote_store.stats(),
+        'providers': get_provider_health(),
+    }
+
+
+def _market_data_key(instrument):
+    """Instruments with equal keys get identical answers from fetch_latest_market_price."""
+    isin = (instrument.isin or '').strip().upper()
+    return (
+        *resolution_key(isin, instrument.exchange, instrument.currency),
+        (instrument.price_symbol or '').strip().upper(),
+        '' if isin else (instrument.ticker or '').strip().upper(),
+    )
+
+
+def refresh_all_market_data(progress=None):
+    """Refreshes every distinct instrument of all users once and fans the answers out in bulk.
+
+    Instruments are grouped by the inputs that determine their quote, so each
+    symbol costs one quote and one dividend request regardless of how many
+    users hold it. Instrument rows are written with bulk_update; only the
+    rare instruments that have to be merged into a duplicate are saved one by one.
+    """
+    started = time.perf_counter()
+    calls_before = provider_call_counts()
+    alpha_client = None
+    alpha_key = getattr(settings, 'ALPHA_VANTAGE_API_KEY', '')
+    if alpha_key:
+        alpha_client = AlphaVantageClient(alpha_key)
+    today = timezone.localdate()
+
+    instruments = list(BrokerageInstrument.objects.order_by('user_id', 'id'))
+    accounts_by_user = defaultdict(list)
+    for account in BrokerageAccount.objects.all():
+        accounts_by_user[account.user_id].append(account)
+
+    groups = {}
+    for instrument in instruments:
+        groups.setdefault(_market_data_key(instrument), []).append(instrument)
+    representatives = [members[0] for members in groups.values()]
+
+    resolutions = resolve_instruments_by_isin(
+        resolution_key(instrument.isin, instrument.exchange, instrument.currency) for instrument in representatives
+    )
+    if progress is not None:
+        progress(0, len(representatives))
+    fetched_items = _fetch_market_data_concurrently(representatives, alpha_client, resolutions, progress)
+
+    instrument_ids_by_ticker = defaultdict(set)
+    for instrument in instruments:
+        instrument_ids_by_ticker[(instrument.user_id, instrument.ticker)].add(instrument.id)
+
+    refreshed_at = timezone.now()
+    updated = []
+    to_merge = []
+    failed_quotes = []
+    failed_dividends = []
+    failed_instruments = 0
+    dividend_targets = []
+    for fetched in fetched_items:
+        members = groups[_market_data_key(fetched['instrument'])]
+        if fetched['quote_error']:
+            failed_quotes.append(f'{fetched["instrument"].ticker}: {fetched["quote_error"]}')
+            failed_instruments += len(members)
+            continue
+
+        market_data = fetched['market_data']
+        for instrument in members:
+            duplicates = instrument_ids_by_ticker[(instrument.user_id, market_data['symbol'])] - {instrument.id}
+            if duplicates:
+                to_merge.append((instrument, market_data))
+            else:
+                _apply_market_data(instrument, market_data, refreshed_at)
+                updated.append(instrument)
+                instrument_ids_by_ticker[(instrument.user_id, instrument.ticker)].add(instrument.id)
+
+        if alpha_client is not None:
+            if fetched['dividend_error']:
+                failed_dividends.append(f'{market_data["symbol"]}: {fetched["dividend_error"]}')
+            else:
+                dividend_targets.append((members, fetched['dividend_items']))
+
+    merged_instruments = 0
+    updated_dividends = 0
+    with transaction.atomic():
+        resolution_cache.flush()
+        BrokerageInstrument.objects.bulk_update(updated, INSTRUMENT_MARKET_DATA_FIELDS, batch_size=500)
+        summary_cache.bump_many(instrument.user_id for instrument in updated)
+
+        merged_into = {}
+        for instrument, market_data in to_merge:
+            original_id = instrument.id
+            instrument, merged = merge_duplicate_instrument(instrument, market_data['symbol'])
+            if merged:
+                merged_instruments += 1
+                merged_into[original_id] = instrument
+            _apply_market_data(instrument, market_data, refreshed_at)
+            instrument.save(update_fields=INSTRUMENT_MARKET_DATA_FIELDS)
+
+        if dividend_targets:
+            updated_dividends = _store_planned_dividends(
+                [
+                    (instrument, accounts_by_user[instrument.user_id], dividend_items)
+                    for members, dividend_items in dividend_targets
+                    for instrument in (merged_into.get(member.id, member) for member in members)
+                ],
+                alpha_client.source_name,
+                today,
+            )
+
+    elapsed = time.perf_counter() - started
+    calls_after = provider_call_counts()
+    return {
+        'users': len({instrument.user_id for instrument in instruments}),
+        'instruments': len(instruments),
+        'symbols': len(representatives),
+        'updated_quotes': len(updated) + len(to_merge),
+        'failed_instruments': failed_instruments,
+        'updated_dividends': updated_dividends,
+        'merged_instruments': merged_instruments,
+        'failed_quotes': failed_quotes,
+        'failed_dividends': failed_dividends,
+        'elapsed': elapsed,
+        'instruments_per_second': len(instruments) / elapsed if elapsed else 0.0,
+        'provider_calls': {
+            provider: calls_after[provider] - calls_before.get(provider, 0)
+            for provider in calls_after
+            if calls_after[provider] != calls_before.get(provider, 0)
+        },
+        'resolution_cache': resolution_cache.stats(),
+        'quote_cache': quote_store.stats(),
+        'providers': get_provider_health(),
     }
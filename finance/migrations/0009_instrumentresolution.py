@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0008_brokerageinstrument_price_symbol'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstrumentResolution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('isin', models.CharField(max_length=12)),
+                ('exchange', models.CharField(blank=True, max_length=40)),
+                ('currency', models.CharField(blank=True, max_length=3)),
+                ('found', models.BooleanField(default=True)),
+                ('symbol', models.CharField(blank=True, max_length=32)),
+                ('name', models.CharField(blank=True, max_length=160)),
+                ('resolved_isin', models.CharField(blank=True, max_length=12)),
+                ('resolved_exchange', models.CharField(blank=True, max_length=40)),
+                ('figi', models.CharField(blank=True, max_length=12)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('resolved_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'instrument_resolutions',
+                'ordering': ['isin', 'exchange', 'currency'],
+                'constraints': [models.UniqueConstraint(fields=('isin', 'exchange', 'currency'), name='unique_instrument_resolution_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0009_instrumentresolution'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceBar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=32)),
+                ('date', models.DateField()),
+                ('open', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('high', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('low', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('close', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('volume', models.BigIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'price_bars',
+                'ordering': ['symbol', 'date'],
+                'constraints': [models.UniqueConstraint(fields=('symbol', 'date'), name='unique_price_bar_symbol_date')],
+            },
+        ),
+    ]
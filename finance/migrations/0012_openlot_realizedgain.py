@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0011_marketdatarefreshjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenLot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trade_date', models.DateField()),
+                ('quantity', models.DecimalField(decimal_places=6, max_digits=18)),
+                ('unit_cost', models.DecimalField(decimal_places=12, max_digits=30)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='open_lots', to='finance.brokerageaccount')),
+                ('buy_transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='open_lot', to='finance.brokeragetransaction')),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='open_lots', to='finance.brokerageinstrument')),
+            ],
+            options={
+                'db_table': 'brokerage_open_lots',
+                'ordering': ['trade_date', 'buy_transaction_id'],
+                'indexes': [models.Index(fields=['account', 'instrument', 'trade_date'], name='brokerage_o_account_480f1a_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RealizedGain',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trade_date', models.DateField()),
+                ('quantity', models.DecimalField(decimal_places=6, max_digits=18)),
+                ('proceeds', models.DecimalField(decimal_places=10, max_digits=30)),
+                ('cost_basis', models.DecimalField(decimal_places=10, max_digits=30)),
+                ('gain', models.DecimalField(decimal_places=10, max_digits=30)),
+                ('allocations', models.JSONField(blank=True, default=list)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='realized_gains', to='finance.brokerageaccount')),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='realized_gains', to='finance.brokerageinstrument')),
+                ('sell_transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='realized_gain', to='finance.brokeragetransaction')),
+            ],
+            options={
+                'db_table': 'brokerage_realized_gains',
+                'ordering': ['trade_date', 'sell_transaction_id'],
+                'indexes': [models.Index(fields=['account', 'instrument', 'trade_date'], name='brokerage_r_account_dd3d20_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,84 @@
+from collections import deque
+from decimal import Decimal
+from itertools import groupby
+
+from django.db import migrations
+
+
+UNIT_COST_QUANTUM = Decimal('0.000000000001')
+AMOUNT_QUANTUM = Decimal('0.0000000001')
+
+
+def replay_position(transactions):
+    """FIFO replay of one position as of this migration; frozen here so later ledger changes do not alter it."""
+    lots = deque()
+    gains = []
+    for transaction in transactions:
+        if transaction.transaction_type == 'buy':
+            total_cost = transaction.quantity * transaction.price + transaction.fees
+            unit_cost = (total_cost / transaction.quantity).quantize(UNIT_COST_QUANTUM)
+            lots.append({
+                'buy_transaction_id': transaction.id,
+                'trade_date': transaction.trade_date,
+                'quantity': transaction.quantity,
+                'unit_cost': unit_cost,
+            })
+            continue
+
+        quantity_to_sell = transaction.quantity
+        cost_basis = Decimal('0')
+        allocations = []
+        while quantity_to_sell > 0 and lots:
+            lot = lots[0]
+            consumed_quantity = min(quantity_to_sell, lot['quantity'])
+            cost_basis += consumed_quantity * lot['unit_cost']
+            lot['quantity'] -= consumed_quantity
+            quantity_to_sell -= consumed_quantity
+            allocations.append({
+                'buy_transaction_id': lot['buy_transaction_id'],
+                'trade_date': lot['trade_date'].isoformat(),
+                'quantity': str(consumed_quantity),
+                'unit_cost': str(lot['unit_cost']),
+            })
+            if lot['quantity'] <= 0:
+                lots.popleft()
+
+        proceeds = transaction.quantity * transaction.price - transaction.fees
+        cost_basis = cost_basis.quantize(AMOUNT_QUANTUM)
+        gains.append({
+            'sell_transaction_id': transaction.id,
+            'trade_date': transaction.trade_date,
+            'quantity': transaction.quantity,
+            'proceeds': proceeds.quantize(AMOUNT_QUANTUM),
+            'cost_basis': cost_basis,
+            'gain': (proceeds - cost_basis).quantize(AMOUNT_QUANTUM),
+            'allocations': allocations,
+        })
+    return [lot for lot in lots if lot['quantity'] > 0], gains
+
+
+def build_ledger(apps, schema_editor):
+    BrokerageTransaction = apps.get_model('finance', 'BrokerageTransaction')
+    OpenLot = apps.get_model('finance', 'OpenLot')
+    RealizedGain = apps.get_model('finance', 'RealizedGain')
+
+    transactions = BrokerageTransaction.objects.order_by('account_id', 'instrument_id', 'trade_date', 'id')
+    for (account_id, instrument_id), position in groupby(
+        transactions.iterator(),
+        key=lambda transaction: (transaction.account_id, transaction.instrument_id),
+    ):
+        lots, gains = replay_position(position)
+        key = {'account_id': account_id, 'instrument_id': instrument_id}
+        OpenLot.objects.bulk_create([OpenLot(**key, **lot) for lot in lots])
+        RealizedGain.objects.bulk_create([RealizedGain(**key, **gain) for gain in gains])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0012_openlot_realizedgain'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_ledger, migrations.RunPython.noop),
+    ]
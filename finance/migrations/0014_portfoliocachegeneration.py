@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('finance', '0013_build_brokerage_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioCacheGeneration',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='portfolio_cache_generation', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('generation', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'portfolio_cache_generations',
+            },
+        ),
+    ]
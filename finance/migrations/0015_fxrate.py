@@ -0,0 +1,57 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:54
+
+import django.core.validators
+from collections import defaultdict
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def copy_transaction_fx_rates(apps, schema_editor):
+    # Seeds the shared table with rates typed in through the admin. A day whose transactions disagree
+    # on the rate is left out, as are days already in the table; the transactions keep their own rates.
+    BrokerageTransaction = apps.get_model('finance', 'BrokerageTransaction')
+    FxRate = apps.get_model('finance', 'FxRate')
+    rates = defaultdict(set)
+    transactions = (
+        BrokerageTransaction.objects
+        .exclude(fx_rate_to_pln=Decimal('1.000000'))
+        .exclude(instrument__currency='PLN')
+        .order_by()
+        .values_list('instrument__currency', 'trade_date', 'fx_rate_to_pln')
+    )
+    for currency, trade_date, rate in transactions.iterator():
+        rates[(currency, trade_date)].add(rate)
+    existing = set(FxRate.objects.values_list('currency', 'date'))
+    FxRate.objects.bulk_create(
+        [
+            FxRate(currency=currency, date=rate_date, rate_to_pln=day_rates.pop())
+            for (currency, rate_date), day_rates in rates.items()
+            if len(day_rates) == 1 and (currency, rate_date) not in existing
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0014_portfoliocachegeneration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('date', models.DateField()),
+                ('rate_to_pln', models.DecimalField(decimal_places=6, max_digits=12, validators=[django.core.validators.MinValueValidator(Decimal('0.000001'))])),
+            ],
+            options={
+                'db_table': 'fx_rates',
+                'ordering': ['currency', 'date'],
+                'constraints': [models.UniqueConstraint(fields=('currency', 'date'), name='unique_fx_rate_currency_date')],
+            },
+        ),
+        migrations.RunPython(copy_transaction_fx_rates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def drop_duplicate_dividends(apps, schema_editor):
+    # update_or_create could leave twins under concurrent refreshes; keep a paid row over a planned one, then the newest.
+    BrokerageDividend = apps.get_model('finance', 'BrokerageDividend')
+    seen = set()
+    duplicates = []
+    rows = BrokerageDividend.objects.order_by('account_id', 'instrument_id', 'payment_date', 'status', '-id')
+    for dividend_id, *key in rows.values_list('id', 'account_id', 'instrument_id', 'payment_date').iterator():
+        key = tuple(key)
+        if key in seen:
+            duplicates.append(dividend_id)
+        else:
+            seen.add(key)
+    for start in range(0, len(duplicates), 500):
+        BrokerageDividend.objects.filter(id__in=duplicates[start:start + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0015_fxrate'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_dividends, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='brokeragedividend',
+            constraint=models.UniqueConstraint(fields=('account', 'instrument', 'payment_date'), name='unique_brokerage_dividend_payment'),
+        ),
+    ]
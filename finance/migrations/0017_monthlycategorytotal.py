@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-18 21:15
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def build_category_totals(apps, schema_editor):
+    Daily = apps.get_model('finance', 'Daily')
+    MonthlyCategoryTotal = apps.get_model('finance', 'MonthlyCategoryTotal')
+    rows = (
+        Daily.objects
+        .values('month_id', 'month__account_id', 'category')
+        .annotate(total=Sum('cost'))
+        .order_by()
+    )
+    MonthlyCategoryTotal.objects.bulk_create(
+        (
+            MonthlyCategoryTotal(
+                month_id=row['month_id'],
+                account_id=row['month__account_id'],
+                category=row['category'],
+                total=row['total'],
+            )
+            for row in rows
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0016_brokeragedividend_unique_payment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyCategoryTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=100)),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='category_totals', to='finance.financeaccount')),
+                ('month', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_totals', to='finance.monthly')),
+            ],
+            options={
+                'db_table': 'monthly_category_totals',
+                'ordering': ['month', '-total'],
+                'indexes': [models.Index(fields=['account', 'category'], name='monthly_cat_account_b6c9fe_idx')],
+                'constraints': [models.UniqueConstraint(fields=('month', 'category'), name='unique_month_category_total')],
+            },
+        ),
+        migrations.RunPython(build_category_totals, migrations.RunPython.noop),
+    ]
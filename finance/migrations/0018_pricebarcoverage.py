@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 21:53
+
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+
+def seed_coverage_from_bars(apps, schema_editor):
+    # Series downloaded before coverage was recorded are taken as fetched over their stored bar range.
+    PriceBar = apps.get_model('finance', 'PriceBar')
+    PriceBarCoverage = apps.get_model('finance', 'PriceBarCoverage')
+    rows = PriceBar.objects.values('symbol').annotate(first=Min('date'), last=Max('date')).order_by()
+    PriceBarCoverage.objects.bulk_create(
+        (PriceBarCoverage(symbol=row['symbol'], first_date=row['first'], last_date=row['last']) for row in rows),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0017_monthlycategorytotal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceBarCoverage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=32, unique=True)),
+                ('first_date', models.DateField()),
+                ('last_date', models.DateField()),
+            ],
+            options={
+                'db_table': 'price_bar_coverage',
+                'ordering': ['symbol'],
+            },
+        ),
+        migrations.RunPython(seed_coverage_from_bars, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:05
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def rebuild_category_totals(apps, schema_editor):
+    # Rows of categories whose expenses summed to zero were dropped before entries were counted.
+    Daily = apps.get_model('finance', 'Daily')
+    MonthlyCategoryTotal = apps.get_model('finance', 'MonthlyCategoryTotal')
+    MonthlyCategoryTotal.objects.all().delete()
+    rows = (
+        Daily.objects
+        .values('month_id', 'month__account_id', 'category')
+        .annotate(total=Sum('cost'), entries=Count('id'))
+        .order_by()
+    )
+    MonthlyCategoryTotal.objects.bulk_create(
+        (
+            MonthlyCategoryTotal(
+                month_id=row['month_id'],
+                account_id=row['month__account_id'],
+                category=row['category'],
+                total=row['total'],
+                entries=row['entries'],
+            )
+            for row in rows
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0018_pricebarcoverage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monthlycategorytotal',
+            name='entries',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(rebuild_category_totals, migrations.RunPython.noop),
+    ]
@@ -125,6 +125,84 @@ class BrokerageInstrument(models.Model):
         return f"{self.ticker} - {self.name}"
 
 
+class InstrumentResolution(models.Model):
+    isin = models.CharField(max_length=12)
+    exchange = models.CharField(max_length=40, blank=True)
+    currency = models.CharField(max_length=3, blank=True)
+    found = models.BooleanField(default=True)
+    symbol = models.CharField(max_length=32, blank=True)
+    name = models.CharField(max_length=160, blank=True)
+    resolved_isin = models.CharField(max_length=12, blank=True)
+    resolved_exchange = models.CharField(max_length=40, blank=True)
+    figi = models.CharField(max_length=12, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    resolved_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'instrument_resolutions'
+        ordering = ['isin', 'exchange', 'currency']
+        constraints = [
+            models.UniqueConstraint(fields=['isin', 'exchange', 'currency'], name='unique_instrument_resolution_key'),
+        ]
+
+    def __str__(self):
+        target = self.symbol if self.found else 'nie znaleziono'
+        return f"{self.isin} ({self.exchange or '-'}, {self.currency or '-'}) -> {target}"
+
+
+class PriceBar(models.Model):
+    symbol = models.CharField(max_length=32)
+    date = models.DateField()
+    open = models.DecimalField(max_digits=14, decimal_places=4, blank=True, null=True)
+    high = models.DecimalField(max_digits=14, decimal_places=4, blank=True, null=True)
+    low = models.DecimalField(max_digits=14, decimal_places=4, blank=True, null=True)
+    close = models.DecimalField(max_digits=14, decimal_places=4)
+    volume = models.BigIntegerField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'price_bars'
+        ordering = ['symbol', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['symbol', 'date'], name='unique_price_bar_symbol_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.symbol} {self.date}: {self.close}"
+
+
+class PriceBarCoverage(models.Model):
+    """Dates of one symbol's daily series already asked for, including days the provider had no bars for."""
+
+    symbol = models.CharField(max_length=32, unique=True)
+    first_date = models.DateField()
+    last_date = models.DateField()
+
+    class Meta:
+        db_table = 'price_bar_coverage'
+        ordering = ['symbol']
+
+    def __str__(self):
+        return f"{self.symbol}: {self.first_date} - {self.last_date}"
+
+
+class FxRate(models.Model):
+    """Daily exchange rate of one currency to PLN (e.g. the NBP table A mid rate)."""
+
+    currency = models.CharField(max_length=3)
+    date = models.DateField()
+    rate_to_pln = models.DecimalField(max_digits=12, decimal_places=6, validators=[MinValueValidator(Decimal('0.000001'))])
+
+    class Meta:
+        db_table = 'fx_rates'
+        ordering = ['currency', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='unique_fx_rate_currency_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.currency} {self.date}: {self.rate_to_pln}"
+
+
 class BrokerageTransaction(models.Model):
     BUY = 'buy'
     SELL = 'sell'
@@ -172,6 +250,51 @@ class BrokerageTransaction(models.Model):
         return f"{self.get_transaction_type_display()} {self.quantity} {self.instrument.ticker}"
 
 
+class OpenLot(models.Model):
+    """Unsold remainder of one buy transaction, maintained by finance.ledger."""
+
+    account = models.ForeignKey(BrokerageAccount, on_delete=models.CASCADE, related_name='open_lots')
+    instrument = models.ForeignKey(BrokerageInstrument, on_delete=models.CASCADE, related_name='open_lots')
+    buy_transaction = models.OneToOneField(BrokerageTransaction, on_delete=models.CASCADE, related_name='open_lot')
+    trade_date = models.DateField()
+    quantity = models.DecimalField(max_digits=18, decimal_places=6)
+    unit_cost = models.DecimalField(max_digits=30, decimal_places=12)
+
+    class Meta:
+        db_table = 'brokerage_open_lots'
+        ordering = ['trade_date', 'buy_transaction_id']
+        indexes = [
+            models.Index(fields=['account', 'instrument', 'trade_date']),
+        ]
+
+    def __str__(self):
+        return f"{self.instrument.ticker} lot {self.trade_date}: {self.quantity}"
+
+
+class RealizedGain(models.Model):
+    """FIFO result of one sell transaction; `allocations` lists the buy lots it consumed."""
+
+    account = models.ForeignKey(BrokerageAccount, on_delete=models.CASCADE, related_name='realized_gains')
+    instrument = models.ForeignKey(BrokerageInstrument, on_delete=models.CASCADE, related_name='realized_gains')
+    sell_transaction = models.OneToOneField(BrokerageTransaction, on_delete=models.CASCADE, related_name='realized_gain')
+    trade_date = models.DateField()
+    quantity = models.DecimalField(max_digits=18, decimal_places=6)
+    proceeds = models.DecimalField(max_digits=30, decimal_places=10)
+    cost_basis = models.DecimalField(max_digits=30, decimal_places=10)
+    gain = models.DecimalField(max_digits=30, decimal_places=10)
+    allocations = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        db_table = 'brokerage_realized_gains'
+        ordering = ['trade_date', 'sell_transaction_id']
+        indexes = [
+            models.Index(fields=['account', 'instrument', 'trade_date']),
+        ]
+
+    def __str__(self):
+        return f"{self.instrument.ticker} sell {self.trade_date}: {self.gain}"
+
+
 class BrokerageDividend(models.Model):
     PLANNED = 'planned'
     PAID = 'paid'
@@ -196,10 +319,70 @@ class BrokerageDividend(models.Model):
         indexes = [
             models.Index(fields=['account', 'payment_date']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'instrument', 'payment_date'], name='unique_brokerage_dividend_payment'),
+        ]
 
     def __str__(self):
         return f"{self.instrument.ticker} dividend {self.payment_date}"
 
+
+class MarketDataRefreshJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'W kolejce'),
+        (RUNNING, 'W trakcie'),
+        (DONE, 'Zakończone'),
+        (FAILED, 'Błąd'),
+    ]
+    ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='market_data_refresh_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=120, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'market_data_refresh_jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user} market data refresh {self.status}"
+
+    @property
+    def progress_percent(self):
+        if not self.progress_total:
+            return 100 if self.status == self.DONE else 0
+        return round(self.progress_done * 100 / self.progress_total)
+
+
+class PortfolioCacheGeneration(models.Model):
+    """Per-user counter bumped on every brokerage write; cached summaries are keyed by it."""
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='portfolio_cache_generation')
+    generation = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'portfolio_cache_generations'
+
+    def __str__(self):
+        return f"{self.user} portfolio generation {self.generation}"
+
 # Expense and Income database
 class Monthly(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_records')
@@ -277,6 +460,27 @@ class Income(models.Model):
         account_name = self.account.display_name if self.account else self.user.username
         return f"{account_name} – {self.date} – {self.title}"
 
+class MonthlyCategoryTotal(models.Model):
+    """Sum and count of Daily rows per (month, category), kept in step with every expense write."""
+    month = models.ForeignKey(Monthly, on_delete=models.CASCADE, related_name='category_totals')
+    account = models.ForeignKey('FinanceAccount', on_delete=models.CASCADE, related_name='category_totals', null=True, blank=True)
+    category = models.CharField(max_length=100)
+    total = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    entries = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'monthly_category_totals'
+        ordering = ['month', '-total']
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'category'], name='unique_month_category_total'),
+        ]
+        indexes = [
+            models.Index(fields=['account', 'category']),
+        ]
+
+    def __str__(self):
+        return f"{self.month} – {self.category}: {self.total}"
+
 # Travel database
 class TravelDestinations(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='travel_destinations')
@@ -0,0 +1,165 @@
+from collections import defaultdict, deque
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .brokerage import ZERO, money
+from .ledger import fifo_replay
+from .market_data import daily_bar_symbols
+from .models import BrokerageTransaction, PriceBar
+from .price_history import DAILY_CLOSE_LOOKBACK
+from .summary_cache import summary_cache
+
+
+DEFAULT_HISTORY_DAYS = 365
+DEFAULT_HISTORY_MAX_DAYS = 3660
+DEFAULT_HISTORY_CACHE_TTL = timedelta(hours=6)
+
+
+class _Sweep:
+    """Replays transactions and daily closes in date order, keeping value and cost per (account, currency)."""
+
+    def __init__(self, transactions, bars, symbol_instruments):
+        self._transactions = transactions
+        self._bars = bars
+        self._symbol_instruments = symbol_instruments
+        self._next_transaction = 0
+        self._next_bar = 0
+        self._lots = defaultdict(deque)
+        self._currencies = {}
+        self._marks = {}
+        self._positions_by_instrument = defaultdict(set)
+        self._contributions = {}
+        self.totals = defaultdict(lambda: [ZERO, ZERO])
+
+    def _mark(self, instrument_id, mark_date, price):
+        # Keep the most recent observation: a stored close, or a trade price when no close is newer.
+        current = self._marks.get(instrument_id)
+        if current is None or mark_date >= current[0]:
+            self._marks[instrument_id] = (mark_date, price)
+            return self._positions_by_instrument[instrument_id]
+        return ()
+
+    def advance(self, until):
+        touched = set()
+        while self._next_transaction < len(self._transactions):
+            transaction = self._transactions[self._next_transaction]
+            if transaction.trade_date > until:
+                break
+            self._next_transaction += 1
+            key = (transaction.account_id, transaction.instrument_id)
+            fifo_replay([transaction], self._lots[key])
+            self._currencies[key] = transaction.instrument.currency
+            self._positions_by_instrument[transaction.instrument_id].add(key)
+            touched.add(key)
+            touched.update(self._mark(transaction.instrument_id, transaction.trade_date, transaction.price))
+
+        while self._next_bar < len(self._bars):
+            symbol, bar_date, close = self._bars[self._next_bar]
+            if bar_date > until:
+                break
+            self._next_bar += 1
+            for instrument_id in self._symbol_instruments.get(symbol, ()):
+                touched.update(self._mark(instrument_id, bar_date, close))
+
+        for key in touched:
+            self._update_contribution(key)
+
+    def _update_contribution(self, key):
+        lots = self._lots[key]
+        quantity = sum((lot.quantity for lot in lots), Decimal('0'))
+        cost = sum((lot.quantity * lot.unit_cost for lot in lots), ZERO)
+        value = quantity * self._marks[key[1]][1] if quantity > 0 else ZERO
+        old_value, old_cost = self._contributions.get(key, (ZERO, ZERO))
+        self._contributions[key] = (value, cost)
+        totals = self.totals[(key[0], self._currencies[key])]
+        totals[0] += value - old_value
+        totals[1] += cost - old_cost
+
+
+def _bar_symbols(instruments):
+    """Picks, per instrument, the first candidate symbol that has stored bars."""
+    candidates = {instrument.id: daily_bar_symbols(instrument) for instrument in instruments}
+    all_symbols = {symbol for symbols in candidates.values() for symbol in symbols}
+    stored = set(PriceBar.objects.filter(symbol__in=all_symbols).values_list('symbol', flat=True).distinct())
+    symbol_instruments = defaultdict(list)
+    for instrument_id, symbols in candidates.items():
+        symbol = next((symbol for symbol in symbols if symbol in stored), None)
+        if symbol is not None:
+            symbol_instruments[symbol].append(instrument_id)
+    return symbol_instruments
+
+
+def build_portfolio_history(user, start, end):
+    """Daily value and FIFO cost basis per (account, currency) between `start` and `end`, in one sweep.
+
+    Prices come from stored PriceBar closes carried forward over non-trading
+    days; until an instrument has a close, its last trade price is used.
+    Nothing is downloaded here.
+    """
+    transactions = list(
+        BrokerageTransaction.objects
+        .filter(account__user=user, trade_date__lte=end)
+        .select_related('account', 'instrument')
+        .order_by('trade_date', 'id')
+    )
+    accounts = {transaction.account_id: transaction.account for transaction in transactions}
+    instruments = {transaction.instrument_id: transaction.instrument for transaction in transactions}
+    symbol_instruments = _bar_symbols(instruments.values())
+    bars = list(
+        PriceBar.objects
+        .filter(symbol__in=symbol_instruments, date__gte=start - DAILY_CLOSE_LOOKBACK, date__lte=end)
+        .order_by('date', 'symbol')
+        .values_list('symbol', 'date', 'close')
+    )
+
+    sweep = _Sweep(transactions, bars, symbol_instruments)
+    sweep.advance(start - timedelta(days=1))
+    dates = []
+    series = {}
+    day = start
+    while day <= end:
+        sweep.advance(day)
+        for key, (value, cost) in sweep.totals.items():
+            if key not in series:
+                series[key] = {'value': ['0.00'] * len(dates), 'cost': ['0.00'] * len(dates)}
+            series[key]['value'].append(str(money(value)))
+            series[key]['cost'].append(str(money(cost)))
+        dates.append(day.isoformat())
+        day += timedelta(days=1)
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'dates': dates,
+        'series': [
+            {
+                'account_id': account_id,
+                'account': accounts[account_id].name,
+                'currency': currency,
+                **values,
+            }
+            for (account_id, currency), values in sorted(
+                series.items(),
+                key=lambda item: (accounts[item[0][0]].name, item[0][1]),
+            )
+        ],
+    }
+
+
+def history_cache_key(user, start, end):
+    """Key tied to the portfolio generation, bumped by every brokerage write and by newly stored daily bars."""
+    generation = summary_cache.generation(user.pk)
+    return f'portfolio-history:{user.pk}:{start.isoformat()}:{end.isoformat()}:{generation}'
+
+
+def get_portfolio_history(user, start, end):
+    key = history_cache_key(user, start, end)
+    history = cache.get(key)
+    if history is None:
+        history = build_portfolio_history(user, start, end)
+        ttl = getattr(settings, 'PORTFOLIO_HISTORY_CACHE_TTL', DEFAULT_HISTORY_CACHE_TTL)
+        cache.set(key, history, ttl.total_seconds())
+    return history
@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+
+from .models import PriceBar, PriceBarCoverage
+
+
+DAILY_CLOSE_LOOKBACK = timedelta(days=7)
+DEFAULT_PRICE_BACKFILL_DAYS = 365
+BULK_INSERT_BATCH_SIZE = 500
+
+
+def fetched_daily_range(symbol):
+    return PriceBarCoverage.objects.filter(symbol=symbol).values_list('first_date', 'last_date').first() or (None, None)
+
+
+def record_fetched_range(symbol, date_from, date_to):
+    """Widens the symbol's coverage by a downloaded range, whether or not the provider returned bars for it.
+
+    The last DAILY_CLOSE_LOOKBACK days of the range count only up to the
+    newest bar stored: the provider may not have published them yet, and
+    stored_daily_close would otherwise keep answering with an older close.
+    """
+    last_bar = PriceBar.objects.filter(symbol=symbol, date__range=(date_from, date_to)).aggregate(last=Max('date'))['last']
+    covered_to = date_to - DAILY_CLOSE_LOOKBACK
+    if last_bar is not None:
+        covered_to = max(covered_to, last_bar)
+    if covered_to < date_from:
+        return
+    first, last = fetched_daily_range(symbol)
+    PriceBarCoverage.objects.update_or_create(symbol=symbol, defaults={
+        'first_date': date_from if first is None else min(first, date_from),
+        'last_date': covered_to if last is None else max(last, covered_to),
+    })
+
+
+def missing_daily_ranges(symbol, trade_date, until):
+    """Date ranges that have to be downloaded before `trade_date` can be answered locally.
+
+    Only dates outside the already fetched [first, last] range are requested:
+    the first lookup pulls MARKET_DATA_PRICE_BACKFILL_DAYS of history up to
+    `until`, later ones only extend the series forwards or backwards. Days
+    the provider had no bars for count as fetched once they are older than
+    DAILY_CLOSE_LOOKBACK, so an unknown symbol is not downloaded again; only
+    the recent days past the newest bar are asked for again.
+    """
+    backfill = timedelta(days=getattr(settings, 'MARKET_DATA_PRICE_BACKFILL_DAYS', DEFAULT_PRICE_BACKFILL_DAYS))
+    first, last = fetched_daily_range(symbol)
+    if first is None:
+        return [(trade_date - backfill, until)]
+
+    ranges = []
+    if trade_date < first:
+        ranges.append((trade_date - backfill, first - timedelta(days=1)))
+    if trade_date > last and last < until:
+        ranges.append((last + timedelta(days=1), until))
+    return ranges
+
+
+def save_price_bars(bars):
+    """Bulk-inserts PriceBar objects from any iterable in fixed-size chunks."""
+    saved = 0
+    chunk = []
+    for bar in bars:
+        chunk.append(bar)
+        if len(chunk) >= BULK_INSERT_BATCH_SIZE:
+            PriceBar.objects.bulk_create(chunk, ignore_conflicts=True)
+            saved += len(chunk)
+            chunk = []
+    if chunk:
+        PriceBar.objects.bulk_create(chunk, ignore_conflicts=True)
+        saved += len(chunk)
+    return saved
+
+
+def stored_daily_close(symbol, trade_date):
+    return (
+        PriceBar.objects
+        .filter(symbol=symbol, date__lte=trade_date, date__gte=trade_date - DAILY_CLOSE_LOOKBACK)
+        .order_by('-date')
+        .values_list('close', flat=True)
+        .first()
+    )
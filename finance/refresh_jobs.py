@@ -0,0 +1,157 @@
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from .market_data import MarketDataError, refresh_market_data_for_user
+from .models import MarketDataRefreshJob
+
+
+DEFAULT_REFRESH_JOB_STALE_AFTER = timedelta(minutes=10)
+DEFAULT_REFRESH_JOB_MAX_ATTEMPTS = 3
+
+
+def default_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_market_data_refresh(user):
+    """Queues a refresh for the user, reusing the job that is already queued or running."""
+    with transaction.atomic():
+        # Locking the user row serialises double-clicks, so each user has at most one active job.
+        get_user_model().objects.select_for_update().filter(pk=user.pk).first()
+        job = (
+            MarketDataRefreshJob.objects
+            .filter(user=user, status__in=MarketDataRefreshJob.ACTIVE_STATUSES)
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            job = MarketDataRefreshJob.objects.create(user=user)
+    return job
+
+
+def claim_next_job(worker=''):
+    """Marks the oldest queued job as running and returns it; concurrent workers skip rows locked by others."""
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            MarketDataRefreshJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=MarketDataRefreshJob.QUEUED)
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = MarketDataRefreshJob.RUNNING
+        job.attempts += 1
+        job.worker = worker[:120]
+        job.started_at = now
+        job.heartbeat_at = now
+        job.progress_done = 0
+        job.error = ''
+        job.save(update_fields=['status', 'attempts', 'worker', 'started_at', 'heartbeat_at', 'progress_done', 'error'])
+    return job
+
+
+def run_job(job):
+    def report_progress(done, total):
+        job.progress_done = done
+        job.progress_total = total
+        job.heartbeat_at = timezone.now()
+        MarketDataRefreshJob.objects.filter(pk=job.pk).update(
+            progress_done=done,
+            progress_total=total,
+            heartbeat_at=job.heartbeat_at,
+        )
+
+    try:
+        result = refresh_market_data_for_user(job.user, progress=report_progress)
+    except MarketDataError as exc:
+        job.status = MarketDataRefreshJob.FAILED
+        job.error = str(exc)
+    except Exception as exc:
+        job.status = MarketDataRefreshJob.FAILED
+        job.error = f'{exc.__class__.__name__}: {exc}'
+    else:
+        job.status = MarketDataRefreshJob.DONE
+        job.result = result
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'result', 'finished_at'])
+    return job
+
+
+def recover_stale_jobs():
+    """Requeues jobs whose worker stopped sending heartbeats; gives up after the attempt limit."""
+    stale_after = getattr(settings, 'MARKET_DATA_REFRESH_JOB_STALE_AFTER', DEFAULT_REFRESH_JOB_STALE_AFTER)
+    max_attempts = getattr(settings, 'MARKET_DATA_REFRESH_JOB_MAX_ATTEMPTS', DEFAULT_REFRESH_JOB_MAX_ATTEMPTS)
+    now = timezone.now()
+    stale = MarketDataRefreshJob.objects.filter(
+        status=MarketDataRefreshJob.RUNNING,
+        heartbeat_at__lt=now - stale_after,
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(status=MarketDataRefreshJob.QUEUED, worker='')
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=MarketDataRefreshJob.FAILED,
+        error='Worker przestał odpowiadać podczas odświeżania.',
+        finished_at=now,
+    )
+    return requeued, failed
+
+
+def refresh_job_messages(job):
+    """(level, text) pairs describing a finished job, in the wording the refresh view used to flash."""
+    if job.status == MarketDataRefreshJob.FAILED:
+        return [('warning', f'Nie udało się odświeżyć danych rynkowych: {job.error}')]
+    if job.status != MarketDataRefreshJob.DONE:
+        return []
+
+    result = job.result or {}
+    items = []
+    failed_quotes = result.get('failed_quotes', [])
+    if failed_quotes:
+        items.append(('warning', f"Nie odświeżono {len(failed_quotes)} instrumentów: {'; '.join(failed_quotes[:3])}"))
+    failed_dividends = result.get('failed_dividends', [])
+    if failed_dividends:
+        items.append((
+            'warning',
+            f"Nie odświeżono dywidend dla {len(failed_dividends)} instrumentów: {'; '.join(failed_dividends[:3])}",
+        ))
+    paused_providers = [
+        name for name, health in result.get('providers', {}).items() if health.get('state') == 'open'
+    ]
+    if paused_providers:
+        items.append((
+            'warning',
+            f"Wstrzymano zapytania do: {', '.join(paused_providers)} (limit zapytań lub awaria dostawcy).",
+        ))
+    items.append((
+        'success',
+        f"Odświeżono ceny: {result.get('updated_quotes', 0)}, "
+        f"scalone instrumenty: {result.get('merged_instruments', 0)}, "
+        f"nowe dywidendy: {result.get('updated_dividends', 0)} ({result.get('source', 'brak źródła')}).",
+    ))
+    return items
+
+
+def serialize_refresh_job(job):
+    if job is None:
+        return {'status': None}
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'progress_done': job.progress_done,
+        'progress_total': job.progress_total,
+        'progress_percent': job.progress_percent,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'error': job.error,
+        'messages': [{'level': level, 'text': text} for level, text in refresh_job_messages(job)],
+    }
@@ -0,0 +1,139 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import BooleanField, DecimalField, ExpressionWrapper, F, Q, Sum, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+from .models import Daily, Income, Monthly, MonthlyCategoryTotal
+
+
+INVESTMENT_CATEGORY = 'Inwestycje'
+RECENT_ITEMS = 5
+DEFAULT_REPORT_MONTHS = 6
+DEFAULT_REPORT_MAX_MONTHS = 120
+REPORT_MONTH_CHOICES = (6, 12, 24, 60)
+ZERO = Decimal('0.00')
+
+
+def _by_total(totals):
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def _recent_expenses(account, monthly_record):
+    """The newest expenses and investments of the month, ranked per kind by a window function in one query."""
+    is_investment = ExpressionWrapper(Q(category=INVESTMENT_CATEGORY), output_field=BooleanField())
+    rows = list(
+        Daily.objects
+        .filter(account=account, month=monthly_record)
+        .annotate(
+            is_investment=is_investment,
+            position=Window(RowNumber(), partition_by=[F('is_investment')], order_by=[F('date').desc(), F('id').desc()]),
+        )
+        .filter(position__lte=RECENT_ITEMS)
+        .order_by('-date', '-id')
+    )
+    return [row for row in rows if not row.is_investment], [row for row in rows if row.is_investment]
+
+
+def build_dashboard_totals(account, monthly_record, days_in_month, selected_categories=()):
+    """Per-day, per-category and per-source figures of one month for the dashboard.
+
+    Expenses are read with a single GROUP BY date whose conditional sums split
+    regular spending from investments and category figures come from the
+    MonthlyCategoryTotal rollup. A month holds only a handful of incomes, so
+    they are read once, newest first, and feed the per-day and per-source
+    sums as well as the recent list. The recent expenses add one more query.
+    """
+    daily_expenses = [0.0] * days_in_month
+    daily_investments = [0.0] * days_in_month
+    daily_incomes = [0.0] * days_in_month
+
+    expense_rows = (
+        Daily.objects
+        .filter(account=account, month=monthly_record)
+        .values('date')
+        .annotate(
+            expense=Sum('cost', filter=~Q(category=INVESTMENT_CATEGORY)),
+            investment=Sum('cost', filter=Q(category=INVESTMENT_CATEGORY)),
+        )
+        .order_by()
+    )
+    for row in expense_rows:
+        day = row['date'].day - 1
+        daily_expenses[day] = float(row['expense'] or 0)
+        daily_investments[day] = float(row['investment'] or 0)
+
+    category_totals = {}
+    investment_total = ZERO
+    selected_total = ZERO
+    selected_categories = set(selected_categories)
+    for category, total in monthly_record.category_totals.order_by('-total', 'category').values_list('category', 'total'):
+        if category == INVESTMENT_CATEGORY:
+            investment_total = total
+        else:
+            category_totals[category] = total
+        if category in selected_categories:
+            selected_total += total
+
+    day_incomes = defaultdict(lambda: ZERO)
+    source_totals = defaultdict(lambda: ZERO)
+    incomes = list(Income.objects.filter(account=account, month=monthly_record).order_by('-date', '-id'))
+    for income in incomes:
+        day_incomes[income.date.day - 1] += income.amount
+        source_totals[income.source] += income.amount
+    for day, total in day_incomes.items():
+        daily_incomes[day] = float(total)
+
+    recent_expenses, recent_investments = _recent_expenses(account, monthly_record)
+    recent_incomes = incomes[:RECENT_ITEMS]
+
+    sources = _by_total(source_totals)
+    return {
+        'daily_expenses_data': daily_expenses,
+        'daily_investments_data': daily_investments,
+        'daily_incomes_data': daily_incomes,
+        'investment_total': investment_total,
+        'categories': list(category_totals),
+        'amounts': [float(total) for total in category_totals.values()],
+        'income_sources': [source for source, _ in sources],
+        'income_amounts': [float(total) for _, total in sources],
+        'selected_category_total': selected_total,
+        'recent_expenses': recent_expenses,
+        'recent_investments': recent_investments,
+        'recent_incomes': recent_incomes,
+    }
+
+
+def account_category_totals(account):
+    """All-time spending per category of the account, largest first, summed over the rollup (months x categories rows)."""
+    rows = (
+        MonthlyCategoryTotal.objects
+        .filter(account=account)
+        .values('category')
+        .annotate(category_total=Sum('total'))
+        .order_by('-category_total', 'category')
+    )
+    return [(row['category'], row['category_total']) for row in rows]
+
+
+def monthly_report(account, months=DEFAULT_REPORT_MONTHS):
+    """The account's newest `months` Monthly records, newest first, in one query.
+
+    Each record gets investment_total (joined from the category rollup),
+    spending_total and monthly_balance, so the window length does not change
+    the number of round trips.
+    """
+    records = list(
+        Monthly.objects
+        .filter(account=account)
+        .annotate(investment_total=Coalesce(
+            Sum('category_totals__total', filter=Q(category_totals__category=INVESTMENT_CATEGORY)),
+            Value(ZERO),
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        ))
+        .order_by('-date')[:months]
+    )
+    for record in records:
+        record.spending_total = record.total_expense - record.investment_total
+        record.monthly_balance = record.total_income - record.total_expense
+    return records
@@ -1,11 +1,175 @@
+from decimal import Decimal
+
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
 from django.dispatch import receiver
 
-from .account_utils import ensure_personal_finance_account
+from . import ledger
+from .account_utils import (
+    CENT,
+    ensure_personal_finance_account,
+    move_category_amount,
+    move_monthly_amount,
+    reconcile_monthly_totals,
+)
+from .models import BrokerageAccount, BrokerageDividend, BrokerageInstrument, BrokerageTransaction, Daily, Income, Monthly
+from .summary_cache import summary_cache
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_personal_finance_account(sender, instance, created, **kwargs):
     if created:
         ensure_personal_finance_account(instance)
+
+
+def _stored_amount(value):
+    # The columns keep 2 dp, so deltas must use the value the database rounded to, not the raw input.
+    return Decimal(str(value)).quantize(CENT)
+
+
+def _expense_origin(expense):
+    return expense.month_id, expense.account_id, expense.category, _stored_amount(expense.cost)
+
+
+@receiver(post_init, sender=Daily)
+def remember_expense_origin(sender, instance, **kwargs):
+    fields = instance.__dict__
+    origin = (fields.get('month_id'), fields.get('account_id'), fields.get('category'), fields.get('cost'))
+    known = instance.pk and None not in (origin[0], origin[2], origin[3])
+    instance._expense_origin = origin if known else None
+
+
+@receiver(post_save, sender=Daily)
+def update_expense_totals_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if not created and instance._expense_origin is None:
+        # Loaded with deferred fields: the previous values are unknown, so recount the month.
+        reconcile_monthly_totals(Monthly.objects.filter(pk=instance.month_id))
+    else:
+        before = None if created else instance._expense_origin
+        after = _expense_origin(instance)
+        move_category_amount(before, after)
+        move_monthly_amount('total_expense', before and (before[0], before[3]), (after[0], after[3]))
+    instance._expense_origin = _expense_origin(instance)
+
+
+@receiver(post_delete, sender=Daily)
+def update_expense_totals_on_delete(sender, instance, **kwargs):
+    before = instance._expense_origin or _expense_origin(instance)
+    move_category_amount(before, None)
+    move_monthly_amount('total_expense', (before[0], before[3]), None)
+
+
+def _income_origin(income):
+    return income.month_id, _stored_amount(income.amount)
+
+
+@receiver(post_init, sender=Income)
+def remember_income_origin(sender, instance, **kwargs):
+    fields = instance.__dict__
+    origin = (fields.get('month_id'), fields.get('amount'))
+    instance._income_origin = origin if instance.pk and None not in origin else None
+
+
+@receiver(post_save, sender=Income)
+def update_income_totals_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if not created and instance._income_origin is None:
+        reconcile_monthly_totals(Monthly.objects.filter(pk=instance.month_id))
+    else:
+        move_monthly_amount('total_income', None if created else instance._income_origin, _income_origin(instance))
+    instance._income_origin = _income_origin(instance)
+
+
+@receiver(post_delete, sender=Income)
+def update_income_totals_on_delete(sender, instance, **kwargs):
+    move_monthly_amount('total_income', instance._income_origin or _income_origin(instance), None)
+
+
+def _deleted_with(origin, *models):
+    # `origin` is the instance or queryset the delete started from, so a cascade is told apart without state.
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(model, models)
+
+
+def _position_deleted(origin):
+    return _deleted_with(origin, BrokerageAccount, BrokerageInstrument, get_user_model())
+
+
+def _ledger_origin(transaction):
+    return transaction.account_id, transaction.instrument_id, transaction.trade_date
+
+
+@receiver(post_init, sender=BrokerageTransaction)
+def remember_ledger_origin(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields are not loaded; an unknown origin falls back to a full replay.
+    fields = instance.__dict__
+    origin = (fields.get('account_id'), fields.get('instrument_id'), fields.get('trade_date'))
+    instance._ledger_origin = origin if instance.pk and None not in origin else None
+
+
+@receiver(post_save, sender=BrokerageTransaction)
+def update_ledger_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    account_id, instrument_id, trade_date = _ledger_origin(instance)
+    origin = None if created else instance._ledger_origin
+    if not created and origin is None:
+        trade_date = None
+    elif origin is not None and origin[:2] != (account_id, instrument_id):
+        ledger.replay_ledger(origin[0], origin[1], origin[2])
+    elif origin is not None:
+        trade_date = min(trade_date, origin[2])
+    ledger.replay_ledger(account_id, instrument_id, trade_date)
+    instance._ledger_origin = _ledger_origin(instance)
+
+
+@receiver(pre_delete, sender=BrokerageTransaction)
+def remember_ledger_replay_date(sender, instance, origin=None, **kwargs):
+    # The cascade removes this sell's RealizedGain before post_delete, so the lots it consumed
+    # must be rebuilt from their own buy dates.
+    if not _position_deleted(origin):
+        instance._ledger_replay_date = ledger.replay_date_for_delete(instance)
+
+
+@receiver(post_delete, sender=BrokerageTransaction)
+def update_ledger_on_delete(sender, instance, origin=None, **kwargs):
+    if _position_deleted(origin):
+        return
+    replay_date = getattr(instance, '_ledger_replay_date', instance.trade_date)
+    ledger.replay_ledger(instance.account_id, instance.instrument_id, replay_date)
+
+
+# Registered after the ledger receivers so the generation moves only once OpenLot/RealizedGain are current.
+@receiver(post_save, sender=BrokerageTransaction)
+@receiver(post_save, sender=BrokerageDividend)
+def invalidate_summary_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        summary_cache.bump(instance.account.user_id)
+
+
+@receiver(post_delete, sender=BrokerageTransaction)
+@receiver(post_delete, sender=BrokerageDividend)
+def invalidate_summary_on_delete(sender, instance, origin=None, **kwargs):
+    # Rows cascading from an account or instrument delete are covered by that delete's own bump.
+    if not _position_deleted(origin):
+        summary_cache.bump(instance.account.user_id)
+
+
+@receiver(post_save, sender=BrokerageAccount)
+@receiver(post_save, sender=BrokerageInstrument)
+def invalidate_summary_on_owner_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        summary_cache.bump(instance.user_id)
+
+
+@receiver(post_delete, sender=BrokerageAccount)
+@receiver(post_delete, sender=BrokerageInstrument)
+def invalidate_summary_on_owner_delete(sender, instance, origin=None, **kwargs):
+    # A user being deleted takes its generation row with it; recreating the row would break the cascade.
+    if not _deleted_with(origin, get_user_model()):
+        summary_cache.bump(instance.user_id)
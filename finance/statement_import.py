@@ -0,0 +1,378 @@
+import abc
+import codecs
+import csv
+import io
+import re
+from collections import Counter, namedtuple
+from datetime import date, datetime, time
+from decimal import Decimal
+from itertools import chain, islice
+
+from django.db import transaction as db_transaction
+from openpyxl import load_workbook
+
+from utils.tools import parse_decimal
+
+from .ledger import replay_ledger
+from .models import BrokerageAccount, BrokerageInstrument, BrokerageTransaction
+from .summary_cache import summary_cache
+
+
+BULK_INSERT_BATCH_SIZE = 500
+HEADER_SEARCH_ROWS = 50
+QUANTITY_QUANTUM = Decimal('0.000001')
+PRICE_QUANTUM = Decimal('0.0001')
+FEES_QUANTUM = Decimal('0.01')
+
+SUPPORTED_CURRENCIES = {code for code, _ in BrokerageAccount.CURRENCY_CHOICES}
+XTB_SYMBOL_MARKETS = {
+    'PL': ('GPW', 'PLN'),
+    'US': ('', 'USD'),
+    'DE': ('XETRA', 'EUR'),
+    'FR': ('EURONEXT', 'EUR'),
+    'NL': ('EURONEXT', 'EUR'),
+    'BE': ('EURONEXT', 'EUR'),
+    'IT': ('MTA', 'EUR'),
+    'ES': ('BME', 'EUR'),
+    'PT': ('EURONEXT', 'EUR'),
+    'FI': ('OMXH', 'EUR'),
+    'UK': ('LSE', 'GBP'),
+}
+MBANK_EXCHANGES = {'WWA-GPW': 'GPW', 'WWA-NC': 'NewConnect'}
+
+_XLSX_MAGIC = b'PK\x03\x04'
+_XTB_COMMENT = re.compile(r'(?:OPEN|CLOSE)\s+BUY\s+([\d.,]+)(?:/[\d.,]+)?\s+@\s+([\d.,]+)', re.IGNORECASE)
+_XTB_TYPES = {
+    'stock purchase': BrokerageTransaction.BUY,
+    'zakup akcji/etf': BrokerageTransaction.BUY,
+    'stock sale': BrokerageTransaction.SELL,
+    'sprzedaż akcji/etf': BrokerageTransaction.SELL,
+}
+_MBANK_SIDES = {'K': BrokerageTransaction.BUY, 'S': BrokerageTransaction.SELL}
+_DATETIME_FORMATS = ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d.%m.%Y', '%Y-%m-%d')
+
+StatementRow = namedtuple(
+    'StatementRow',
+    'symbol name exchange currency transaction_type trade_date trade_time quantity price fees',
+)
+
+
+class StatementImportError(ValueError):
+    pass
+
+
+def _cell(value):
+    return '' if value is None else str(value).strip()
+
+
+def _parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, time())
+    text = _cell(value)
+    for datetime_format in _DATETIME_FORMATS:
+        try:
+            return datetime.strptime(text, datetime_format)
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_amount(value):
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value))
+    return parse_decimal(value)
+
+
+class _Layout(abc.ABC):
+    """Column names (lower-cased, any of the aliases) that identify one broker's statement header."""
+
+    broker = None
+    columns = {}
+
+    def match(self, header):
+        indexes = {}
+        for column, aliases in self.columns.items():
+            index = next((position for position, name in enumerate(header) if name in aliases), None)
+            if index is None:
+                return None
+            indexes[column] = index
+        return indexes
+
+    @abc.abstractmethod
+    def parse(self, values, account):
+        """StatementRow for a trade row, None for rows to leave out; raises ValueError for unreadable trades."""
+
+
+class _XtbCashOperations(_Layout):
+    """XTB "Cash operations" history: trades are the stock purchase/sale rows, quantity and price sit in the comment."""
+
+    broker = BrokerageAccount.BROKER_XTB
+    columns = {
+        'type': {'type', 'typ'},
+        'time': {'time', 'czas'},
+        'comment': {'comment', 'komentarz'},
+        'symbol': {'symbol'},
+    }
+
+    def parse(self, values, account):
+        transaction_type = _XTB_TYPES.get(_cell(values['type']).lower())
+        if transaction_type is None:
+            return None
+        match = _XTB_COMMENT.search(_cell(values['comment']))
+        traded_at = _parse_datetime(values['time'])
+        symbol = _cell(values['symbol']).upper()
+        if match is None or traded_at is None or not symbol:
+            raise ValueError
+        ticker, _, suffix = symbol.partition('.')
+        exchange, currency = XTB_SYMBOL_MARKETS.get(suffix, ('', account.currency))
+        return StatementRow(
+            symbol=ticker,
+            name=ticker,
+            exchange=exchange,
+            currency=currency,
+            transaction_type=transaction_type,
+            trade_date=traded_at.date(),
+            trade_time=traded_at.time(),
+            quantity=_parse_amount(match.group(1)),
+            price=_parse_amount(match.group(2)),
+            fees=Decimal('0'),
+        )
+
+
+class _MbankTransactions(_Layout):
+    """mBank eMakler transaction history: one row per execution, K/S marks buys and sells."""
+
+    broker = BrokerageAccount.BROKER_MBANK
+    columns = {
+        'time': {'czas transakcji'},
+        'security': {'walor'},
+        'exchange': {'giełda'},
+        'side': {'k/s'},
+        'quantity': {'liczba'},
+        'price': {'kurs'},
+        'currency': {'waluta'},
+        'fees': {'prowizja'},
+    }
+
+    def parse(self, values, account):
+        transaction_type = _MBANK_SIDES.get(_cell(values['side']).upper())
+        traded_at = _parse_datetime(values['time'])
+        security = _cell(values['security']).upper()
+        if transaction_type is None or traded_at is None or not security:
+            raise ValueError
+        return StatementRow(
+            symbol=security,
+            name=_cell(values['security']),
+            exchange=MBANK_EXCHANGES.get(_cell(values['exchange']).upper(), _cell(values['exchange'])),
+            currency=_cell(values['currency']).upper(),
+            transaction_type=transaction_type,
+            trade_date=traded_at.date(),
+            trade_time=traded_at.time(),
+            quantity=_parse_amount(values['quantity']),
+            price=_parse_amount(values['price']),
+            fees=_parse_amount(values['fees']) if _cell(values['fees']) else Decimal('0'),
+        )
+
+
+LAYOUTS = (_XtbCashOperations(), _MbankTransactions())
+
+
+def _decode(file):
+    """Binary upload -> text, trying UTF-8 first and falling back to cp1250 (the usual mBank export encoding)."""
+    head = file.read(64 * 1024)
+    file.seek(0)
+    try:
+        # Incremental, so a character cut at the end of the sample is not taken for invalid UTF-8.
+        codecs.getincrementaldecoder('utf-8-sig')().decode(head)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        encoding = 'cp1250'
+    return io.TextIOWrapper(file, encoding=encoding, newline='')
+
+
+def _csv_tables(file):
+    lines = iter(file)
+    head = list(islice(lines, HEADER_SEARCH_ROWS))
+    delimiter = max(';,\t', key=lambda candidate: sum(line.count(candidate) for line in head))
+    yield csv.reader(chain(head, lines), delimiter=delimiter)
+
+
+def _xlsx_tables(file):
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def statement_tables(file):
+    """Row iterators, one per CSV file or XLSX sheet, read lazily from a binary file object."""
+    head = file.read(len(_XLSX_MAGIC))
+    file.seek(0)
+    if head == _XLSX_MAGIC:
+        return _xlsx_tables(file)
+    return _csv_tables(_decode(file))
+
+
+def read_statement(file, account):
+    """Yields (line number, StatementRow or None) for every row below the recognised header.
+
+    None marks a row that belongs to the statement but cannot be imported,
+    so callers can report it; non-trade rows (deposits, dividends, taxes)
+    are left out altogether.
+    """
+    for rows in statement_tables(file):
+        rows = iter(rows)
+        layout = indexes = None
+        for line_number, row in enumerate(islice(rows, HEADER_SEARCH_ROWS), start=1):
+            header = [_cell(value).lower() for value in row]
+            for layout in LAYOUTS:
+                indexes = layout.match(header)
+                if indexes:
+                    break
+            if indexes:
+                break
+        if not indexes:
+            continue
+
+        if account.broker != BrokerageAccount.BROKER_OTHER and layout.broker != account.broker:
+            raise StatementImportError(
+                f'Plik wygląda na wyciąg z {dict(BrokerageAccount.BROKER_CHOICES)[layout.broker]}, '
+                f'a konto {account.name} jest w {account.get_broker_display()}.'
+            )
+        width = max(indexes.values()) + 1
+        for line_number, row in enumerate(rows, start=line_number + 1):
+            row = list(row)
+            if not any(_cell(value) for value in row):
+                continue
+            row += [None] * (width - len(row))
+            try:
+                parsed = layout.parse({column: row[index] for column, index in indexes.items()}, account)
+            except (ValueError, ArithmeticError):
+                yield line_number, None
+                continue
+            if parsed is not None:
+                yield line_number, parsed
+        return
+
+    raise StatementImportError('Nie rozpoznano formatu wyciągu. Obsługiwane są historia operacji XTB i historia transakcji mBanku.')
+
+
+def _natural_key(instrument_id, transaction_type, trade_date, trade_time, quantity, price):
+    # Minutes only: transactions typed in by hand carry HH:MM, statements carry seconds.
+    minute = trade_time.replace(second=0, microsecond=0) if trade_time else None
+    return (instrument_id, transaction_type, trade_date, minute, quantity, price)
+
+
+class _InstrumentResolver:
+    """The user's instruments loaded once, matched by ticker or name; unknown ones are created a chunk at a time."""
+
+    def __init__(self, user):
+        self.user = user
+        self.created = 0
+        self._by_ticker = {}
+        self._by_name = {}
+        for instrument in BrokerageInstrument.objects.filter(user=user):
+            self._remember(instrument)
+
+    def _remember(self, instrument):
+        self._by_ticker[instrument.ticker.upper()] = instrument
+        self._by_name.setdefault(instrument.name.upper(), instrument)
+
+    def _find(self, row):
+        return self._by_ticker.get(row.symbol) or self._by_name.get(row.name.upper())
+
+    def resolve(self, rows):
+        missing = {}
+        for row in rows:
+            if self._find(row) is None:
+                missing.setdefault(row.symbol, BrokerageInstrument(
+                    user=self.user,
+                    ticker=row.symbol,
+                    name=row.name or row.symbol,
+                    exchange=row.exchange,
+                    currency=row.currency,
+                ))
+        if missing:
+            for instrument in BrokerageInstrument.objects.bulk_create(missing.values()):
+                self._remember(instrument)
+            self.created += len(missing)
+        return [self._find(row) for row in rows]
+
+
+def _chunks(items, size):
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def import_statement(account, file):
+    """Imports broker statement trades into `account` and returns counters of what happened.
+
+    Rows are parsed lazily and inserted with bulk_create in chunks of
+    BULK_INSERT_BATCH_SIZE. A row is a duplicate when the account already
+    holds a transaction with the same instrument, type, date, minute,
+    quantity and price; duplicates are counted with their multiplicity, so
+    two identical partial fills in one statement are both kept the first
+    time and both skipped on a re-import. bulk_create bypasses the model
+    signals, so each touched position's ledger is replayed once from its
+    earliest imported date and the cached summary is invalidated at the end.
+    """
+    result = {'rows': 0, 'created': 0, 'duplicates': 0, 'skipped': 0, 'instruments_created': 0, 'skipped_lines': []}
+    existing = Counter(
+        _natural_key(*values)
+        for values in BrokerageTransaction.objects
+        .filter(account=account)
+        .values_list('instrument_id', 'transaction_type', 'trade_date', 'trade_time', 'quantity', 'price')
+    )
+    replay_from = {}
+
+    with db_transaction.atomic():
+        resolver = _InstrumentResolver(account.user)
+        for chunk in _chunks(read_statement(file, account), BULK_INSERT_BATCH_SIZE):
+            rows = []
+            for line_number, row in chunk:
+                result['rows'] += 1
+                if row is None or row.currency not in SUPPORTED_CURRENCIES or row.quantity <= 0 or row.price <= 0:
+                    result['skipped'] += 1
+                    result['skipped_lines'].append(line_number)
+                    continue
+                rows.append(row._replace(
+                    quantity=row.quantity.quantize(QUANTITY_QUANTUM),
+                    price=row.price.quantize(PRICE_QUANTUM),
+                    fees=abs(row.fees).quantize(FEES_QUANTUM),
+                ))
+
+            transactions = []
+            for row, instrument in zip(rows, resolver.resolve(rows)):
+                key = _natural_key(instrument.id, row.transaction_type, row.trade_date, row.trade_time, row.quantity, row.price)
+                if existing[key] > 0:
+                    existing[key] -= 1
+                    result['duplicates'] += 1
+                    continue
+                transactions.append(BrokerageTransaction(
+                    account=account,
+                    instrument=instrument,
+                    transaction_type=row.transaction_type,
+                    trade_date=row.trade_date,
+                    trade_time=row.trade_time,
+                    quantity=row.quantity,
+                    price=row.price,
+                    fees=row.fees,
+                    notes='Import z wyciągu',
+                ))
+                position = (account.id, instrument.id)
+                replay_from[position] = min(replay_from.get(position, row.trade_date), row.trade_date)
+            BrokerageTransaction.objects.bulk_create(transactions)
+            result['created'] += len(transactions)
+
+        for (account_id, instrument_id), from_date in replay_from.items():
+            replay_ledger(account_id, instrument_id, from_date)
+        result['instruments_created'] = resolver.created
+
+    if replay_from or result['instruments_created']:
+        summary_cache.bump(account.user_id)
+    return result
@@ -0,0 +1,95 @@
+import threading
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .brokerage import build_portfolio_summary
+from .models import PortfolioCacheGeneration
+
+
+DEFAULT_SUMMARY_CACHE_TTL = timedelta(hours=6)
+
+
+class SummaryCache:
+    """build_portfolio_summary results keyed by (user, generation, day).
+
+    The generation lives in the database rather than the cache: the default
+    caches are per process, and writes made by the market-data worker or
+    another gunicorn worker must still invalidate every process's copy. A
+    repeat view therefore costs one indexed query plus one cache read. The day
+    is part of the key because upcoming dividends and their quantities depend
+    on today's date.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def generation(self, user_id):
+        return (
+            PortfolioCacheGeneration.objects
+            .filter(user_id=user_id)
+            .values_list('generation', flat=True)
+            .first()
+        ) or 0
+
+    def bump(self, user_id):
+        self.bump_many([user_id])
+
+    def bump_many(self, user_ids):
+        """Invalidates the cached summaries of all given users with one UPDATE (plus one INSERT for new users)."""
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+        generations = PortfolioCacheGeneration.objects.filter(user_id__in=user_ids)
+        if generations.update(generation=F('generation') + 1) < len(user_ids):
+            # Users seen for the first time start at 1; ignore_conflicts covers a concurrent first bump.
+            existing = set(generations.values_list('user_id', flat=True))
+            PortfolioCacheGeneration.objects.bulk_create(
+                [PortfolioCacheGeneration(user_id=user_id, generation=1) for user_id in user_ids - existing],
+                ignore_conflicts=True,
+            )
+        with self._lock:
+            self._stats['invalidations'] += len(user_ids)
+
+    def _key(self, user_id, generation):
+        return f'portfolio-summary:{user_id}:{generation}:{timezone.localdate().isoformat()}'
+
+    def get(self, user):
+        key = self._key(user.pk, self.generation(user.pk))
+        summary = cache.get(key)
+        if summary is not None:
+            self._count('hits')
+            return summary
+
+        self._count('misses')
+        summary = build_portfolio_summary(user)
+        ttl = getattr(settings, 'PORTFOLIO_SUMMARY_CACHE_TTL', DEFAULT_SUMMARY_CACHE_TTL)
+        cache.set(key, summary, ttl.total_seconds())
+        return summary
+
+    def stats(self):
+        with self._lock:
+            stats = {name: self._stats[name] for name in ('hits', 'misses', 'invalidations')}
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+summary_cache = SummaryCache()
+
+
+def get_summary_cache_stats():
+    return summary_cache.stats()
@@ -1,33 +1,82 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest.mock import patch
-from urllib.error import HTTPError
 
-from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db import transaction as db_transaction
+from django.db.models import Sum
+from django.db.models.signals import pre_delete
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from decimal import Decimal
+from openpyxl import Workbook
 from finance.models import (
     BrokerageAccount,
     BrokerageDividend,
     BrokerageInstrument,
     BrokerageTransaction,
     Daily,
+    FinanceAccount,
+    FxRate,
     Income,
+    InstrumentResolution,
+    MarketDataRefreshJob,
     Monthly,
+    MonthlyCategoryTotal,
+    OpenLot,
+    PriceBar,
+    RealizedGain,
 )
+from finance.brokerage import build_portfolio_summary, get_quantity
+from finance.fx_import import import_fx_rates_csv
+from finance.http_pool import HTTPSession, HTTPStatusError, http_session
+from finance.ledger import replay_ledger
+from finance.market_cache import quote_store, resolution_cache
 from finance.market_data import (
+    CircuitBreaker,
+    InstrumentNotFoundError,
     MarketDataError,
+    ProviderUnavailableError,
+    StooqClient,
+    TokenBucket,
+    _first_row,
+    _last_rows,
+    _read_csv_url,
+    _store_planned_dividends,
     fetch_latest_market_price,
     fetch_transaction_market_price,
+    get_provider_health,
     refresh_market_data_for_user,
+    reset_provider_guards,
+    resolve_instrument_by_isin,
 )
+from finance.portfolio_history import get_portfolio_history
+from finance.refresh_jobs import claim_next_job, enqueue_market_data_refresh, recover_stale_jobs, run_job
+from finance.reporting import build_dashboard_totals, monthly_report
 from finance.serializers import MonthlySerializer
-from datetime import date, time
+from finance.statement_import import import_statement
+from finance.summary_cache import summary_cache
+from datetime import date, datetime, time, timedelta
 
 User = get_user_model()
 
 
 class BrokerageMarketDataTests(TestCase):
+    def setUp(self):
+        resolution_cache.clear()
+        quote_store.clear()
+        reset_provider_guards()
+
     @override_settings(OPENFIGI_API_KEY="openfigi-key", ALPHA_VANTAGE_API_KEY="alpha-key")
     @patch("finance.market_data._request_json")
     def test_latest_price_resolves_isin_with_openfigi_and_fetches_quote_from_alpha_vantage(self, mock_request_json):
@@ -122,6 +171,72 @@ class BrokerageMarketDataTests(TestCase):
         self.assertEqual(result["price"], Decimal("484.20"))
         self.assertEqual(result["source"], "Stooq")
 
+    @override_settings(MARKET_DATA_PRICE_BACKFILL_DAYS=30)
+    @patch("finance.market_data.timezone.localdate", return_value=date(2026, 4, 20))
+    @patch("finance.market_data._read_csv_url")
+    def test_daily_close_is_served_from_stored_bars_and_backfilled_incrementally(self, mock_read_csv, mock_localdate):
+        mock_read_csv.side_effect = [
+            [
+                {"Date": "2026-04-14", "Open": "470", "High": "482", "Low": "468", "Close": "478.00", "Volume": "1200"},
+                {"Date": "2026-04-15", "Open": "478", "High": "485", "Low": "476", "Close": "481.00", "Volume": "1500"},
+            ],
+            [
+                {"Date": "2026-04-16", "Open": "481", "High": "490", "Low": "480", "Close": "488.50", "Volume": "900"},
+            ],
+            [
+                {"Date": "2026-03-02", "Open": "450", "High": "455", "Low": "447", "Close": "452.00", "Volume": "700"},
+            ],
+        ]
+        client = StooqClient()
+
+        self.assertEqual(client.fetch_daily_close("KRU", date(2026, 4, 15), "GPW", "PLN"), Decimal("481.00"))
+        self.assertEqual(client.fetch_daily_close("KRU", date(2026, 4, 14), "GPW", "PLN"), Decimal("478.00"))
+        self.assertEqual(mock_read_csv.call_count, 1)
+        self.assertIn("d1=20260316", mock_read_csv.call_args_list[0][0][0])
+        self.assertIn("d2=20260419", mock_read_csv.call_args_list[0][0][0])
+
+        self.assertEqual(client.fetch_daily_close("KRU", date(2026, 4, 17), "GPW", "PLN"), Decimal("488.50"))
+        self.assertIn("d1=20260416", mock_read_csv.call_args_list[1][0][0])
+        self.assertIn("d2=20260419", mock_read_csv.call_args_list[1][0][0])
+
+        self.assertEqual(client.fetch_daily_close("KRU", date(2026, 3, 3), "GPW", "PLN"), Decimal("452.00"))
+        self.assertEqual(mock_read_csv.call_count, 3)
+        self.assertIn("d1=20260201", mock_read_csv.call_args_list[2][0][0])
+        self.assertIn("d2=20260315", mock_read_csv.call_args_list[2][0][0])
+        self.assertEqual(PriceBar.objects.filter(symbol="kru.pl").count(), 4)
+
+    @override_settings(MARKET_DATA_PRICE_BACKFILL_DAYS=30)
+    @patch("finance.market_data.timezone.localdate", return_value=date(2026, 4, 20))
+    @patch("finance.market_data._read_csv_url")
+    def test_daily_close_without_bars_is_not_downloaded_again(self, mock_read_csv, mock_localdate):
+        mock_read_csv.return_value = []
+        client = StooqClient()
+
+        with self.assertRaises(MarketDataError):
+            client.fetch_daily_close("KRU", date(2026, 4, 1), "GPW", "PLN")
+        calls = mock_read_csv.call_count
+        self.assertGreater(calls, 0)
+
+        with self.assertRaises(MarketDataError):
+            client.fetch_daily_close("KRU", date(2026, 4, 1), "GPW", "PLN")
+        self.assertEqual(mock_read_csv.call_count, calls)
+
+    @override_settings(MARKET_DATA_PRICE_BACKFILL_DAYS=30)
+    @patch("finance.market_data.timezone.localdate", return_value=date(2026, 4, 21))
+    @patch("finance.market_data._read_csv_url")
+    def test_daily_close_not_yet_published_is_fetched_again(self, mock_read_csv, mock_localdate):
+        mock_read_csv.side_effect = [
+            [{"Date": "2026-04-17", "Close": "478.00"}],
+            [{"Date": "2026-04-20", "Close": "490.00"}],
+        ]
+        client = StooqClient()
+
+        self.assertEqual(client.fetch_daily_close("KRU", date(2026, 4, 20), "GPW", "PLN"), Decimal("478.00"))
+        self.assertEqual(client.fetch_daily_close("KRU", date(2026, 4, 20), "GPW", "PLN"), Decimal("490.00"))
+        self.assertEqual(mock_read_csv.call_count, 2)
+        self.assertIn("d1=20260418", mock_read_csv.call_args_list[1][0][0])
+        self.assertIn("d2=20260420", mock_read_csv.call_args_list[1][0][0])
+
     @override_settings(OPENFIGI_API_KEY="openfigi-key", ALPHA_VANTAGE_API_KEY="alpha-key")
     @patch("finance.market_data._read_csv_url")
     @patch("finance.market_data._request_json")
@@ -273,6 +388,7 @@ class BrokerageMarketDataTests(TestCase):
         canonical.refresh_from_db()
         self.assertEqual(result["merged_instruments"], 1)
         self.assertEqual(moved_transaction.instrument, canonical)
+        self.assertEqual(moved_transaction.open_lot.instrument, canonical)
         self.assertFalse(BrokerageInstrument.objects.filter(id=duplicate.id).exists())
         self.assertEqual(canonical.last_price, Decimal("52.4000"))
 
@@ -354,27 +470,567 @@ class BrokerageMarketDataTests(TestCase):
         self.assertEqual(instrument.market_data_source, "Stooq")
         self.assertIn("ubi.fr", mock_read_csv.call_args[0][0])
 
-    @override_settings(OPENFIGI_API_KEY="openfigi-key", ALPHA_VANTAGE_API_KEY="alpha-key")
-    @patch("finance.market_data.urlopen")
-    def test_provider_http_error_is_returned_as_market_data_error(self, mock_urlopen):
-        mock_urlopen.side_effect = HTTPError(
-            url="https://api.openfigi.com/v3/mapping",
-            code=402,
-            msg="Payment Required",
-            hdrs=None,
-            fp=None,
+    @override_settings(OPENFIGI_API_KEY="openfigi-key")
+    @patch("finance.market_data._request_json")
+    def test_isin_resolution_is_cached_in_memory_and_database(self, mock_request_json):
+        mock_request_json.return_value = [{
+            "data": [{
+                "ticker": "KRU",
+                "name": "KRUK S.A.",
+                "marketSector": "Equity",
+                "exchCode": "PW",
+                "micCode": "XWAR",
+            }]
+        }]
+
+        first = resolve_instrument_by_isin("plkrk0000010", "GPW", "PLN")
+        second = resolve_instrument_by_isin("PLKRK0000010", "gpw", "pln")
+        resolution_cache.clear()
+        third = resolve_instrument_by_isin("PLKRK0000010", "GPW", "PLN")
+
+        self.assertEqual(mock_request_json.call_count, 1)
+        self.assertEqual(first["symbol"], "KRU")
+        self.assertEqual(second["symbol"], "KRU")
+        self.assertEqual(third["exchange"], "XWAR")
+        self.assertTrue(InstrumentResolution.objects.get(isin="PLKRK0000010").found)
+        self.assertEqual(resolution_cache.stats()["db_hits"], 1)
+
+    @override_settings(OPENFIGI_API_KEY="openfigi-key")
+    @patch("finance.market_data._request_json")
+    def test_isin_resolution_caches_not_found_answers(self, mock_request_json):
+        mock_request_json.return_value = [{"warning": "No identifier found."}]
+
+        for _ in range(2):
+            with self.assertRaisesRegex(InstrumentNotFoundError, "PLXXX0000000"):
+                resolve_instrument_by_isin("PLXXX0000000")
+
+        self.assertEqual(mock_request_json.call_count, 1)
+        self.assertFalse(InstrumentResolution.objects.get(isin="PLXXX0000000").found)
+        self.assertEqual(resolution_cache.stats()["negative_hits"], 1)
+
+    @override_settings(OPENFIGI_API_KEY="openfigi-key", ALPHA_VANTAGE_API_KEY="")
+    @patch("finance.market_data._read_csv_url")
+    @patch("finance.market_data._request_json")
+    def test_refresh_market_data_skips_openfigi_for_cached_isin(self, mock_request_json, mock_read_csv):
+        user = User.objects.create_user(username="cached-market-user", password="pass123")
+        BrokerageInstrument.objects.create(
+            user=user,
+            ticker="KRU",
+            name="Kruk",
+            isin="PLKRK0000010",
+            exchange="XWAR",
+            asset_type=BrokerageInstrument.STOCK,
+            currency="PLN",
+        )
+        mock_request_json.return_value = [{
+            "data": [{"ticker": "KRU", "name": "KRUK S.A.", "marketSector": "Equity", "micCode": "XWAR"}]
+        }]
+        mock_read_csv.return_value = [{"Symbol": "KRU.PL", "Close": "484.20"}]
+
+        refresh_market_data_for_user(user)
+        resolution_cache.clear()
+        result = refresh_market_data_for_user(user)
+
+        self.assertEqual(mock_request_json.call_count, 1)
+        self.assertEqual(result["updated_quotes"], 1)
+        self.assertEqual(result["resolution_cache"]["lru_hits"], 1)
+
+    @override_settings(OPENFIGI_API_KEY="openfigi-key", ALPHA_VANTAGE_API_KEY="", OPENFIGI_MAX_JOBS_PER_REQUEST=4)
+    @patch("finance.market_data._read_csv_url")
+    @patch("finance.market_data._request_json")
+    def test_refresh_market_data_batches_openfigi_mapping_jobs(self, mock_request_json, mock_read_csv):
+        user = User.objects.create_user(username="batch-market-user", password="pass123")
+        isins = ["PLKRK0000010", "PLPZU0000011", "PLPKO0000016", "PLXXX0000000", "PLCDPRO00015"]
+        for isin in isins:
+            BrokerageInstrument.objects.create(
+                user=user,
+                ticker=isin,
+                name=isin,
+                isin=isin,
+                exchange="XWAR",
+                asset_type=BrokerageInstrument.STOCK,
+                currency="PLN",
+            )
+
+        def map_jobs(url, data=None, headers=None):
+            return [
+                {"warning": "No identifier found."} if job["idValue"] == "PLXXX0000000"
+                else {"data": [{"ticker": job["idValue"][2:5], "name": job["idValue"], "micCode": "XWAR"}]}
+                for job in data
+            ]
+
+        mock_request_json.side_effect = map_jobs
+        mock_read_csv.return_value = [{"Symbol": "X.PL", "Close": "10.00"}]
+
+        result = refresh_market_data_for_user(user)
+
+        self.assertEqual(mock_request_json.call_count, 3)
+        self.assertTrue(all(len(call.kwargs["data"]) <= 4 for call in mock_request_json.call_args_list))
+        self.assertEqual(result["updated_quotes"], 4)
+        self.assertEqual(len(result["failed_quotes"]), 1)
+        self.assertIn("Nie znaleziono instrumentu dla ISIN PLXXX0000000", result["failed_quotes"][0])
+        self.assertEqual(
+            sorted(BrokerageInstrument.objects.filter(user=user).values_list("ticker", flat=True)),
+            ["CDP", "KRK", "PKO", "PLXXX0000000", "PZU"],
+        )
+
+    @override_settings(OPENFIGI_API_KEY="openfigi-key", ALPHA_VANTAGE_API_KEY="")
+    @patch("finance.market_data._read_csv_url")
+    @patch("finance.market_data._request_json")
+    def test_refresh_market_data_shares_quotes_between_users(self, mock_request_json, mock_read_csv):
+        users = [User.objects.create_user(username=f"quote-user-{index}", password="pass123") for index in range(2)]
+        for user in users:
+            BrokerageInstrument.objects.create(
+                user=user,
+                ticker="KRU",
+                name="Kruk",
+                isin="PLKRK0000010",
+                exchange="XWAR",
+                asset_type=BrokerageInstrument.STOCK,
+                currency="PLN",
+            )
+        mock_request_json.return_value = [{
+            "data": [{"ticker": "KRU", "name": "KRUK S.A.", "marketSector": "Equity", "micCode": "XWAR"}]
+        }]
+        mock_read_csv.return_value = [{"Symbol": "KRU.PL", "Close": "484.20"}]
+
+        results = [refresh_market_data_for_user(user) for user in users]
+
+        self.assertEqual(mock_read_csv.call_count, 1)
+        self.assertEqual([result["updated_quotes"] for result in results], [1, 1])
+        self.assertEqual(results[1]["quote_cache"]["hits"], 1)
+        self.assertEqual(
+            list(BrokerageInstrument.objects.values_list("last_price", flat=True).distinct()),
+            [Decimal("484.2000")],
+        )
+
+    @override_settings(OPENFIGI_API_KEY="openfigi-key", ALPHA_VANTAGE_API_KEY="")
+    @patch("finance.market_data._read_csv_url")
+    @patch("finance.market_data._request_json")
+    def test_refresh_all_market_data_fetches_each_symbol_once(self, mock_request_json, mock_read_csv):
+        users = [User.objects.create_user(username=f"nightly-user-{index}", password="pass123") for index in range(3)]
+        for user in users:
+            BrokerageInstrument.objects.create(
+                user=user,
+                ticker="KRU",
+                name="Kruk",
+                isin="PLKRK0000010",
+                exchange="XWAR",
+                asset_type=BrokerageInstrument.STOCK,
+                currency="PLN",
+            )
+        BrokerageInstrument.objects.create(
+            user=users[0],
+            ticker="PKO",
+            name="PKO BP",
+            exchange="XWAR",
+            asset_type=BrokerageInstrument.STOCK,
+            currency="PLN",
         )
+        mock_request_json.return_value = [{
+            "data": [{"ticker": "KRU", "name": "KRUK S.A.", "marketSector": "Equity", "micCode": "XWAR"}]
+        }]
+        mock_read_csv.return_value = [{"Symbol": "KRU.PL", "Close": "484.20"}]
+        output = StringIO()
+
+        call_command("refresh_all_market_data", stdout=output)
+
+        self.assertEqual(mock_request_json.call_count, 1)
+        self.assertEqual(mock_read_csv.call_count, 2)
+        self.assertFalse(BrokerageInstrument.objects.filter(last_price__isnull=True).exists())
+        self.assertEqual(BrokerageInstrument.objects.filter(last_price=Decimal("484.20")).count(), 4)
+        self.assertIn("Użytkownicy: 3, instrumenty: 4, unikalne symbole: 2", output.getvalue())
+        self.assertIn("Wywołania dostawców: OpenFIGI: 1, Stooq: 2", output.getvalue())
+
+    @patch("finance.market_data._read_csv_url")
+    def test_concurrent_quote_requests_share_one_fetch(self, mock_read_csv):
+        fetch_started = threading.Event()
+        release_fetch = threading.Event()
+
+        def read_csv(url):
+            fetch_started.set()
+            release_fetch.wait(timeout=5)
+            return [{"Symbol": "KRU.PL", "Close": "484.20"}]
+
+        mock_read_csv.side_effect = read_csv
+        prices = []
+        threads = [
+            threading.Thread(target=lambda: prices.append(StooqClient().fetch_quote("KRU", "XWAR", "PLN")))
+            for _ in range(3)
+        ]
+        threads[0].start()
+        fetch_started.wait(timeout=5)
+        for thread in threads[1:]:
+            thread.start()
+        release_fetch.set()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        self.assertEqual(prices, [Decimal("484.20")] * 3)
+        self.assertEqual(mock_read_csv.call_count, 1)
+
+    @patch("finance.market_data._read_csv_url")
+    def test_daily_bar_download_failing_mid_body_counts_as_provider_failure(self, mock_read_csv):
+        def broken_rows(url):
+            yield {"Date": "2026-04-09", "Close": "480.00"}
+            raise ProviderUnavailableError("Połączenie zostało przerwane.")
+
+        mock_read_csv.side_effect = broken_rows
+
+        with self.assertRaises(ProviderUnavailableError):
+            StooqClient().backfill_daily_bars("kru.pl", date(2026, 4, 9), until=date(2026, 4, 10))
+
+        self.assertEqual(get_provider_health()["Stooq"]["failures"], 1)
+
+    @override_settings(ALPHA_VANTAGE_API_KEY="", MARKET_DATA_MAX_WORKERS=4)
+    @patch("finance.market_data.fetch_latest_market_price")
+    def test_refresh_market_data_fetches_instruments_concurrently(self, mock_fetch_price):
+        user = User.objects.create_user(username="concurrent-market-user", password="pass123")
+        for ticker in ("KRU", "PZU", "PKO"):
+            BrokerageInstrument.objects.create(
+                user=user,
+                ticker=ticker,
+                name=ticker,
+                exchange="XWAR",
+                asset_type=BrokerageInstrument.STOCK,
+                currency="PLN",
+            )
+        barrier = threading.Barrier(3, timeout=5)
+
+        def fetch_price(symbol="", **kwargs):
+            barrier.wait()
+            if symbol == "PZU":
+                raise MarketDataError("brak danych")
+            return {"price": Decimal("10.00"), "source": "Stooq", "symbol": symbol, "price_symbol": ""}
+
+        mock_fetch_price.side_effect = fetch_price
+        closing_threads = []
+
+        with patch("finance.market_data.close_old_connections", side_effect=lambda: closing_threads.append(threading.current_thread().name)):
+            result = refresh_market_data_for_user(user)
+
+        self.assertEqual(result["updated_quotes"], 2)
+        self.assertEqual(result["failed_quotes"], ["PZU: brak danych"])
+        self.assertEqual(len(closing_threads), 3)
+        self.assertTrue(all(name.startswith("market-data") for name in closing_threads))
+        self.assertEqual(
+            list(BrokerageInstrument.objects.filter(user=user, last_price__isnull=False).values_list("ticker", flat=True)),
+            ["KRU", "PKO"],
+        )
+
+    @override_settings(ALPHA_VANTAGE_API_KEY="alpha-key")
+    @patch("finance.market_data._read_csv_url")
+    @patch("finance.market_data._request_json")
+    def test_alpha_vantage_throttling_opens_breaker_for_remaining_instruments(self, mock_request_json, mock_read_csv):
+        user = User.objects.create_user(username="throttled-user", password="pass123")
+        for ticker in ("AAPL", "MSFT", "NVDA"):
+            BrokerageInstrument.objects.create(
+                user=user,
+                ticker=ticker,
+                price_symbol=f"{ticker}.US",
+                name=ticker,
+                exchange="NASDAQ",
+                asset_type=BrokerageInstrument.STOCK,
+                currency="USD",
+            )
+        mock_request_json.return_value = {"Note": "Thank you for using Alpha Vantage! Our standard API rate limit is 5 requests per minute."}
+        mock_read_csv.return_value = [{"Symbol": "AAPL.US", "Close": "189.12"}]
+
+        result = refresh_market_data_for_user(user)
+
+        self.assertEqual(mock_request_json.call_count, 1)
+        self.assertEqual(result["updated_quotes"], 3)
+        self.assertEqual(len(result["failed_dividends"]), 3)
+        self.assertEqual(result["providers"]["Alpha Vantage"]["state"], CircuitBreaker.OPEN)
+        self.assertEqual(result["providers"]["Alpha Vantage"]["rejected"], 5)
+
+    def test_planned_dividends_upsert_in_constant_queries(self):
+        user = User.objects.create_user(username="dividend-user", password="pass123")
+        today = timezone.localdate()
+        accounts = [
+            BrokerageAccount.objects.create(
+                user=user,
+                name=f"XTB {index}",
+                broker=BrokerageAccount.BROKER_XTB,
+                account_type=BrokerageAccount.STANDARD,
+                currency="PLN",
+            )
+            for index in range(2)
+        ]
+        instruments = []
+        for index in range(4):
+            instrument = BrokerageInstrument.objects.create(
+                user=user,
+                ticker=f"DIV{index}",
+                name=f"Dywidendowa {index}",
+                asset_type=BrokerageInstrument.STOCK,
+                currency="PLN",
+            )
+            instruments.append(instrument)
+            BrokerageTransaction.objects.create(
+                account=accounts[0],
+                instrument=instrument,
+                transaction_type=BrokerageTransaction.BUY,
+                trade_date=today - timedelta(days=30),
+                quantity="10",
+                price="10.00",
+                fees="0.00",
+            )
+        # The second account buys only after the ex-dividend date, so it gets nothing.
+        BrokerageTransaction.objects.create(
+            account=accounts[1],
+            instrument=instruments[0],
+            transaction_type=BrokerageTransaction.BUY,
+            trade_date=today + timedelta(days=3),
+            quantity="5",
+            price="10.00",
+            fees="0.00",
+        )
+
+        def targets(amount):
+            items = [
+                {"ex_dividend_date": (today + timedelta(days=2)).isoformat(), "payment_date": (today + timedelta(days=20)).isoformat(), "amount": amount},
+                {"ex_dividend_date": "None", "payment_date": (today + timedelta(days=40)).isoformat(), "amount": amount},
+                {"ex_dividend_date": (today - timedelta(days=60)).isoformat(), "payment_date": (today - timedelta(days=50)).isoformat(), "amount": amount},
+                {"ex_dividend_date": "None", "payment_date": "None", "amount": amount},
+            ]
+            return [(instrument, accounts, items) for instrument in instruments]
+
+        with self.assertNumQueries(4):
+            created = _store_planned_dividends(targets("1.50"), "Alpha Vantage", today)
+
+        self.assertEqual(created, 8)
+        self.assertFalse(BrokerageDividend.objects.filter(account=accounts[1]).exists())
+
+        with self.assertNumQueries(4):
+            created = _store_planned_dividends(targets("2.00"), "Alpha Vantage", today)
+
+        self.assertEqual(created, 0)
+        self.assertEqual(BrokerageDividend.objects.count(), 8)
+        self.assertEqual(
+            set(BrokerageDividend.objects.values_list("gross_amount_per_share", "status", "ex_dividend_date")),
+            {
+                (Decimal("2.000000"), BrokerageDividend.PLANNED, today + timedelta(days=2)),
+                (Decimal("2.000000"), BrokerageDividend.PLANNED, None),
+            },
+        )
+
+    def test_token_bucket_waits_for_budget_or_rejects(self):
+        bucket = TokenBucket(2, 1)
+
+        self.assertEqual(bucket.reserve(max_wait=0), 0)
+        self.assertEqual(bucket.reserve(max_wait=0), 0)
+        self.assertIsNone(bucket.reserve(max_wait=0.1))
+        self.assertAlmostEqual(bucket.reserve(max_wait=1), 0.5, delta=0.05)
+        self.assertEqual(bucket.rejected, 1)
+
+    def test_circuit_breaker_lets_one_trial_call_through_after_reset_timeout(self):
+        breaker = CircuitBreaker("Stooq", failure_threshold=2, reset_timeout=0)
+
+        breaker.record_failure("timeout")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure("timeout")
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        breaker.before_call()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(ProviderUnavailableError):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.snapshot()["state"], CircuitBreaker.CLOSED)
+
+    @override_settings(OPENFIGI_API_KEY="openfigi-key", ALPHA_VANTAGE_API_KEY="alpha-key")
+    @patch("finance.market_data.http_session.request")
+    def test_provider_http_error_is_returned_as_market_data_error(self, mock_request):
+        mock_request.side_effect = HTTPStatusError("https://api.openfigi.com/v3/mapping", 402, "Payment Required")
 
         with self.assertRaisesRegex(MarketDataError, "Payment Required"):
             fetch_latest_market_price(isin="PLKRK0000010")
 
 
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = b"Symbol,Close\nKRU.PL,484.20\n"
+        if self.path.startswith("/history"):
+            body = b"Date,Close\n" + b"".join(
+                f"{date.fromordinal(738000 + day).isoformat()},{100 + day / 100:.2f}\n".encode() for day in range(20000)
+            )
+        status = 404 if self.path.startswith("/missing") else 200
+        self.send_response(status)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class HTTPSessionTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.session = HTTPSession()
+        http_session.clear()
+
+    def tearDown(self):
+        self.session.clear()
+        http_session.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused_and_gzip_bodies_decoded(self):
+        for _ in range(3):
+            with self.session.request("GET", f"{self.base_url}/q/l/?s=kru.pl") as response:
+                self.assertEqual(response.read(), b"Symbol,Close\nKRU.PL,484.20\n")
+
+        stats = self.session.stats()
+        self.assertEqual(stats["opened"], 1)
+        self.assertEqual(stats["reused"], 2)
+        self.assertEqual(stats["idle"], 1)
+
+    def test_csv_rows_are_streamed_lazily(self):
+        rows = _read_csv_url(f"{self.base_url}/history")
+
+        self.assertNotIsInstance(rows, list)
+        tail = _last_rows(rows, 2, lambda row: row["Close"])
+        self.assertEqual([row["Date"] for row in tail], ["2076-04-29", "2076-04-30"])
+
+        first = _first_row(_read_csv_url(f"{self.base_url}/history"))
+        self.assertEqual(first, {"Date": "2021-07-29", "Close": "100.00"})
+
+    def test_abandoned_small_response_keeps_connection_alive(self):
+        self.assertEqual(_first_row(_read_csv_url(f"{self.base_url}/q/l/"))["Symbol"], "KRU.PL")
+        self.assertEqual(_first_row(_read_csv_url(f"{self.base_url}/q/l/"))["Close"], "484.20")
+
+        self.assertEqual(http_session.stats()["reused"], 1)
+
+    def test_error_status_raises_http_status_error(self):
+        with self.assertRaises(HTTPStatusError) as raised:
+            self.session.request("GET", f"{self.base_url}/missing")
+
+        self.assertEqual(raised.exception.code, 404)
+        self.assertEqual(self.session.stats()["idle"], 1)
+
+
+class MarketDataRefreshJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="refresh-user", password="pass123")
+        self.client.login(username="refresh-user", password="pass123")
+
+    @patch("finance.refresh_jobs.refresh_market_data_for_user")
+    def test_refresh_view_enqueues_single_job_without_fetching(self, mock_refresh):
+        for _ in range(2):
+            response = self.client.post(reverse("finance:brokerage_refresh"))
+            self.assertRedirects(response, reverse("finance:brokerage"))
+
+        mock_refresh.assert_not_called()
+        job = MarketDataRefreshJob.objects.get(user=self.user)
+        self.assertEqual(job.status, MarketDataRefreshJob.QUEUED)
+
+        status = self.client.get(reverse("finance:brokerage_refresh_status")).json()
+        self.assertEqual(status["id"], job.pk)
+        self.assertEqual(status["status"], MarketDataRefreshJob.QUEUED)
+
+    @patch("finance.refresh_jobs.refresh_market_data_for_user")
+    def test_worker_runs_queued_job_and_reports_progress(self, mock_refresh):
+        def refresh(user, progress):
+            progress(0, 2)
+            progress(2, 2)
+            return {
+                "updated_quotes": 2,
+                "updated_dividends": 1,
+                "merged_instruments": 0,
+                "failed_quotes": [],
+                "failed_dividends": [],
+                "source": "Stooq",
+            }
+
+        mock_refresh.side_effect = refresh
+        job = enqueue_market_data_refresh(self.user)
+
+        call_command("market_data_worker", "--once", stdout=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, MarketDataRefreshJob.DONE)
+        self.assertEqual((job.progress_done, job.progress_total), (2, 2))
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.result["updated_quotes"], 2)
+
+        status = self.client.get(reverse("finance:brokerage_refresh_status")).json()
+        self.assertEqual(status["progress_percent"], 100)
+        self.assertIn("Odświeżono ceny: 2", status["messages"][-1]["text"])
+        self.assertIsNone(claim_next_job())
+
+    @patch("finance.refresh_jobs.refresh_market_data_for_user")
+    def test_worker_records_refresh_failure(self, mock_refresh):
+        mock_refresh.side_effect = MarketDataError("Stooq nie odpowiada")
+        job = enqueue_market_data_refresh(self.user)
+
+        run_job(claim_next_job("test-worker"))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, MarketDataRefreshJob.FAILED)
+        self.assertEqual(job.error, "Stooq nie odpowiada")
+        self.assertEqual(job.worker, "test-worker")
+
+    def test_stale_running_jobs_are_requeued_until_attempt_limit(self):
+        old_heartbeat = timezone.now() - timedelta(hours=1)
+        retried = MarketDataRefreshJob.objects.create(
+            user=self.user, status=MarketDataRefreshJob.RUNNING, attempts=1, heartbeat_at=old_heartbeat,
+        )
+        exhausted = MarketDataRefreshJob.objects.create(
+            user=self.user, status=MarketDataRefreshJob.RUNNING, attempts=3, heartbeat_at=old_heartbeat,
+        )
+
+        self.assertEqual(recover_stale_jobs(), (1, 1))
+
+        retried.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual(retried.status, MarketDataRefreshJob.QUEUED)
+        self.assertEqual(exhausted.status, MarketDataRefreshJob.FAILED)
+
+
 class FinanceCoreTests(TestCase):
     def setUp(self):
+        cache.clear()
+        summary_cache.clear()
         self.user = User.objects.create_user(username="u1", password="pass123")
         self.personal_account = self.user.owned_finance_accounts.get(account_type='personal')
         self.client.login(username="u1", password="pass123")
 
+    def test_finance_accounts_are_resolved_once_per_request_and_only_when_rendered(self):
+        def account_queries(url):
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            return [query["sql"] for query in queries if "finance_accounts" in query["sql"]]
+
+        self.assertEqual(len(account_queries(reverse("finance:dashboard"))), 1)
+        self.assertEqual(account_queries(reverse("index")), [])
+
+        shared_account = FinanceAccount.objects.create(owner=self.user, name="Dom", account_type=FinanceAccount.SHARED)
+        shared_account.members.add(self.user)
+        self.client.post(reverse("finance:switch_account"), {"account_id": shared_account.id})
+        resp = self.client.get(reverse("finance:dashboard"))
+        self.assertEqual(resp.context["active_finance_account"].id, shared_account.id)
+        self.assertEqual([account.id for account in resp.context["finance_accounts"]], [self.personal_account.id, shared_account.id])
+
+    def test_request_accounts_restore_a_lost_personal_membership(self):
+        self.personal_account.members.remove(self.user)
+
+        resp = self.client.get(reverse("finance:dashboard"))
+
+        self.assertEqual(resp.context["active_finance_account"].id, self.personal_account.id)
+        self.assertEqual([account.id for account in resp.context["finance_accounts"]], [self.personal_account.id])
+        self.assertTrue(self.personal_account.members.filter(id=self.user.id).exists())
+
     def test_add_expense_creates_monthly_and_updates_total(self):
         resp = self.client.post(reverse("finance:add_expense"), {
             "date": "2025-06-15",
@@ -513,7 +1169,7 @@ class FinanceCoreTests(TestCase):
 
     def test_dashboard_separates_investments_from_expenses(self):
         today = timezone.now().date()
-        month = Monthly.objects.create(user=self.user, account=self.personal_account, date=today.replace(day=1), total_income=0, total_expense=300)
+        month = Monthly.objects.create(user=self.user, account=self.personal_account, date=today.replace(day=1), total_income=0, total_expense=0)
         Daily.objects.create(user=self.user, account=self.personal_account, date=today, title="ETF", category="Inwestycje", store="", cost=120, month=month)
         Daily.objects.create(user=self.user, account=self.personal_account, date=today, title="Zakupy", category="Zakupy spozywcze", store="", cost=180, month=month)
 
@@ -525,8 +1181,34 @@ class FinanceCoreTests(TestCase):
         self.assertEqual(resp.context["recent_expenses"][0].category, "Zakupy spozywcze")
         self.assertEqual(resp.context["recent_investments"][0].category, "Inwestycje")
 
+    def test_dashboard_totals_come_from_a_fixed_number_of_queries(self):
+        month = Monthly.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 1), total_income=0, total_expense=0)
+        for day in range(1, 11):
+            Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, day), title=f"Zakupy {day}", category="Zakupy spozywcze", store="", cost=10, month=month)
+            Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, day), title=f"Paliwo {day}", category="Paliwo", store="", cost=5, month=month)
+            Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, day), title=f"ETF {day}", category="Inwestycje", store="", cost=100, month=month)
+            Income.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, day), title=f"Zlecenie {day}", source="Inne", amount=50, month=month)
+        Income.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 10), title="Pensja", source="Pensja", amount=5000, month=month)
+
+        with self.assertNumQueries(4):
+            totals = build_dashboard_totals(self.personal_account, month, 30, ["Paliwo", "Inwestycje"])
+
+        self.assertEqual(totals["daily_expenses_data"][:11], [15.0] * 10 + [0.0])
+        self.assertEqual(totals["daily_investments_data"][9], 100.0)
+        self.assertEqual(totals["daily_incomes_data"][9], 5050.0)
+        self.assertEqual(totals["investment_total"], Decimal("1000.00"))
+        self.assertEqual(totals["selected_category_total"], Decimal("1050.00"))
+        self.assertEqual(totals["categories"], ["Zakupy spozywcze", "Paliwo"])
+        self.assertEqual(totals["amounts"], [100.0, 50.0])
+        self.assertEqual(totals["income_sources"], ["Pensja", "Inne"])
+        self.assertEqual(totals["income_amounts"], [5000.0, 500.0])
+        self.assertEqual([expense.title for expense in totals["recent_expenses"]], ["Paliwo 10", "Zakupy 10", "Paliwo 9", "Zakupy 9", "Paliwo 8"])
+        self.assertEqual([investment.title for investment in totals["recent_investments"]], [f"ETF {day}" for day in range(10, 5, -1)])
+        self.assertEqual([income.title for income in totals["recent_incomes"]], ["Pensja", "Zlecenie 10", "Zlecenie 9", "Zlecenie 8", "Zlecenie 7"])
+
     def test_reports_keep_investments_in_balance_but_show_separately(self):
-        month = Monthly.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 1), total_income=1000, total_expense=400)
+        month = Monthly.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 1), total_income=0, total_expense=0)
+        Income.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 1), title="Pensja", source="Pensja", amount=1000, month=month)
         Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 10), title="ETF", category="Inwestycje", store="", cost=150, month=month)
         Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 11), title="Rachunek", category="Rachunki", store="", cost=250, month=month)
 
@@ -537,6 +1219,36 @@ class FinanceCoreTests(TestCase):
         self.assertEqual(float(resp.context["total_spending_all"]), 250.0)
         self.assertEqual(float(resp.context["balance_all"]), 600.0)
 
+    def test_reports_window_length_does_not_add_queries(self):
+        for month_index in range(14):
+            month_date = date(2024 + month_index // 12, month_index % 12 + 1, 1)
+            month = Monthly.objects.create(user=self.user, account=self.personal_account, date=month_date, total_income=0, total_expense=0)
+            Income.objects.create(user=self.user, account=self.personal_account, date=month_date, title="Pensja", source="Pensja", amount=1000, month=month)
+            Daily.objects.create(user=self.user, account=self.personal_account, date=month_date, title="ETF", category="Inwestycje", store="", cost=100 + month_index, month=month)
+            Daily.objects.create(user=self.user, account=self.personal_account, date=month_date, title="Rachunek", category="Rachunki", store="", cost=50, month=month)
+        call_command("verify_monthly_totals", stdout=StringIO())
+
+        with self.assertNumQueries(1):
+            records = monthly_report(self.personal_account, 12)
+
+        self.assertEqual(len(records), 12)
+        self.assertEqual(records[0].date, date(2025, 2, 1))
+        self.assertEqual(records[0].investment_total, Decimal("113.00"))
+        self.assertEqual(records[0].spending_total, Decimal("50.00"))
+        self.assertEqual(records[0].monthly_balance, Decimal("837.00"))
+
+        self.client.get(reverse("finance:reports"))
+        query_counts = {}
+        for months in ("6", "60"):
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(reverse("finance:reports"), {"months": months})
+            query_counts[months] = len(queries)
+            self.assertEqual(resp.status_code, 200)
+        self.assertEqual(query_counts["6"], query_counts["60"])
+        self.assertEqual(resp.context["report_months"], 60)
+        self.assertEqual(len(resp.context["months_labels"]), 14)
+        self.assertEqual(resp.context["investment_data"][0], 100.0)
+
     def test_expense_list_shows_investments_separately(self):
         month = Monthly.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 1), total_income=0, total_expense=200)
         Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 10), title="ETF", category="Inwestycje", store="", cost=150, month=month)
@@ -579,6 +1291,162 @@ class FinanceCoreTests(TestCase):
         self.assertEqual(float(shared_month.total_income), 250.0)
         self.assertEqual(float(linked_income.amount), 250.0)
 
+    def test_monthly_totals_follow_amounts_rounded_to_the_stored_cents(self):
+        for title, cost in (("Kawa", "10.004"), ("Bilet", "10.014")):
+            self.client.post(reverse("finance:add_expense"), {"date": "2025-06-15", "title": title, "category": "Inne", "store": "", "cost": cost})
+        self.client.post(reverse("finance:edit_expense", args=[Daily.objects.get(title="Kawa").id]), {
+            "date": "2025-06-15",
+            "title": "Kawa",
+            "category": "Inne",
+            "store": "",
+            "cost": "7.124",
+        })
+        for title in ("Zwrot", "Premia"):
+            self.client.post(reverse("finance:add_income"), {"date": "2025-06-20", "title": title, "source": "Inne", "amount": "0.014"})
+
+        month = Monthly.objects.get(account=self.personal_account, date=date(2025, 6, 1))
+        self.assertEqual(month.total_expense, Daily.objects.filter(month=month).aggregate(total=Sum("cost"))["total"])
+        self.assertEqual((month.total_expense, month.total_income), (Decimal("17.13"), Decimal("0.02")))
+        self.assertEqual(MonthlyCategoryTotal.objects.get(month=month, category="Inne").total, Decimal("17.13"))
+        output = StringIO()
+        call_command("verify_monthly_totals", "--dry-run", stdout=output)
+        self.assertIn("do poprawy: 0", output.getvalue())
+
+    def test_expense_write_cost_does_not_grow_with_month_entries(self):
+        def add_expense(title):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse("finance:add_expense"), {
+                    "date": "2025-06-15",
+                    "title": title,
+                    "category": "Inne",
+                    "store": "",
+                    "cost": "10.00",
+                })
+            return len(queries)
+
+        add_expense("Pierwszy")
+        month = Monthly.objects.get(account=self.personal_account, date=date(2025, 6, 1))
+        baseline = add_expense("Drugi")
+        for index in range(30):
+            Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 1), title=f"Stary {index}", category="Inne", store="", cost=1, month=month)
+
+        self.assertEqual(add_expense("Trzeci"), baseline)
+        month.refresh_from_db()
+        self.assertEqual(month.total_expense, Decimal("60.00"))
+
+    def test_verify_monthly_totals_reconciles_drift_in_bulk(self):
+        june = Monthly.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 1), total_income=0, total_expense=0)
+        july = Monthly.objects.create(user=self.user, account=self.personal_account, date=date(2025, 7, 1), total_income=0, total_expense=0)
+        Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 2), title="A", category="Inne", store="", cost=20, month=june)
+        Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 7, 2), title="B", category="Inne", store="", cost=15, month=july)
+        Income.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 3), title="C", source="Inne", amount=100, month=june)
+        Monthly.objects.filter(pk=june.pk).update(total_income=999, total_expense=5)
+
+        output = StringIO()
+        call_command("verify_monthly_totals", "--dry-run", stdout=output)
+        june.refresh_from_db()
+        self.assertEqual(june.total_income, Decimal("999.00"))
+        self.assertIn("do poprawy: 1", output.getvalue())
+
+        output = StringIO()
+        call_command("verify_monthly_totals", stdout=output)
+
+        june.refresh_from_db()
+        self.assertEqual((june.total_income, june.total_expense), (Decimal("100.00"), Decimal("20.00")))
+        self.assertIn("przychody 999.00 -> 100.00, wydatki 5.00 -> 20.00", output.getvalue())
+        self.assertIn("Sprawdzone miesiące: 2, poprawione: 1", output.getvalue())
+
+    def test_category_rollup_follows_expense_writes_and_serves_reports(self):
+        def rollup():
+            return {
+                (row.month.date, row.category): row.total
+                for row in MonthlyCategoryTotal.objects.filter(account=self.personal_account).select_related("month")
+            }
+
+        for title, category, cost in (("Obiad", "Jedzenie na miescie", "40"), ("Bilet", "Transport miejski", "10"), ("ETF", "Inwestycje", "500")):
+            self.client.post(reverse("finance:add_expense"), {"date": "2025-06-10", "title": title, "category": category, "store": "", "cost": cost})
+        lunch = Daily.objects.get(title="Obiad")
+        self.client.post(reverse("finance:edit_expense", args=[lunch.id]), {
+            "date": "2025-07-02",
+            "title": "Obiad",
+            "category": "Zakupy spozywcze",
+            "store": "",
+            "cost": "45",
+        })
+        self.client.post(reverse("finance:delete_expense", args=[Daily.objects.get(title="Bilet").id]))
+
+        self.assertEqual(rollup(), {
+            (date(2025, 6, 1), "Inwestycje"): Decimal("500.00"),
+            (date(2025, 7, 1), "Zakupy spozywcze"): Decimal("45.00"),
+        })
+
+        MonthlyCategoryTotal.objects.filter(category="Inwestycje").update(total=1)
+        output = StringIO()
+        call_command("verify_monthly_totals", stdout=output)
+        self.assertIn("sumy kategorii przebudowane", output.getvalue())
+        self.assertEqual(rollup()[(date(2025, 6, 1), "Inwestycje")], Decimal("500.00"))
+
+        july = Monthly.objects.get(account=self.personal_account, date=date(2025, 7, 1))
+        for index in range(20):
+            Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 7, 3), title=f"Zakupy {index}", category="Zakupy spozywcze", store="", cost=5, month=july)
+        resp = self.client.get(reverse("finance:reports"))
+
+        self.assertEqual(float(resp.context["total_investment_all"]), 500.0)
+        self.assertEqual(list(resp.context["top_categories"]), [{"category": "Zakupy spozywcze", "total": Decimal("145.00")}])
+        resp = self.client.get(reverse("finance:expense_list"), {"month": "2025-07"})
+        self.assertEqual(float(resp.context["total_filtered"]), 145.0)
+
+    def test_category_with_zero_total_stays_in_pickers_until_its_last_entry_goes(self):
+        month = Monthly.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 1), total_income=0, total_expense=0)
+        free = Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 2), title="Próbka", category="Gratisy", store="", cost=0, month=month)
+        paid = Daily.objects.create(user=self.user, account=self.personal_account, date=date(2025, 6, 3), title="Kubek", category="Gratisy", store="", cost=15, month=month)
+        paid.delete()
+
+        self.assertEqual(
+            list(MonthlyCategoryTotal.objects.filter(month=month).values_list("category", "total", "entries")),
+            [("Gratisy", Decimal("0.00"), 1)],
+        )
+        resp = self.client.get(reverse("finance:expense_list"))
+        self.assertIn("Gratisy", resp.context["categories"])
+        resp = self.client.get(reverse("finance:add_expense"))
+        self.assertIn("Gratisy", resp.context["categories"])
+
+        free.delete()
+        self.assertFalse(MonthlyCategoryTotal.objects.filter(month=month).exists())
+
+    def test_moving_and_deleting_a_shared_transfer_adjusts_both_months(self):
+        User.objects.create_user(username="u2", password="pass123")
+        self.client.post(reverse("profile"), {"form_name": "shared_account", "name": "Dom", "partner_username": "u2"})
+        shared_account = self.user.finance_accounts.get(account_type='shared')
+        self.client.post(reverse("finance:add_expense"), {
+            "date": "2025-06-15",
+            "title": "Wpłata",
+            "category": "Wpłata do wspólnego z mBank",
+            "store": "",
+            "cost": "250.00",
+            "transfer_target_account": str(shared_account.id),
+        })
+        expense = Daily.objects.get(title="Wpłata")
+
+        self.client.post(reverse("finance:edit_expense", args=[expense.id]), {
+            "date": "2025-07-01",
+            "title": "Wpłata",
+            "category": "Wpłata do wspólnego z mBank",
+            "store": "",
+            "cost": "300.00",
+            "transfer_target_account": str(shared_account.id),
+        })
+
+        totals = dict(Monthly.objects.filter(account=shared_account).values_list("date", "total_income"))
+        self.assertEqual(totals, {date(2025, 6, 1): Decimal("0.00"), date(2025, 7, 1): Decimal("300.00")})
+        personal = dict(Monthly.objects.filter(account=self.personal_account).values_list("date", "total_expense"))
+        self.assertEqual(personal, {date(2025, 6, 1): Decimal("0.00"), date(2025, 7, 1): Decimal("300.00")})
+
+        self.client.post(reverse("finance:delete_expense", args=[expense.id]))
+
+        self.assertEqual(Monthly.objects.get(account=shared_account, date=date(2025, 7, 1)).total_income, Decimal("0.00"))
+        self.assertEqual(Monthly.objects.get(account=self.personal_account, date=date(2025, 7, 1)).total_expense, Decimal("0.00"))
+
     def test_brokerage_view_shows_positions_dividends_and_tax(self):
         account = BrokerageAccount.objects.create(
             user=self.user,
@@ -618,7 +1486,6 @@ class FinanceCoreTests(TestCase):
             quantity="10",
             price="10.00",
             fees="0.00",
-            fx_rate_to_pln="4.000000",
         )
         BrokerageTransaction.objects.create(
             account=account,
@@ -628,7 +1495,6 @@ class FinanceCoreTests(TestCase):
             quantity="2",
             price="15.00",
             fees="0.00",
-            fx_rate_to_pln="4.000000",
         )
         BrokerageTransaction.objects.create(
             account=ike_account,
@@ -639,19 +1505,21 @@ class FinanceCoreTests(TestCase):
             price="100.00",
             fees="0.00",
         )
+        dividend_ex_date = timezone.localdate() + timedelta(days=30)
+        dividend_payment_date = dividend_ex_date + timedelta(days=14)
         BrokerageDividend.objects.create(
             account=account,
             instrument=instrument,
-            ex_dividend_date=date(2026, 6, 1),
-            payment_date=date(2026, 6, 15),
+            ex_dividend_date=dividend_ex_date,
+            payment_date=dividend_payment_date,
             gross_amount_per_share="1.00",
             currency="USD",
         )
         BrokerageDividend.objects.create(
             account=ike_account,
             instrument=polish_instrument,
-            ex_dividend_date=date(2026, 6, 1),
-            payment_date=date(2026, 6, 15),
+            ex_dividend_date=dividend_ex_date,
+            payment_date=dividend_payment_date,
             gross_amount_per_share="2.00",
             currency="PLN",
         )
@@ -672,6 +1540,507 @@ class FinanceCoreTests(TestCase):
         self.assertEqual(currency_totals["PLN"]["planned_dividend_net"], Decimal("10.00"))
         self.assertEqual(len(response.context["positions"]), 2)
 
+    def test_fx_rates_load_from_csv_and_consolidate_summary_totals_to_pln(self):
+        account = BrokerageAccount.objects.create(
+            user=self.user,
+            name="XTB USD",
+            broker=BrokerageAccount.BROKER_XTB,
+            account_type=BrokerageAccount.STANDARD,
+            currency="USD",
+        )
+        for ticker, currency, last_price in (("AAPL", "USD", "12.00"), ("SAP", "EUR", "50.00"), ("ETFPL", "PLN", "110.00")):
+            instrument = BrokerageInstrument.objects.create(
+                user=self.user, ticker=ticker, name=ticker, currency=currency, last_price=last_price,
+            )
+            BrokerageTransaction.objects.create(
+                account=account,
+                instrument=instrument,
+                transaction_type=BrokerageTransaction.BUY,
+                trade_date=date(2026, 1, 2),
+                quantity="10",
+                price="10.00",
+            )
+        rate_date = timezone.localdate() - timedelta(days=3)
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / "archiwum_tab_a.csv"
+            path.write_text(
+                "data;1USD;100JPY\n"
+                f"{(rate_date - timedelta(days=1)):%Y%m%d};3,9000;2,6000\n"
+                f"{rate_date:%Y%m%d};4,0000;2,7000\n"
+                "nr tabeli;001/A/NBP/2026;\n",
+                encoding="utf-8",
+            )
+            out = StringIO()
+            call_command("load_fx_rates", str(path), stdout=out)
+
+        self.assertIn("Zapisane kursy: 4", out.getvalue())
+        self.assertEqual(FxRate.objects.get(currency="JPY", date=rate_date).rate_to_pln, Decimal("0.027000"))
+
+        pln_totals = build_portfolio_summary(self.user)["pln_totals"]
+        self.assertEqual(pln_totals["value"], Decimal("1580.00"))
+        self.assertEqual(pln_totals["cost"], Decimal("500.00"))
+        self.assertEqual(pln_totals["rates"], {"USD": Decimal("4.0")})
+        self.assertEqual(pln_totals["missing_currencies"], ["EUR"])
+
+        generation = summary_cache.generation(self.user.pk)
+        import_fx_rates_csv(StringIO(f"date,currency,rate\n{rate_date.isoformat()},EUR,4.25\n"))
+        self.assertEqual(summary_cache.generation(self.user.pk), generation + 1)
+        pln_totals = build_portfolio_summary(self.user)["pln_totals"]
+        self.assertEqual(pln_totals["value"], Decimal("3705.00"))
+        self.assertEqual(pln_totals["missing_currencies"], [])
+
+    def test_portfolio_summary_query_count_does_not_grow_with_dividends(self):
+        account = BrokerageAccount.objects.create(
+            user=self.user,
+            name="XTB PLN",
+            broker=BrokerageAccount.BROKER_XTB,
+            account_type=BrokerageAccount.STANDARD,
+            currency="PLN",
+        )
+        today = timezone.localdate()
+        for index in range(12):
+            instrument = BrokerageInstrument.objects.create(
+                user=self.user,
+                ticker=f"DIV{index}",
+                name=f"Dywidendowa {index}",
+                asset_type=BrokerageInstrument.STOCK,
+                currency="PLN",
+            )
+            for trade_date, transaction_type, quantity in (
+                (today - timedelta(days=60), BrokerageTransaction.BUY, "10"),
+                (today - timedelta(days=30), BrokerageTransaction.SELL, "4"),
+                (today + timedelta(days=5), BrokerageTransaction.BUY, "100"),
+            ):
+                BrokerageTransaction.objects.create(
+                    account=account,
+                    instrument=instrument,
+                    transaction_type=transaction_type,
+                    trade_date=trade_date,
+                    quantity=quantity,
+                    price="10.00",
+                    fees="0.00",
+                )
+            BrokerageDividend.objects.create(
+                account=account,
+                instrument=instrument,
+                ex_dividend_date=today,
+                payment_date=today + timedelta(days=10),
+                gross_amount_per_share="1.00",
+                currency="PLN",
+            )
+
+        with self.assertNumQueries(5):
+            summary = build_portfolio_summary(self.user)
+
+        self.assertEqual(len(summary["upcoming_dividends"]), 12)
+        self.assertEqual(
+            {item["quantity"] for item in summary["upcoming_dividends"]},
+            {get_quantity(account, instrument, today)},
+        )
+        self.assertEqual(summary["upcoming_dividends"][0]["quantity"], Decimal("6"))
+
+    def _ledger_snapshot(self, account, instrument):
+        lots = list(
+            OpenLot.objects.filter(account=account, instrument=instrument)
+            .values_list("buy_transaction_id", "quantity", "unit_cost")
+        )
+        gains = list(
+            RealizedGain.objects.filter(account=account, instrument=instrument)
+            .values_list("sell_transaction_id", "quantity", "cost_basis", "gain", "allocations")
+        )
+        return lots, gains
+
+    def test_ledger_replays_back_dated_edits_from_the_affected_date(self):
+        account = BrokerageAccount.objects.create(
+            user=self.user,
+            name="XTB PLN",
+            broker=BrokerageAccount.BROKER_XTB,
+            account_type=BrokerageAccount.STANDARD,
+            currency="PLN",
+        )
+        instrument = BrokerageInstrument.objects.create(
+            user=self.user,
+            ticker="KRU",
+            name="Kruk",
+            asset_type=BrokerageInstrument.STOCK,
+            currency="PLN",
+        )
+
+        def trade(transaction_type, trade_date, quantity, price):
+            return BrokerageTransaction.objects.create(
+                account=account,
+                instrument=instrument,
+                transaction_type=transaction_type,
+                trade_date=trade_date,
+                quantity=quantity,
+                price=price,
+                fees="1.00",
+            )
+
+        trade(BrokerageTransaction.BUY, date(2025, 1, 2), "10", "100.00")
+        trade(BrokerageTransaction.SELL, date(2025, 3, 1), "4", "120.00")
+        late_buy = trade(BrokerageTransaction.BUY, date(2025, 6, 2), "10", "110.00")
+        trade(BrokerageTransaction.SELL, date(2025, 9, 1), "12", "130.00")
+
+        early_gain = RealizedGain.objects.get(trade_date=date(2025, 3, 1))
+        self.assertEqual(early_gain.cost_basis, Decimal("400.4"))
+        self.assertEqual(OpenLot.objects.get().quantity, Decimal("4"))
+
+        late_buy.trade_date = date(2025, 5, 2)
+        late_buy.quantity = Decimal("6")
+        late_buy.save()
+
+        self.assertTrue(RealizedGain.objects.filter(pk=early_gain.pk).exists())
+        self.assertFalse(OpenLot.objects.exists())
+        late_gain = RealizedGain.objects.get(trade_date=date(2025, 9, 1))
+        self.assertEqual(
+            [Decimal(allocation["quantity"]) for allocation in late_gain.allocations],
+            [Decimal("6"), Decimal("6")],
+        )
+        incremental = self._ledger_snapshot(account, instrument)
+        replay_ledger(account.id, instrument.id)
+        self.assertEqual(self._ledger_snapshot(account, instrument), incremental)
+
+        late_gain.sell_transaction.delete()
+        self.assertEqual(
+            list(OpenLot.objects.values_list("quantity", flat=True)),
+            [Decimal("6"), Decimal("6")],
+        )
+        summary = build_portfolio_summary(self.user)
+        self.assertEqual(summary["positions"][0]["quantity"], Decimal("12"))
+
+        account.delete()
+        self.assertFalse(OpenLot.objects.exists())
+        self.assertFalse(RealizedGain.objects.exists())
+
+    def test_failed_account_delete_keeps_ledger_updates_for_the_position(self):
+        account = BrokerageAccount.objects.create(user=self.user, name="XTB PLN", currency="PLN")
+        instrument = BrokerageInstrument.objects.create(
+            user=self.user,
+            ticker="KRU",
+            name="Kruk",
+            asset_type=BrokerageInstrument.STOCK,
+            currency="PLN",
+        )
+        for transaction_type, quantity in ((BrokerageTransaction.BUY, "10"), (BrokerageTransaction.SELL, "4")):
+            BrokerageTransaction.objects.create(
+                account=account,
+                instrument=instrument,
+                transaction_type=transaction_type,
+                trade_date=date(2025, 1, 2),
+                quantity=quantity,
+                price="100.00",
+            )
+
+        def refuse_delete(sender, instance, **kwargs):
+            raise RuntimeError("delete refused")
+
+        pre_delete.connect(refuse_delete, sender=BrokerageAccount)
+        try:
+            with self.assertRaises(RuntimeError), db_transaction.atomic():
+                account.delete()
+        finally:
+            pre_delete.disconnect(refuse_delete, sender=BrokerageAccount)
+
+        generation = summary_cache.generation(self.user.pk)
+        BrokerageTransaction.objects.get(transaction_type=BrokerageTransaction.SELL).delete()
+
+        self.assertEqual(OpenLot.objects.get().quantity, Decimal("10"))
+        self.assertFalse(RealizedGain.objects.exists())
+        self.assertEqual(summary_cache.generation(self.user.pk), generation + 1)
+
+    def test_brokerage_history_api_sweeps_stored_closes_and_caches_per_transaction_state(self):
+        account = BrokerageAccount.objects.create(
+            user=self.user,
+            name="XTB PLN",
+            broker=BrokerageAccount.BROKER_XTB,
+            account_type=BrokerageAccount.STANDARD,
+            currency="PLN",
+        )
+        instrument = BrokerageInstrument.objects.create(
+            user=self.user, ticker="KRU", name="Kruk", exchange="XWAR", currency="PLN",
+        )
+        BrokerageTransaction.objects.create(
+            account=account,
+            instrument=instrument,
+            transaction_type=BrokerageTransaction.BUY,
+            trade_date=date(2026, 1, 5),
+            quantity="10",
+            price="100.00",
+        )
+        BrokerageTransaction.objects.create(
+            account=account,
+            instrument=instrument,
+            transaction_type=BrokerageTransaction.SELL,
+            trade_date=date(2026, 1, 8),
+            quantity="4",
+            price="111.00",
+        )
+        PriceBar.objects.create(symbol="kru.pl", date=date(2026, 1, 5), close="102.00")
+        PriceBar.objects.create(symbol="kru.pl", date=date(2026, 1, 7), close="110.00")
+
+        response = self.client.get(
+            reverse("finance:api_brokerage_history"),
+            {"start": "2026-01-04", "end": "2026-01-09"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["dates"]), 6)
+        series = response.data["series"][0]
+        self.assertEqual((series["account"], series["currency"]), ("XTB PLN", "PLN"))
+        self.assertEqual(series["value"], ["0.00", "1020.00", "1020.00", "1100.00", "666.00", "666.00"])
+        self.assertEqual(series["cost"], ["0.00", "1000.00", "1000.00", "1000.00", "600.00", "600.00"])
+
+        with self.assertNumQueries(1):
+            cached = get_portfolio_history(self.user, date(2026, 1, 4), date(2026, 1, 9))
+        self.assertEqual(cached, response.data)
+
+        BrokerageTransaction.objects.create(
+            account=account,
+            instrument=instrument,
+            transaction_type=BrokerageTransaction.BUY,
+            trade_date=date(2026, 1, 9),
+            quantity="1",
+            price="110.00",
+        )
+        refreshed = get_portfolio_history(self.user, date(2026, 1, 4), date(2026, 1, 9))
+        self.assertEqual(refreshed["series"][0]["value"][-1], "770.00")
+
+        with patch("finance.market_data._read_csv_url", return_value=[
+            {"Date": "2026-01-09", "Open": "110", "High": "121", "Low": "109", "Close": "120.00", "Volume": "800"},
+        ]):
+            StooqClient().backfill_daily_bars("kru.pl", date(2026, 1, 9), until=date(2026, 1, 9))
+        refreshed = get_portfolio_history(self.user, date(2026, 1, 4), date(2026, 1, 9))
+        self.assertEqual(refreshed["series"][0]["value"][-1], "840.00")
+
+        response = self.client.get(
+            reverse("finance:api_brokerage_history"),
+            {"start": "2026-01-09", "end": "2026-01-04"},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_portfolio_summary_is_cached_until_a_brokerage_write_bumps_the_generation(self):
+        account = BrokerageAccount.objects.create(
+            user=self.user,
+            name="XTB PLN",
+            broker=BrokerageAccount.BROKER_XTB,
+            account_type=BrokerageAccount.STANDARD,
+            currency="PLN",
+        )
+        instrument = BrokerageInstrument.objects.create(
+            user=self.user, ticker="KRU", name="Kruk", exchange="XWAR", currency="PLN", last_price="120.00",
+        )
+        transaction = BrokerageTransaction.objects.create(
+            account=account,
+            instrument=instrument,
+            transaction_type=BrokerageTransaction.BUY,
+            trade_date=date(2026, 1, 5),
+            quantity="10",
+            price="100.00",
+        )
+
+        response = self.client.get(reverse("finance:brokerage"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["currency_totals"][0]["value"], Decimal("1200.00"))
+        with self.assertNumQueries(1):
+            summary_cache.get(self.user)
+        self.assertEqual(summary_cache.stats()["hits"], 1)
+        self.assertEqual(summary_cache.stats()["misses"], 1)
+        self.assertEqual(summary_cache.stats()["hit_ratio"], 0.5)
+
+        instrument.last_price = Decimal("130.00")
+        instrument.save()
+        self.assertEqual(summary_cache.get(self.user)["currency_totals"][0]["value"], Decimal("1300.00"))
+
+        transaction.quantity = Decimal("5")
+        transaction.save()
+        self.assertEqual(summary_cache.get(self.user)["currency_totals"][0]["value"], Decimal("650.00"))
+
+        generation = summary_cache.generation(self.user.pk)
+        BrokerageDividend.objects.create(
+            account=account,
+            instrument=instrument,
+            ex_dividend_date=date(2026, 6, 1),
+            payment_date=date(2026, 6, 10),
+            gross_amount_per_share="5.00",
+            currency="PLN",
+        )
+        self.assertEqual(summary_cache.generation(self.user.pk), generation + 1)
+        self.assertEqual(summary_cache.stats()["misses"], 3)
+
+        self.user.is_staff = True
+        self.user.save()
+        stats = self.client.get(reverse("finance:brokerage_cache_stats")).json()
+        self.assertEqual(stats["portfolio_summary"]["hits"], 1)
+        self.assertIn("hit_ratio", stats["quote_cache"])
+
+        self.user.delete()
+        self.assertFalse(BrokerageTransaction.objects.exists())
+
+    def test_mbank_statement_upload_bulk_imports_trades_and_skips_duplicates(self):
+        account = BrokerageAccount.objects.create(
+            user=self.user,
+            name="mBank IKE",
+            broker=BrokerageAccount.BROKER_MBANK,
+            account_type=BrokerageAccount.IKE,
+            currency="PLN",
+        )
+        kruk = BrokerageInstrument.objects.create(user=self.user, ticker="KRU", name="Kruk", currency="PLN")
+        BrokerageTransaction.objects.create(
+            account=account,
+            instrument=kruk,
+            transaction_type=BrokerageTransaction.BUY,
+            trade_date=date(2026, 2, 2),
+            trade_time=time(10, 30),
+            quantity="10",
+            price="400.00",
+        )
+        statement = (
+            "mBank S.A. eMakler;Historia transakcji\n"
+            "Rachunek;IKE 12345\n"
+            "\n"
+            "Czas transakcji;Walor;Giełda;K/S;Liczba;Kurs;Waluta;Prowizja;Waluta prowizji;Wartość;Waluta\n"
+            "02.02.2026 10:30:41;KRUK;WWA-GPW;K;10;400,00;PLN;15,20;PLN;4 000,00;PLN\n"
+            "03.02.2026 09:01:02;KRUK;WWA-GPW;K;5;410,00;PLN;7,79;PLN;2 050,00;PLN\n"
+            "04.02.2026 15:12:00;ORLENPKN;WWA-GPW;K;20;60,50;PLN;4,60;PLN;1 210,00;PLN\n"
+            "05.02.2026 11:00:00;KRUK;WWA-GPW;S;12;450,00;PLN;20,52;PLN;5 400,00;PLN\n"
+            "06.02.2026 11:00:00;KRUK;WWA-GPW;X;1;450,00;PLN;0;PLN;450,00;PLN\n"
+        ).encode("cp1250")
+        generation = summary_cache.generation(self.user.pk)
+
+        response = self.client.post(reverse("finance:import_brokerage_statement"), {
+            "account": str(account.id),
+            "statement": SimpleUploadedFile("historia.csv", statement, content_type="text/csv"),
+        }, follow=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Zaimportowano transakcje: 3. Pominięte duplikaty: 1. Nowe instrumenty: 1.")
+        self.assertContains(response, "Nie udało się odczytać 1 wierszy (wiersze: 9).")
+        self.assertEqual(BrokerageTransaction.objects.filter(account=account).count(), 4)
+        orlen = BrokerageInstrument.objects.get(user=self.user, ticker="ORLENPKN")
+        self.assertEqual((orlen.exchange, orlen.currency), ("GPW", "PLN"))
+        sell = BrokerageTransaction.objects.get(account=account, transaction_type=BrokerageTransaction.SELL)
+        self.assertEqual((sell.instrument, sell.fees, sell.trade_time), (kruk, Decimal("20.52"), time(11, 0)))
+        self.assertEqual(sell.realized_gain.cost_basis, Decimal("4000") + 2 * Decimal("410") + 2 * Decimal("7.79") / 5)
+        self.assertEqual(OpenLot.objects.get(account=account, instrument=kruk).quantity, Decimal("3"))
+        self.assertGreater(summary_cache.generation(self.user.pk), generation)
+
+        result = import_statement(account, BytesIO(statement))
+        self.assertEqual((result["created"], result["duplicates"], result["skipped"]), (0, 4, 1))
+
+    def test_xtb_statement_command_imports_thousands_of_trades_in_chunks(self):
+        account = BrokerageAccount.objects.create(
+            user=self.user,
+            name="XTB PLN",
+            broker=BrokerageAccount.BROKER_XTB,
+            account_type=BrokerageAccount.STANDARD,
+            currency="PLN",
+        )
+        lines = ["ID;Type;Time;Comment;Symbol;Amount"]
+        start = date(2020, 1, 2)
+        for index in range(1200):
+            day = start + timedelta(days=index)
+            lines.append(f"{index + 1};Stock purchase;{day:%d.%m.%Y} 10:00:00;OPEN BUY 2 @ 10.50;KRU.PL;-21.00")
+            lines.append(f"{index + 10001};Deposit;{day:%d.%m.%Y} 09:00:00;Wpłata;;100.00")
+        lines.append("99999;Stock sale;01.01.2024 12:00:00;CLOSE BUY 2/4 @ 12.00;AAPL.US;24.00")
+
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / "xtb.csv"
+            path.write_text("\n".join(lines), encoding="utf-8")
+            out = StringIO()
+            call_command("import_brokerage_statement", str(path), account=account.id, stdout=out)
+
+            self.assertIn("Wiersze: 1201, dodane: 1201, duplikaty: 0, pominięte: 0, nowe instrumenty: 2", out.getvalue())
+            kruk = BrokerageInstrument.objects.get(user=self.user, ticker="KRU")
+            self.assertEqual((kruk.exchange, kruk.currency), ("GPW", "PLN"))
+            self.assertEqual(BrokerageInstrument.objects.get(user=self.user, ticker="AAPL").currency, "USD")
+            self.assertEqual(
+                OpenLot.objects.filter(account=account, instrument=kruk).aggregate(total=Sum("quantity"))["total"],
+                Decimal("2400"),
+            )
+
+            mbank_account = BrokerageAccount.objects.create(
+                user=self.user,
+                name="mBank",
+                broker=BrokerageAccount.BROKER_MBANK,
+                account_type=BrokerageAccount.STANDARD,
+                currency="PLN",
+            )
+            with self.assertRaisesMessage(CommandError, "Plik wygląda na wyciąg z XTB"):
+                call_command("import_brokerage_statement", str(path), account=mbank_account.id, stdout=StringIO())
+
+    def _xlsx_statement(self, *sheets):
+        workbook = Workbook()
+        workbook.remove(workbook.active)
+        for title, rows in sheets:
+            sheet = workbook.create_sheet(title)
+            for row in rows:
+                sheet.append(row)
+        output = BytesIO()
+        workbook.save(output)
+        output.seek(0)
+        return output
+
+    def test_xtb_xlsx_statement_imports_trades_from_the_cash_operations_sheet(self):
+        account = BrokerageAccount.objects.create(
+            user=self.user,
+            name="XTB PLN",
+            broker=BrokerageAccount.BROKER_XTB,
+            account_type=BrokerageAccount.STANDARD,
+            currency="PLN",
+        )
+        statement = self._xlsx_statement(
+            ("Open positions", [["Position", "Symbol", "Volume"], [1, "KRU.PL", 2]]),
+            ("Cash operations", [
+                ["Cash operations"],
+                [],
+                ["ID", "Type", "Time", "Comment", "Symbol", "Amount"],
+                [1, "Stock purchase", datetime(2026, 2, 2, 10, 0, 5), "OPEN BUY 4 @ 400.00", "KRU.PL", -1600],
+                [2, "Deposit", datetime(2026, 2, 1, 9, 0), "Wpłata", None, 5000],
+                [3, "Stock sale", "05.02.2026 11:30:00", "CLOSE BUY 1/4 @ 450.00", "KRU.PL", 450],
+                [4, "Stock purchase", datetime(2026, 2, 6, 12, 0), "OPEN BUY 3 @ 190.50", "AAPL.US", -571.5],
+            ]),
+        )
+
+        result = import_statement(account, statement)
+
+        self.assertEqual((result["rows"], result["created"], result["skipped"]), (3, 3, 0))
+        kruk = BrokerageInstrument.objects.get(user=self.user, ticker="KRU")
+        buy = BrokerageTransaction.objects.get(instrument=kruk, transaction_type=BrokerageTransaction.BUY)
+        self.assertEqual((buy.trade_date, buy.trade_time, buy.quantity, buy.price), (date(2026, 2, 2), time(10, 0, 5), Decimal("4"), Decimal("400")))
+        self.assertEqual(OpenLot.objects.get(account=account, instrument=kruk).quantity, Decimal("3"))
+        self.assertEqual(BrokerageInstrument.objects.get(user=self.user, ticker="AAPL").currency, "USD")
+
+    def test_mbank_xlsx_statement_reads_numeric_and_date_cells(self):
+        account = BrokerageAccount.objects.create(
+            user=self.user,
+            name="mBank IKE",
+            broker=BrokerageAccount.BROKER_MBANK,
+            account_type=BrokerageAccount.IKE,
+            currency="PLN",
+        )
+        header = ["Czas transakcji", "Walor", "Giełda", "K/S", "Liczba", "Kurs", "Waluta", "Prowizja", "Waluta prowizji", "Wartość", "Waluta"]
+        statement = self._xlsx_statement(("Historia transakcji", [
+            ["mBank S.A. eMakler", "Historia transakcji"],
+            ["Rachunek", "IKE 12345"],
+            [],
+            header,
+            [datetime(2026, 2, 2, 10, 30, 41), "KRUK", "WWA-GPW", "K", 10, 400, "PLN", 15.2, "PLN", 4000, "PLN"],
+            [datetime(2026, 2, 5, 11, 0), "KRUK", "WWA-GPW", "S", 4, 450.5, "PLN", None, "PLN", 1802, "PLN"],
+            [datetime(2026, 2, 6, 11, 0), "KRUK", "WWA-GPW", "X", 1, 450, "PLN", 0, "PLN", 450, "PLN"],
+        ]))
+
+        result = import_statement(account, statement)
+
+        self.assertEqual((result["created"], result["skipped"], result["skipped_lines"]), (2, 1, [7]))
+        buy, sell = BrokerageTransaction.objects.filter(account=account).order_by("trade_date")
+        self.assertEqual((buy.quantity, buy.price, buy.fees, buy.trade_time), (Decimal("10"), Decimal("400"), Decimal("15.20"), time(10, 30, 41)))
+        self.assertEqual((sell.transaction_type, sell.price, sell.fees), (BrokerageTransaction.SELL, Decimal("450.5"), Decimal("0")))
+        self.assertEqual(buy.instrument.exchange, "GPW")
+
+        statement.seek(0)
+        self.assertEqual(import_statement(account, statement)["duplicates"], 2)
+
     def test_brokerage_transaction_form_filters_accounts_by_user(self):
         other_user = User.objects.create_user(username="u2", password="pass123")
         other_account = BrokerageAccount.objects.create(
@@ -718,7 +2087,6 @@ class FinanceCoreTests(TestCase):
             "quantity": "3",
             "price": "412.50",
             "fees": "5.00",
-            "fx_rate_to_pln": "1.000000",
             "notes": "",
         }, follow=True)
 
@@ -730,7 +2098,7 @@ class FinanceCoreTests(TestCase):
         self.assertEqual(transaction.trade_time, time(10, 30))
         self.assertEqual(transaction.price, Decimal("412.5000"))
 
-    @patch("finance.forms.fetch_transaction_market_price")
+    @patch("finance.forms.cached_transaction_market_price")
     def test_brokerage_transaction_fetches_market_price_before_save(self, mock_fetch_price):
         mock_fetch_price.return_value = {
             "price": Decimal("410.2500"),
@@ -760,7 +2128,6 @@ class FinanceCoreTests(TestCase):
             "quantity": "3",
             "price": "",
             "fees": "5.00",
-            "fx_rate_to_pln": "1.000000",
             "notes": "",
         })
 
@@ -780,7 +2147,6 @@ class FinanceCoreTests(TestCase):
             "quantity": "3",
             "price": "411.00",
             "fees": "5.00",
-            "fx_rate_to_pln": "1.000000",
             "notes": "",
             "market_price_confirmed": "on",
             "market_price_value": "410.2500",
@@ -796,6 +2162,79 @@ class FinanceCoreTests(TestCase):
         self.assertEqual(transaction.market_price, Decimal("410.2500"))
         self.assertEqual(transaction.market_price_source, "Test market")
 
+    @patch("finance.market_data.OpenFigiClient.search_many", side_effect=AssertionError("network"))
+    @patch("finance.market_data._read_csv_url", side_effect=AssertionError("network"))
+    def test_brokerage_transaction_submit_reads_cached_prices_without_network(self, *network):
+        resolution_cache.clear()
+        InstrumentResolution.objects.create(
+            isin="PLKRK0000010",
+            currency="PLN",
+            symbol="KRU",
+            name="KRUK SA",
+            resolved_exchange="WSE",
+            resolved_at=timezone.now(),
+        )
+        PriceBar.objects.create(symbol="kru.pl", date=date(2026, 5, 8), close="405.00")
+        account = BrokerageAccount.objects.create(
+            user=self.user,
+            name="XTB PLN",
+            broker=BrokerageAccount.BROKER_XTB,
+            account_type=BrokerageAccount.STANDARD,
+            currency="PLN",
+        )
+        data = {
+            "account": str(account.id),
+            "transaction_type": BrokerageTransaction.BUY,
+            "instrument_name": "Kruk",
+            "isin": "PLKRK0000010",
+            "asset_type": BrokerageInstrument.STOCK,
+            "currency": "PLN",
+            "trade_date": "2026-05-11",
+            "trade_time": "10:30",
+            "quantity": "3",
+            "price": "",
+            "fees": "5.00",
+            "notes": "",
+        }
+
+        response = self.client.post(reverse("finance:add_brokerage_transaction"), data)
+        self.assertContains(response, "Pobrano cenę 405.0000 z Stooq dzienne zamknięcie.")
+
+        response = self.client.post(reverse("finance:add_brokerage_transaction"), {**data, "isin": "US0378331005"})
+        self.assertContains(response, "Cena rynkowa nie jest jeszcze pobrana.")
+
+        response = self.client.post(reverse("finance:add_brokerage_transaction"), {
+            **data,
+            "isin": "US0378331005",
+            "market_price_value": "190.1200",
+            "market_price_source_value": "Alpha Vantage",
+            "market_symbol_value": "AAPL",
+        })
+        self.assertContains(response, "Pobrano cenę 190.1200 z Alpha Vantage.")
+        self.assertFalse(BrokerageTransaction.objects.exists())
+
+    @patch("finance.views.fetch_transaction_market_price")
+    def test_brokerage_market_price_endpoint_prefetches_for_the_form(self, mock_fetch_price):
+        resolution_cache.clear()
+        mock_fetch_price.return_value = {
+            "price": Decimal("410.2500"),
+            "source": "Stooq dzienne zamknięcie",
+            "symbol": "KRU",
+            "name": "KRUK SA",
+        }
+
+        response = self.client.get(
+            reverse("finance:brokerage_market_price"),
+            {"isin": "plkrk0000010", "trade_date": "11.05.2026", "currency": "PLN"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["price"], "410.2500")
+        mock_fetch_price.assert_called_once_with("PLKRK0000010", date(2026, 5, 11), None, "", "PLN")
+
+        response = self.client.get(reverse("finance:brokerage_market_price"), {"isin": "PLKRK", "trade_date": "2026-05-11"})
+        self.assertEqual(response.status_code, 400)
+
     def test_brokerage_transaction_can_be_edited_and_deleted(self):
         account = BrokerageAccount.objects.create(
             user=self.user,
@@ -835,7 +2274,6 @@ class FinanceCoreTests(TestCase):
             "quantity": "3",
             "price": "482.00",
             "fees": "1.00",
-            "fx_rate_to_pln": "1.000000",
             "notes": "korekta",
         }, follow=True)
 
@@ -27,6 +27,8 @@ urlpatterns = [
     # Brokerage portfolio
     path('brokerage/', views.BrokeragePortfolioView.as_view(), name='brokerage'),
     path('brokerage/refresh/', views.RefreshBrokerageMarketDataView.as_view(), name='brokerage_refresh'),
+    path('brokerage/refresh/status/', views.BrokerageRefreshStatusView.as_view(), name='brokerage_refresh_status'),
+    path('brokerage/cache-stats/', views.BrokerageCacheStatsView.as_view(), name='brokerage_cache_stats'),
     path('brokerage/accounts/add/', views.AddBrokerageAccountView.as_view(), name='add_brokerage_account'),
     path('brokerage/accounts/<int:account_id>/edit/', views.EditBrokerageAccountView.as_view(), name='edit_brokerage_account'),
     path('brokerage/accounts/<int:account_id>/delete/', views.DeleteBrokerageAccountView.as_view(), name='delete_brokerage_account'),
@@ -34,6 +36,8 @@ urlpatterns = [
     path('brokerage/instruments/<int:instrument_id>/edit/', views.EditBrokerageInstrumentView.as_view(), name='edit_brokerage_instrument'),
     path('brokerage/instruments/<int:instrument_id>/delete/', views.DeleteBrokerageInstrumentView.as_view(), name='delete_brokerage_instrument'),
     path('brokerage/transactions/add/', views.AddBrokerageTransactionView.as_view(), name='add_brokerage_transaction'),
+    path('brokerage/transactions/market-price/', views.BrokerageMarketPriceView.as_view(), name='brokerage_market_price'),
+    path('brokerage/transactions/import/', views.ImportBrokerageStatementView.as_view(), name='import_brokerage_statement'),
     path('brokerage/transactions/<int:transaction_id>/edit/', views.EditBrokerageTransactionView.as_view(), name='edit_brokerage_transaction'),
     path('brokerage/transactions/<int:transaction_id>/delete/', views.DeleteBrokerageTransactionView.as_view(), name='delete_brokerage_transaction'),
     path('brokerage/dividends/add/', views.AddBrokerageDividendView.as_view(), name='add_brokerage_dividend'),
@@ -49,4 +53,5 @@ urlpatterns = [
     # API
     path('api/daily/', views.DailyRecordAPI.as_view(), name='api_daily'),
     path('api/monthly/', views.MonthlyRecordAPI.as_view(), name='api_monthly'),
+    path('api/brokerage/history/', views.BrokerageHistoryAPI.as_view(), name='api_brokerage_history'),
 ]
@@ -1,11 +1,14 @@
 import calendar
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.db import transaction
-from django.db.models import Sum
+from django.db.models import Q, Sum
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.utils import timezone
@@ -19,24 +22,26 @@ from rest_framework.views import APIView
 from utils.tools import month_start, parse_date_input, parse_decimal
 
 from .account_utils import (
+    CENT,
     TRANSFER_INCOME_SOURCE,
     TRANSFER_TO_SHARED_CATEGORY,
     get_active_finance_account,
     get_available_shared_accounts,
     get_or_create_monthly_record,
-    recalculate_monthly_record,
     set_active_finance_account,
     sync_shared_account_transfer,
 )
-from .brokerage import build_portfolio_summary
 from .forms import (
     BrokerageAccountForm,
     BrokerageDividendForm,
     BrokerageInstrumentForm,
+    BrokerageStatementImportForm,
     BrokerageTransactionForm,
     TravelDestinationForm,
 )
-from .market_data import MarketDataError, refresh_market_data_for_user
+from .http_pool import get_http_session_stats
+from .market_cache import get_quote_store_stats, get_resolution_cache_stats
+from .market_data import MarketDataError, cached_transaction_market_price, fetch_transaction_market_price
 from .models import (
     BrokerageAccount,
     BrokerageDividend,
@@ -45,9 +50,24 @@ from .models import (
     Daily,
     FinanceAccount,
     Income,
+    MarketDataRefreshJob,
     Monthly,
+    MonthlyCategoryTotal,
     TravelDestinations,
 )
+from .portfolio_history import DEFAULT_HISTORY_DAYS, DEFAULT_HISTORY_MAX_DAYS, get_portfolio_history
+from .refresh_jobs import enqueue_market_data_refresh, refresh_job_messages, serialize_refresh_job
+from .reporting import (
+    DEFAULT_REPORT_MAX_MONTHS,
+    DEFAULT_REPORT_MONTHS,
+    INVESTMENT_CATEGORY,
+    REPORT_MONTH_CHOICES,
+    account_category_totals,
+    build_dashboard_totals,
+    monthly_report,
+)
+from .statement_import import StatementImportError, import_statement
+from .summary_cache import get_summary_cache_stats, summary_cache
 
 CATEGORIES_EXPENSES = sorted([
     'Zakupy spozywcze', 'Jedzenie na miescie', 'Transport miejski',
@@ -68,25 +88,16 @@ INCOME_SOURCES = sorted([
 COST_OF_LIVING_CATEGORIES = [
     'Zakupy spozywcze', 'Paliwo', 'Rachunki', 'Zdrowie'
 ]
-INVESTMENT_CATEGORY = 'Inwestycje'
 
 
 def get_available_expense_categories(account):
-    dynamic_categories = Daily.objects.filter(account=account).values_list('category', flat=True).distinct()
+    dynamic_categories = MonthlyCategoryTotal.objects.filter(account=account).values_list('category', flat=True).distinct()
     categories = set(CATEGORIES_EXPENSES)
     if account.account_type != FinanceAccount.PERSONAL:
         categories.discard(TRANSFER_TO_SHARED_CATEGORY)
     return sorted(categories.union(dynamic_categories))
 
 
-def get_investment_queryset(queryset):
-    return queryset.filter(category=INVESTMENT_CATEGORY)
-
-
-def get_non_investment_queryset(queryset):
-    return queryset.exclude(category=INVESTMENT_CATEGORY)
-
-
 def get_selected_transfer_target(request, active_account, category):
     if active_account.account_type != FinanceAccount.PERSONAL or category != TRANSFER_TO_SHARED_CATEGORY:
         return None
@@ -135,7 +146,7 @@ def switch_account(request):
 @method_decorator(login_required, name='dispatch')
 class BrokeragePortfolioView(View):
     def get(self, request):
-        summary = build_portfolio_summary(request.user)
+        summary = dict(summary_cache.get(request.user))
         summary.update({
             'brokerage_accounts': BrokerageAccount.objects.filter(user=request.user),
             'brokerage_instruments': BrokerageInstrument.objects.filter(user=request.user).order_by('name', 'ticker'),
@@ -152,38 +163,41 @@ class BrokeragePortfolioView(View):
                 .order_by('-payment_date', 'instrument__ticker')[:25]
             ),
         })
+        refresh_job = MarketDataRefreshJob.objects.filter(user=request.user).order_by('-created_at').first()
+        summary['refresh_job'] = refresh_job
+        summary['refresh_job_messages'] = refresh_job_messages(refresh_job) if refresh_job else []
         return render(request, 'finance/brokerage.html', summary)
 
 
 @method_decorator(login_required, name='dispatch')
 class RefreshBrokerageMarketDataView(View):
     def post(self, request):
-        try:
-            result = refresh_market_data_for_user(request.user)
-        except MarketDataError as exc:
-            messages.warning(request, f'Nie udało się odświeżyć danych rynkowych: {exc}')
+        job = enqueue_market_data_refresh(request.user)
+        if job.status == MarketDataRefreshJob.RUNNING:
+            messages.info(request, 'Odświeżanie danych rynkowych już trwa.')
         else:
-            failed_count = len(result.get('failed_quotes', []))
-            if failed_count:
-                messages.warning(
-                    request,
-                    f"Nie odświeżono {failed_count} instrumentów: {'; '.join(result['failed_quotes'][:3])}",
-                )
-            failed_dividends_count = len(result.get('failed_dividends', []))
-            if failed_dividends_count:
-                messages.warning(
-                    request,
-                    f"Nie odświeżono dywidend dla {failed_dividends_count} instrumentów: {'; '.join(result['failed_dividends'][:3])}",
-                )
-            messages.success(
-                request,
-                f"Odświeżono ceny: {result['updated_quotes']}, "
-                f"scalone instrumenty: {result.get('merged_instruments', 0)}, "
-                f"nowe dywidendy: {result['updated_dividends']} ({result['source']}).",
-            )
+            messages.info(request, 'Odświeżanie danych rynkowych zostało dodane do kolejki.')
         return redirect('finance:brokerage')
 
 
+@method_decorator(login_required, name='dispatch')
+class BrokerageRefreshStatusView(View):
+    def get(self, request):
+        job = MarketDataRefreshJob.objects.filter(user=request.user).order_by('-created_at').first()
+        return JsonResponse(serialize_refresh_job(job))
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class BrokerageCacheStatsView(View):
+    def get(self, request):
+        return JsonResponse({
+            'portfolio_summary': get_summary_cache_stats(),
+            'quote_cache': get_quote_store_stats(),
+            'resolution_cache': get_resolution_cache_stats(),
+            'http_session': get_http_session_stats(),
+        })
+
+
 @method_decorator(login_required, name='dispatch')
 class AddBrokerageAccountView(View):
     def get(self, request):
@@ -332,6 +346,63 @@ class AddBrokerageTransactionView(View):
         return render(request, 'finance/brokerage_form.html', {'form': form, 'title': 'Dodaj transakcję'})
 
 
+@method_decorator(login_required, name='dispatch')
+class BrokerageMarketPriceView(View):
+    """Fetches the market price for the transaction form in the background, warming the caches its submit reads."""
+
+    def get(self, request):
+        isin = request.GET.get('isin', '').strip().upper()
+        currency = request.GET.get('currency', '').strip().upper()
+        try:
+            trade_date = parse_date_input(request.GET.get('trade_date', ''))
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Nieprawidłowa data transakcji.'}, status=400)
+        if len(isin) != 12:
+            return JsonResponse({'status': 'error', 'message': 'ISIN musi mieć 12 znaków.'}, status=400)
+
+        try:
+            market_data = cached_transaction_market_price(isin, trade_date, '', currency)
+            if market_data is None:
+                market_data = fetch_transaction_market_price(isin, trade_date, None, '', currency)
+        except MarketDataError as exc:
+            return JsonResponse({'status': 'error', 'message': str(exc)}, status=502)
+        return JsonResponse({
+            'status': 'ok',
+            'price': str(market_data['price']),
+            'source': market_data['source'],
+            'symbol': market_data.get('symbol', ''),
+            'name': market_data.get('name', ''),
+        })
+
+
+@method_decorator(login_required, name='dispatch')
+class ImportBrokerageStatementView(View):
+    def get(self, request):
+        return render(request, 'finance/brokerage_form.html', {
+            'form': BrokerageStatementImportForm(user=request.user),
+            'title': 'Importuj wyciąg',
+        })
+
+    def post(self, request):
+        form = BrokerageStatementImportForm(request.POST, request.FILES, user=request.user)
+        if form.is_valid():
+            try:
+                result = import_statement(form.cleaned_data['account'], form.cleaned_data['statement'].file)
+            except StatementImportError as exc:
+                form.add_error('statement', str(exc))
+            else:
+                messages.success(
+                    request,
+                    f"Zaimportowano transakcje: {result['created']}. Pominięte duplikaty: {result['duplicates']}. "
+                    f"Nowe instrumenty: {result['instruments_created']}.",
+                )
+                if result['skipped']:
+                    lines = ', '.join(map(str, result['skipped_lines'][:20]))
+                    messages.warning(request, f"Nie udało się odczytać {result['skipped']} wierszy (wiersze: {lines}).")
+                return redirect('finance:brokerage')
+        return render(request, 'finance/brokerage_form.html', {'form': form, 'title': 'Importuj wyciąg'})
+
+
 @method_decorator(login_required, name='dispatch')
 class EditBrokerageTransactionView(View):
     def get(self, request, transaction_id):
@@ -449,55 +520,6 @@ class DashboardView(View):
             days_passed = 0
 
         days_in_month = list(range(1, days_in_month_count + 1))
-        daily_expenses_data = [0.0] * days_in_month_count
-        daily_investments_data = [0.0] * days_in_month_count
-        daily_incomes_data = [0.0] * days_in_month_count
-
-        regular_daily_cost = (
-            Daily.objects
-            .filter(account=active_account, month=monthly_record)
-            .exclude(category=INVESTMENT_CATEGORY)
-            .values('date')
-            .annotate(cost=Sum('cost'))
-            .order_by('-date')
-        )
-        investment_daily_cost = (
-            Daily.objects
-            .filter(account=active_account, month=monthly_record, category=INVESTMENT_CATEGORY)
-            .values('date')
-            .annotate(cost=Sum('cost'))
-            .order_by('-date')
-        )
-        daily_incomes = (
-            Income.objects
-            .filter(account=active_account, month=monthly_record)
-            .values('date')
-            .annotate(income=Sum('amount'))
-            .order_by('-date')
-        )
-
-        for record in regular_daily_cost:
-            daily_expenses_data[record['date'].day - 1] = float(record['cost'] or 0.0)
-        for record in investment_daily_cost:
-            daily_investments_data[record['date'].day - 1] = float(record['cost'] or 0.0)
-        for record in daily_incomes:
-            daily_incomes_data[record['date'].day - 1] = float(record['income'] or 0.0)
-
-        investment_total = (
-            Daily.objects.filter(account=active_account, month=monthly_record, category=INVESTMENT_CATEGORY)
-            .aggregate(Sum('cost'))['cost__sum'] or 0
-        )
-        spending_total = monthly_record.total_expense - investment_total
-
-        expenses_by_category = (
-            Daily.objects.filter(account=active_account, month=monthly_record)
-            .exclude(category=INVESTMENT_CATEGORY)
-            .values('category')
-            .annotate(total=Sum('cost'))
-            .order_by('-total')
-        )
-        categories = [item['category'] for item in expenses_by_category]
-        amounts = [float(item['total']) for item in expenses_by_category]
         available_expense_categories = get_available_expense_categories(active_account)
 
         requested_cost_categories = request.GET.getlist('cost_category')
@@ -510,25 +532,11 @@ class DashboardView(View):
                 category for category in COST_OF_LIVING_CATEGORIES if category in available_expense_categories
             ]
 
-        income_by_source = (
-            Income.objects.filter(account=active_account, month=monthly_record)
-            .values('source')
-            .annotate(total=Sum('amount'))
-            .order_by('-total')
-        )
-        income_sources = [item['source'] for item in income_by_source]
-        income_amounts = [float(item['total']) for item in income_by_source]
+        totals = build_dashboard_totals(active_account, monthly_record, days_in_month_count, selected_cost_categories)
+        daily_expenses_data = totals['daily_expenses_data']
+        investment_total = totals['investment_total']
+        spending_total = monthly_record.total_expense - investment_total
         balance = monthly_record.total_income - monthly_record.total_expense
-        recent_incomes = Income.objects.filter(account=active_account, month=monthly_record).order_by('-date')[:5]
-        recent_expenses = Daily.objects.filter(
-            account=active_account,
-            month=monthly_record,
-        ).exclude(category=INVESTMENT_CATEGORY).order_by('-date')[:5]
-        recent_investments = Daily.objects.filter(
-            account=active_account,
-            month=monthly_record,
-            category=INVESTMENT_CATEGORY,
-        ).order_by('-date')[:5]
 
         savings_rate = 0
         if monthly_record.total_income > 0:
@@ -545,15 +553,6 @@ class DashboardView(View):
             if normal_days:
                 adjusted_daily_avg = sum(normal_days) / len(normal_days)
 
-        if selected_cost_categories:
-            selected_category_total = Daily.objects.filter(
-                account=active_account,
-                month=monthly_record,
-                category__in=selected_cost_categories,
-            ).aggregate(Sum('cost'))['cost__sum'] or 0
-        else:
-            selected_category_total = 0
-
         projected_expense = float(spending_total) + (adjusted_daily_avg * (days_in_month_count - days_passed))
 
         context = {
@@ -563,23 +562,12 @@ class DashboardView(View):
             'total_income': monthly_record.total_income,
             'total_expense': monthly_record.total_expense,
             'spending_total': spending_total,
-            'investment_total': investment_total,
             'balance': balance,
-            'categories': categories,
-            'amounts': amounts,
-            'income_sources': income_sources,
-            'income_amounts': income_amounts,
-            'recent_expenses': recent_expenses,
-            'recent_investments': recent_investments,
-            'recent_incomes': recent_incomes,
+            **totals,
             'days_in_month': days_in_month,
-            'daily_expenses_data': daily_expenses_data,
-            'daily_investments_data': daily_investments_data,
-            'daily_incomes_data': daily_incomes_data,
             'savings_rate': savings_rate,
             'daily_average': adjusted_daily_avg,
             'projected_expense': projected_expense,
-            'selected_category_total': selected_category_total,
             'available_expense_categories': available_expense_categories,
             'selected_cost_categories': selected_cost_categories,
         }
@@ -597,6 +585,7 @@ class ExpenseListView(View):
         specific_date = None
 
         records = Daily.objects.filter(account=active_account).select_related('month', 'transfer_target_account')
+        rollup = MonthlyCategoryTotal.objects.filter(account=active_account)
 
         if month_filter:
             try:
@@ -608,6 +597,7 @@ class ExpenseListView(View):
                 ).first()
                 if month_obj:
                     records = records.filter(month=month_obj)
+                    rollup = rollup.filter(month=month_obj)
             except ValueError:
                 pass
 
@@ -618,25 +608,35 @@ class ExpenseListView(View):
             except ValueError:
                 pass
 
+        # The same category conditions select the listed rows and sum the totals.
+        regular_filter = ~Q(category=INVESTMENT_CATEGORY)
+        investment_filter = Q(category=INVESTMENT_CATEGORY)
         if category_filter == 'Koszty zycia':
-            regular_expenses = records.filter(category__in=COST_OF_LIVING_CATEGORIES).exclude(category=INVESTMENT_CATEGORY)
-            investments = records.none()
+            regular_filter &= Q(category__in=COST_OF_LIVING_CATEGORIES)
+            investment_filter = None
         elif category_filter == INVESTMENT_CATEGORY:
-            regular_expenses = records.none()
-            investments = get_investment_queryset(records)
+            regular_filter = None
         elif category_filter:
-            regular_expenses = records.filter(category=category_filter).exclude(category=INVESTMENT_CATEGORY)
-            investments = records.none()
-        else:
-            regular_expenses = get_non_investment_queryset(records)
-            investments = get_investment_queryset(records)
+            regular_filter &= Q(category=category_filter)
+            investment_filter = None
 
+        regular_expenses = records.filter(regular_filter) if regular_filter is not None else records.none()
+        investments = records.filter(investment_filter) if investment_filter is not None else records.none()
         regular_expenses = regular_expenses.order_by('-date', 'title')
         investments = investments.order_by('-date', 'title')
-        total_filtered = regular_expenses.aggregate(Sum('cost'))['cost__sum'] or 0
-        investment_total_filtered = investments.aggregate(Sum('cost'))['cost__sum'] or 0
+
+        # Without a day filter the totals come from the per-month category rollup instead of the expenses.
+        totals_source, amount_field = (records, 'cost') if specific_date else (rollup, 'total')
+        sums = {
+            name: Sum(amount_field, filter=condition)
+            for name, condition in (('regular', regular_filter), ('investment', investment_filter))
+            if condition is not None
+        }
+        totals = totals_source.aggregate(**sums)
+        total_filtered = totals.get('regular') or 0
+        investment_total_filtered = totals.get('investment') or 0
         categories = list(
-            Daily.objects.filter(account=active_account).order_by('category').values_list('category', flat=True).distinct()
+            MonthlyCategoryTotal.objects.filter(account=active_account).order_by('category').values_list('category', flat=True).distinct()
         )
         if 'Koszty zycia' not in categories:
             categories.append('Koszty zycia')
@@ -679,7 +679,7 @@ class AddExpenseView(View):
             title = request.POST.get('title')
             category = request.POST.get('category')
             store = request.POST.get('store', '')
-            cost = parse_decimal(request.POST.get('cost'))
+            cost = parse_decimal(request.POST.get('cost')).quantize(CENT)
             transfer_target_account = get_selected_transfer_target(request, active_account, category)
 
             if cost <= 0:
@@ -704,7 +704,6 @@ class AddExpenseView(View):
                 transfer_target_account=transfer_target_account,
             )
 
-            recalculate_monthly_record(monthly_record)
             sync_shared_account_transfer(expense)
 
             messages.success(request, 'Wydatek został dodany pomyślnie!')
@@ -745,7 +744,7 @@ class EditExpenseView(View):
             expense.title = request.POST.get('title')
             expense.category = request.POST.get('category')
             expense.store = request.POST.get('store', '')
-            expense.cost = parse_decimal(request.POST.get('cost'))
+            expense.cost = parse_decimal(request.POST.get('cost')).quantize(CENT)
             expense.transfer_target_account = get_selected_transfer_target(request, active_account, expense.category)
 
             if expense.cost <= 0:
@@ -761,11 +760,6 @@ class EditExpenseView(View):
                 )
                 expense.month = new_monthly
             expense.save()
-
-            months_to_recalc = {expense.month, old_monthly}
-            for monthly in months_to_recalc:
-                recalculate_monthly_record(monthly)
-
             sync_shared_account_transfer(expense)
 
             messages.success(request, 'Wydatek został zaktualizowany!')
@@ -790,16 +784,9 @@ class DeleteExpenseView(View):
     def post(self, request, expense_id):
         active_account = get_active_finance_account(request)
         expense = get_object_or_404(Daily, id=expense_id, account=active_account)
-        monthly_record = expense.month
-        linked_income = getattr(expense, 'linked_shared_income', None)
-        target_month = linked_income.month if linked_income else None
         expense_title = expense.title
         expense.delete()
 
-        recalculate_monthly_record(monthly_record)
-        if target_month:
-            recalculate_monthly_record(target_month)
-
         messages.success(request, f'Wydatek "{expense_title}" został usunięty!')
         return redirect('finance:expense_list')
 
@@ -868,7 +855,7 @@ class AddIncomeView(View):
         try:
             date_value = request.POST.get('date')
             title = request.POST.get('title')
-            amount = parse_decimal(request.POST.get('amount'))
+            amount = parse_decimal(request.POST.get('amount')).quantize(CENT)
             source = request.POST.get('source')
             if amount <= 0:
                 raise ValueError('Kwota musi być większa od 0')
@@ -891,7 +878,6 @@ class AddIncomeView(View):
                 month=monthly_record,
             )
 
-            recalculate_monthly_record(monthly_record)
             messages.success(request, f'Przychód "{title}" ({amount} zł) został dodany!')
             return redirect('finance:income_list')
         except Exception as exc:
@@ -932,7 +918,7 @@ class EditIncomeView(View):
             income.date = parse_date_input(request.POST.get('date'))
             income.title = request.POST.get('title')
             income.source = request.POST.get('source')
-            income.amount = parse_decimal(request.POST.get('amount'))
+            income.amount = parse_decimal(request.POST.get('amount')).quantize(CENT)
             if income.amount <= 0:
                 raise ValueError('Kwota musi być większa od 0')
 
@@ -947,9 +933,6 @@ class EditIncomeView(View):
                 income.month = new_monthly
             income.save()
 
-            for monthly in {income.month, old_monthly}:
-                recalculate_monthly_record(monthly)
-
             messages.success(request, 'Przychód został zaktualizowany!')
             return redirect('finance:income_list')
         except Exception as exc:
@@ -967,10 +950,8 @@ class DeleteIncomeView(View):
             messages.warning(request, 'Ten przychód jest zasileniem konta wspólnego. Usuń lub edytuj wydatek źródłowy.')
             return redirect('finance:income_list')
 
-        monthly_record = income.month
         income_title = income.title
         income.delete()
-        recalculate_monthly_record(monthly_record)
 
         messages.success(request, f'Przychód "{income_title}" został usunięty!')
         return redirect('finance:income_list')
@@ -980,7 +961,12 @@ class DeleteIncomeView(View):
 class ReportsView(View):
     def get(self, request):
         active_account = get_active_finance_account(request)
-        monthly_records = Monthly.objects.filter(account=active_account).order_by('-date')[:6]
+        max_months = getattr(settings, 'REPORT_MAX_MONTHS', DEFAULT_REPORT_MAX_MONTHS)
+        try:
+            report_months = min(max(int(request.GET.get('months', DEFAULT_REPORT_MONTHS)), 1), max_months)
+        except ValueError:
+            report_months = DEFAULT_REPORT_MONTHS
+        monthly_records = monthly_report(active_account, report_months)
 
         months_labels = []
         income_data = []
@@ -989,32 +975,26 @@ class ReportsView(View):
         monthly_balance = []
 
         for record in reversed(monthly_records):
-            record.investment_total = (
-                Daily.objects.filter(account=active_account, month=record, category=INVESTMENT_CATEGORY)
-                .aggregate(Sum('cost'))['cost__sum'] or 0
-            )
-            record.spending_total = record.total_expense - record.investment_total
             months_labels.append(record.date.strftime('%B %Y'))
             income_data.append(float(record.total_income))
             expense_data.append(float(record.spending_total))
             investment_data.append(float(record.investment_total))
-            monthly_balance.append(float(record.total_income - record.total_expense))
-            record.monthly_balance = record.total_income - record.total_expense
-
-        total_income_all = Monthly.objects.filter(account=active_account).aggregate(Sum('total_income'))['total_income__sum'] or 0
-        total_expense_all = Monthly.objects.filter(account=active_account).aggregate(Sum('total_expense'))['total_expense__sum'] or 0
-        total_investment_all = (
-            Daily.objects.filter(account=active_account, category=INVESTMENT_CATEGORY)
-            .aggregate(Sum('cost'))['cost__sum'] or 0
+            monthly_balance.append(float(record.monthly_balance))
+
+        totals_all = Monthly.objects.filter(account=active_account).aggregate(
+            income=Sum('total_income'),
+            expense=Sum('total_expense'),
         )
+        total_income_all = totals_all['income'] or 0
+        total_expense_all = totals_all['expense'] or 0
+        category_totals = account_category_totals(active_account)
+        total_investment_all = next((total for category, total in category_totals if category == INVESTMENT_CATEGORY), 0)
         total_spending_all = total_expense_all - total_investment_all
-        top_categories = (
-            Daily.objects.filter(account=active_account)
-            .exclude(category=INVESTMENT_CATEGORY)
-            .values('category')
-            .annotate(total=Sum('cost'))
-            .order_by('-total')[:5]
-        )
+        top_categories = [
+            {'category': category, 'total': total}
+            for category, total in category_totals
+            if category != INVESTMENT_CATEGORY
+        ][:5]
 
         context = {
             'monthly_records': monthly_records,
@@ -1029,6 +1009,8 @@ class ReportsView(View):
             'total_expense_all': total_expense_all,
             'balance_all': total_income_all - total_expense_all,
             'top_categories': top_categories,
+            'report_months': report_months,
+            'report_month_choices': sorted({months for months in REPORT_MONTH_CHOICES if months <= max_months} | {report_months}),
         }
         return render(request, 'finance/reports.html', context)
 
@@ -1149,7 +1131,7 @@ class DailyRecordAPI(APIView):
                 ).first()
                 if transfer_target_account is None:
                     raise ValueError('Wybrano przelew na konto wspólne bez poprawnego konta docelowego.')
-            cost = parse_decimal(data['cost'])
+            cost = parse_decimal(data['cost']).quantize(CENT)
             if cost <= 0:
                 raise ValueError('Kwota musi być większa od 0')
 
@@ -1171,7 +1153,6 @@ class DailyRecordAPI(APIView):
                 transfer_target_account=transfer_target_account,
             )
 
-            recalculate_monthly_record(monthly_record)
             sync_shared_account_transfer(daily_record)
 
             return Response({'status': 'success', 'id': daily_record.id})
@@ -1179,6 +1160,26 @@ class DailyRecordAPI(APIView):
             return Response({'status': 'error', 'message': str(exc)}, status=400)
 
 
+class BrokerageHistoryAPI(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            end = parse_date_input(request.query_params['end']) if 'end' in request.query_params else timezone.localdate()
+            if 'start' in request.query_params:
+                start = parse_date_input(request.query_params['start'])
+            else:
+                start = end - timedelta(days=DEFAULT_HISTORY_DAYS)
+            max_days = getattr(settings, 'PORTFOLIO_HISTORY_MAX_DAYS', DEFAULT_HISTORY_MAX_DAYS)
+            if start > end:
+                raise ValueError('Data początkowa musi być wcześniejsza niż końcowa')
+            if (end - start).days > max_days:
+                raise ValueError(f'Zakres nie może przekraczać {max_days} dni')
+        except ValueError as exc:
+            return Response({'status': 'error', 'message': str(exc)}, status=400)
+        return Response(get_portfolio_history(request.user, start, end))
+
+
 class MonthlyRecordAPI(APIView):
     permission_classes = [IsAuthenticated]
 